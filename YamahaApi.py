@@ -0,0 +1,165 @@
+from YamahaRoutes import RouteTable, ZONES, to_boolean, one_of, optional
+from YamahaTuner import switch_preset
+from YamahaNetusb import YamahaNetusb
+
+
+ROUTES = RouteTable()
+
+
+def set_playback(yamaha_input, playback: str):
+    assert playback in ("play", "stop", "pause", "next", "previous",
+                        "fast_reverse_start", "fast_reverse_end",
+                        "fast_forward_start", "fast_forward_end")
+
+    if playback == "play":
+        yamaha_input.play()
+    elif playback == "stop":
+        yamaha_input.stop()
+    elif playback == "pause":
+        yamaha_input.pause()
+    elif playback == "next":
+        yamaha_input.next_track()
+    elif playback == "previous":
+        yamaha_input.previous_track()
+    elif playback == "fast_reverse_start":
+        yamaha_input.fast_reverse_start()
+    elif playback == "fast_reverse_end":
+        yamaha_input.fast_reverse_end()
+    elif playback == "fast_forward_start":
+        yamaha_input.fast_forward_start()
+    elif playback == "fast_forward_end":
+        yamaha_input.fast_forward_end()
+
+
+def set_list_control(netusb: YamahaNetusb, type_: str, index: int):
+    if type_ == "return":
+        return
+
+    assert index is not None, "Missing query parameter 'index'"
+    if type_ == "select":
+        netusb.select_track_index(index)
+    elif type_ == "play":
+        netusb.play_track_index(index)
+
+
+# обратная связь
+
+
+@ROUTES.route("getFeatures", senders=("system",), feedback=True)
+def get_features(system, sender):
+    return system.features_response()
+
+
+@ROUTES.route("getStatus", senders=ZONES, feedback=True,
+              watch=lambda system, sender: system.get_zone(sender))
+def get_status(system, sender):
+    return system.status_response(sender)
+
+
+@ROUTES.route("getPlayInfo", senders=("netusb", "tuner", "cd"), feedback=True,
+              watch=lambda system, sender: system.get_input(sender))
+def get_play_info(system, sender):
+    return system.play_info_response(sender)
+
+
+@ROUTES.route("getListInfo", senders=("netusb",), params={"input": str, "index": int, "size": int}, feedback=True,
+              watch=lambda system, sender: system.netusb())
+def get_list_info(system, sender, input, index, size):
+    return system.list_info_response(index_from=index, chunk_size=size)
+
+
+# команды зон
+
+
+@ROUTES.route("setInput", senders=ZONES, params={"input": str})
+def set_input(system, sender, input):
+    system.set_input(zone=sender, input=input)
+
+
+@ROUTES.route("setMute", senders=ZONES, params={"enable": to_boolean})
+def set_mute(system, sender, enable):
+    system.get_zone(sender).mute = enable
+
+
+@ROUTES.route("setVolume", senders=ZONES, params={"volume": int})
+def set_volume(system, sender, volume):
+    system.get_zone(sender).volume = volume
+
+
+@ROUTES.route("setPower", senders=ZONES, params={"power": str})
+def set_power(system, sender, power):
+    system.get_zone(sender).set_power(power)
+
+
+@ROUTES.route("setSoundProgram", senders=ZONES, params={"program": str})
+def set_sound_program(system, sender, program):
+    system.get_zone(sender).set_sound_program(program)
+
+
+# команды источников
+
+
+@ROUTES.route("toggleRepeat", senders=("netusb", "cd"))
+def toggle_repeat(system, sender):
+    system.get_input(sender).toggle_repeat()
+
+
+@ROUTES.route("toggleShuffle", senders=("netusb", "cd"))
+def toggle_shuffle(system, sender):
+    system.get_input(sender).toggle_shuffle()
+
+
+@ROUTES.route("setPlayback", senders=("netusb", "cd"), params={"playback": str, "num": optional(int)})
+def set_playback_command(system, sender, playback, num):
+    if playback == "track_select":
+        assert sender == "cd", "Wrong sender, cd expected"
+        assert num is not None, "Missing query parameter 'num'"
+        system.cd().set_track_num(num)
+    else:
+        set_playback(system.get_input(sender), playback)
+
+
+@ROUTES.route("switchPreset", senders=("tuner",), params={"dir": str})
+def switch_preset_command(system, sender, dir):
+    switch_preset(system.tuner(), dir)
+
+
+@ROUTES.route("setDabService", senders=("tuner",), params={"dir": one_of("previous", "next")})
+def set_dab_service(system, sender, dir):
+    if dir == "previous":
+        system.tuner().prev_dab()
+    elif dir == "next":
+        system.tuner().next_dab()
+
+
+@ROUTES.route("storePreset", senders=("tuner", "netusb"), params={"num": int})
+def store_preset(system, sender, num):
+    system.get_input(sender).store_preset(num)
+
+
+@ROUTES.route("setBand", senders=("tuner",), params={"band": str})
+def set_band(system, sender, band):
+    system.tuner().set_band(band)
+
+
+@ROUTES.route("setFreq", senders=("tuner",),
+              params={"band": one_of("am", "fm"), "tuning": one_of("direct"), "num": int})
+def set_freq(system, sender, band, tuning, num):
+    system.tuner().set_frequency(num)
+
+
+@ROUTES.route("recallPreset", senders=("tuner", "netusb"),
+              params={"zone": str, "num": int, "band": optional(str)})
+def recall_preset(system, sender, zone, num, band):
+    zone = system.get_zone(zone)
+    if sender == "tuner":
+        assert band is not None, "Missing query parameter 'band'"
+        system.tuner().recall_preset(zone=zone, band=band, num=num)
+    elif sender == "netusb":
+        system.netusb().recall_preset(zone=zone, num=num)
+
+
+@ROUTES.route("setListControl", senders=("netusb",),
+              params={"type": one_of("select", "play", "return"), "index": optional(int)})
+def set_list_control_command(system, sender, type, index):
+    set_list_control(netusb=system.netusb(), type_=type, index=index)
@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.parse
+
+from YamahaApi import ROUTES
+from YamahaSystem import YamahaSystem
+
+
+# коды ответа MusicCast
+RESPONSE_OK = 0
+RESPONSE_INVALID_REQUEST = 3
+RESPONSE_INVALID_PARAMETER = 4
+RESPONSE_GUARDED = 5
+
+MAX_BATCH_OPERATIONS = 256
+
+
+def to_query_value(value):
+    # значения параметров из JSON приводятся к виду, в котором они приходят в строке запроса
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+class BatchOperation:
+    def __init__(self, route, sender: str, params: dict):
+        self.route = route
+        self.sender = sender
+        self.params = params
+
+
+def parse_batch(routes, version: str, body: bytes):
+    # {"operations": [{"sender": "main", "action": "setVolume", "params": {"volume": 30}}, ...]}
+    # возвращает (операции, None) или (None, результаты с ошибками), если хотя бы одна операция неверна
+    request = json.loads(body)
+    assert isinstance(request, dict) and isinstance(request.get("operations"), list), "Missing 'operations' list"
+    items = request["operations"]
+    assert 0 < len(items) <= MAX_BATCH_OPERATIONS, f"Batch must contain from 1 to {MAX_BATCH_OPERATIONS} operations"
+
+    operations = []
+    results = []
+    for item in items:
+        try:
+            assert isinstance(item, dict), "Operation must be an object"
+            params = item.get("params", {})
+            assert isinstance(params, dict), "Operation 'params' must be an object"
+            route = routes.find(version, str(item.get("sender")), str(item.get("action")))
+        except AssertionError as e:
+            results.append({"response_code": RESPONSE_INVALID_REQUEST, "error": str(e)})
+            continue
+        if route is None:
+            results.append({"response_code": RESPONSE_INVALID_REQUEST,
+                            "error": f"Unknown action '{item.get('action')}'"})
+            continue
+        if route.feedback:
+            results.append({"response_code": RESPONSE_INVALID_REQUEST,
+                            "error": f"'{route.action}' is not a command, only commands can be batched"})
+            continue
+
+        query = urllib.parse.urlencode({name: to_query_value(value) for name, value in params.items()})
+        try:
+            operations.append(BatchOperation(route, str(item["sender"]), route.parse_params(query)))
+            results.append({"response_code": RESPONSE_OK})
+        except (AssertionError, ValueError) as e:
+            results.append({"response_code": RESPONSE_INVALID_PARAMETER, "error": str(e)})
+
+    if len(operations) != len(items):
+        return None, batch_failure(results)
+    return operations, None
+
+
+def batch_failure(results: list):
+    # при ошибке ничего не применяется: у остальных операций код "guarded"
+    failed_index = next(i for i, result in enumerate(results) if result["response_code"] != RESPONSE_OK)
+    for result in results:
+        if result["response_code"] == RESPONSE_OK:
+            result["response_code"] = RESPONSE_GUARDED
+    return {"response_code": results[failed_index]["response_code"], "failed_index": failed_index, "results": results}
+
+
+def run_batch(system, operations: list):
+    # все операции выполняются под блокировкой писателя как один пакет (YamahaSystem.begin_batch):
+    # чтения через system.read() видят состояние либо до пакета, либо после, события и журнал
+    # получают изменения только после успешного завершения.
+    # Если операция завершилась ошибкой - состояние ресивера откатывается к снимку перед пакетом
+    with system.writer():
+        checkpoint = system.checkpoint()
+        system.begin_batch()
+        committed = False
+        try:
+            results = []
+            for operation in operations:
+                try:
+                    operation.route.invoke(system, operation.sender, operation.params)
+                except Exception as e:
+                    system.restore(checkpoint)
+                    results.append({"response_code": RESPONSE_INVALID_PARAMETER, "error": str(e)})
+                    results += [{"response_code": RESPONSE_OK} for _ in operations[len(results):]]
+                    return batch_failure(results)
+                results.append({"response_code": RESPONSE_OK})
+            committed = True
+        finally:
+            system.end_batch(committed)
+    return {"response_code": RESPONSE_OK, "results": results}
+
+
+class TestRunBatch(unittest.TestCase):
+    def setUp(self):
+        self._routes = ROUTES
+        self._dir = tempfile.mkdtemp()
+        config_file = os.path.join(self._dir, "config.json")
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"), config_file)
+        self._system = YamahaSystem.load(config_file)
+        # события и записи журнала перехватываются вместо отправки
+        self._events = []
+        self._journal = []
+        self._system.events().notify = lambda section, event: self._events.append((section, event))
+        self._system.journal().append = lambda key, value: self._journal.append((key, value))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _operation(self, action: str, **params):
+        return BatchOperation(self._routes.find("v1", "main", action), "main", params)
+
+    def _read_volume(self):
+        return self._system.read(lambda: self._system.get_zone("main").volume)
+
+    def test_rollback_is_invisible(self):
+        volume = self._read_volume()
+        readers = []
+
+        class ReadDuringBatch:
+            # чтение, начатое посреди пакета, ждёт его завершения
+            @staticmethod
+            def invoke(system, sender, params):
+                reader = threading.Thread(target=lambda: readers.append(self._read_volume()))
+                reader.start()
+                reader.join(0.1)
+                readers.append(reader.is_alive())
+                readers.append(reader)
+
+        operations = [self._operation("setVolume", volume=volume + 7),
+                      BatchOperation(ReadDuringBatch(), "main", {}),
+                      self._operation("setSoundProgram", program="no such program")]
+        result = run_batch(self._system, operations)
+        readers[1].join()
+
+        self.assertEqual(RESPONSE_INVALID_PARAMETER, result["response_code"])
+        self.assertEqual(2, result["failed_index"])
+        self.assertTrue(readers[0])
+        self.assertEqual(volume, readers[2])
+        self.assertEqual(volume, self._read_volume())
+        self.assertEqual([], self._events)
+        self.assertEqual([], self._journal)
+
+    def test_commit_publishes_events(self):
+        volume = self._read_volume()
+        result = run_batch(self._system, [self._operation("setVolume", volume=volume + 1),
+                                          self._operation("setVolume", volume=volume + 2)])
+        self.assertEqual(RESPONSE_OK, result["response_code"])
+        self.assertEqual(volume + 2, self._read_volume())
+        self.assertEqual(2, len(self._events))
+        self.assertEqual(volume + 2, self._journal[-1][1]["volume"])
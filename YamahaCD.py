@@ -1,12 +1,24 @@
 from YamahaPlaylist import YamahaPlaylist
+from YamahaState import YamahaState
 from YamahaTrack import YamahaTrack
 
 
-class YamahaCD:
+class YamahaCD(YamahaState):
     def __init__(self, playlist: YamahaPlaylist):
+        super().__init__()
         self._repeat_mode = "off"   # "off" / "one" / "all" / "folder" / "a-b"
         self._shuffle_mode = "off"  # "off" / "on" / "folder" / "program"
         self._playlist = playlist
+        self._playlist.add_observer(lambda changes: self._touch())
+
+    def state_key(self):
+        return self.version(), self._playlist.state_key()
+
+    def transition_token(self):
+        return f"{self.version()}-{self._playlist.transition_token()}"
+
+    def next_transition_delay(self):
+        return self._playlist.next_transition_delay()
 
     def play(self):
         self._playlist.play()
@@ -33,6 +45,7 @@ class YamahaCD:
             self._playlist.repeat_one()
         else:
             self._playlist.repeat_all()
+        self._touch()
 
     def toggle_shuffle(self):
         next_shuffle_mode = {
@@ -47,6 +60,7 @@ class YamahaCD:
             self._playlist.shuffle_off()
         else:
             self._playlist.shuffle_on()
+        self._touch()
 
     def set_track_num(self, num: int):
         # переводим номер [ 1..len(tracks) ] в индекс [ 0..len(tracks) )
@@ -71,19 +85,19 @@ class YamahaCD:
         self._playlist.fast_forward_end()
 
     def play_info(self):
-        track_index, play_time = self._playlist.sync()
-        current_track = self._playlist.current_track()
+        position = self._playlist.position()
+        current_track = self._playlist.track_at(position)
         return {
-            "playback": self._playlist.play_state(),
+            "playback": position.play_state.name,
             "repeat": self._repeat_mode,
             "shuffle": self._shuffle_mode,
-            "play_time": play_time,
+            "play_time": position.play_time_sec,
             "total_time": current_track.total_time,
             "album": current_track.album,
             "artist": current_track.artist,
             "track": current_track.track,
             "disc_time": self._playlist.summary_time(),
-            "track_number": track_index + 1,
+            "track_number": position.track_index + 1,
             "total_tracks": self._playlist.count_tracks()
         }
 
@@ -0,0 +1,249 @@
+import gzip
+import hashlib
+import json
+import threading
+import unittest
+import zlib
+
+from collections import OrderedDict
+
+
+def encode_json(json_answer: dict, compact: bool = False):
+    # ответ может сам задать код (например пакет команд с ошибкой), по умолчанию - 0
+    json_answer = dict(json_answer)
+    json_answer.setdefault("response_code", 0)
+    if compact:
+        return json.dumps(json_answer, separators=(",", ":")).encode('utf-8')
+    return json.dumps(json_answer, indent=4).encode('utf-8')
+
+
+# поддерживаемые Content-Encoding в порядке предпочтения
+CONTENT_CODINGS = ("gzip", "deflate")
+
+
+def compress(body: bytes, coding: str):
+    # mtime=0: одинаковое тело всегда сжимается в одинаковые байты
+    if coding == "gzip":
+        return gzip.compress(body, mtime=0)
+    assert coding == "deflate", f"Unsupported content coding '{coding}'"
+    return zlib.compress(body)
+
+
+def accepted_coding(accept_encoding: str):
+    # лучшая из CONTENT_CODINGS по заголовку Accept-Encoding ("gzip;q=0.5, deflate" и т.п.), None - без сжатия
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in CONTENT_CODINGS:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def body_etag(body: bytes):
+    # строгий ETag по содержимому: меняется только вместе с видимым состоянием
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+class EncodedBody(bytes):
+    # закодированный ответ вместе с ETag; ETag вычисляется один раз - когда ответ кодируется
+    # для новой версии состояния, и дальше отдаётся из кэша вместе с телом
+    def __new__(cls, body: bytes, etag: str = None):
+        encoded = super().__new__(cls, body)
+        encoded.etag = etag if etag is not None else body_etag(body)
+        encoded._compressed = {}
+        return encoded
+
+    def compressed(self, coding: str):
+        # сжатый вариант хранится вместе с телом: ответ из кэша сжимается один раз на версию состояния.
+        # У сжатого варианта свой строгий ETag
+        body = self._compressed.get(coding)
+        if body is None:
+            body = self._compressed[coding] = EncodedBody(compress(self, coding), self.etag[:-1] + "-" + coding + '"')
+        return body
+
+
+class ResponseCache:
+    # по одному закодированному ответу на каждое имя - ключ (версия состояния) проверяется при чтении
+    def __init__(self, compact: bool = False):
+        self._compact = compact
+        self._entries = {}
+
+    def encode(self, json_answer: dict):
+        return EncodedBody(encode_json(json_answer, self._compact))
+
+    def get(self, name, key, build):
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == key:
+            return entry[1]
+
+        body = self.encode(build())
+        self._entries[name] = (key, body)
+        return body
+
+
+class EncodedPage:
+    # закодированная страница, в которую при каждом запросе подставляется одно изменчивое поле
+    def __init__(self, head: bytes, tail: bytes, etag: str):
+        self._head = head
+        self._tail = tail
+        self._etag = etag
+        self._last = (None, None)
+
+    def render(self, value: int):
+        # ETag страницы дополняется значением изменчивого поля - без хэширования тела на каждый запрос.
+        # Последний результат запоминается: пока поле не меняется, отдаётся то же тело с его сжатыми вариантами
+        last_value, body = self._last
+        if last_value == value:
+            return body
+        text = str(value)
+        body = EncodedBody(self._head + text.encode('utf-8') + self._tail, self._etag[:-1] + "-" + text + '"')
+        self._last = (value, body)
+        return body
+
+
+class PageCache:
+    # ограниченный LRU-кэш закодированных страниц (например, для getListInfo)
+    VOLATILE_PLACEHOLDER = "\0volatile\0"
+
+    def __init__(self, responses: ResponseCache, max_pages: int = 256):
+        assert max_pages > 0, "Page cache size must be positive"
+        self._responses = responses
+        self._max_pages = max_pages
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build, volatile_field: str):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+                return page
+
+        json_answer = dict(build())
+        json_answer[volatile_field] = PageCache.VOLATILE_PLACEHOLDER
+        body = self._responses.encode(json_answer)
+        placeholder = json.dumps(PageCache.VOLATILE_PLACEHOLDER).encode('utf-8')
+        head, _, tail = body.partition(placeholder)
+        page = EncodedPage(head, tail, body.etag)
+
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self._max_pages:
+                self._pages.popitem(last=False)
+        return page
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self._responses = ResponseCache(compact=True)
+        self._builds = 0
+
+    def _get(self, key, volume: int):
+        def build():
+            self._builds += 1
+            return {"volume": volume}
+
+        return self._responses.get(("getStatus", "main"), key, build)
+
+    def test_same_version_is_served_from_cache(self):
+        body = self._get(1, 10)
+        self.assertIs(body, self._get(1, 20))
+        self.assertEqual(1, self._builds)
+        self.assertEqual(b'{"volume":10,"response_code":0}', bytes(body))
+
+    def test_stale_entry_is_not_served(self):
+        old = self._get(1, 10)
+        new = self._get(2, 20)
+        self.assertEqual(2, self._builds)
+        self.assertEqual(b'{"volume":20,"response_code":0}', bytes(new))
+        self.assertNotEqual(old.etag, new.etag)
+        # возврат к прежней версии тоже кодирует ответ заново: хранится только последняя версия
+        self.assertEqual(b'{"volume":10,"response_code":0}', bytes(self._get(1, 10)))
+        self.assertEqual(3, self._builds)
+
+    def test_names_are_cached_separately(self):
+        self._get(1, 10)
+        self._responses.get(("getStatus", "zone2"), 1, lambda: {"volume": 30})
+        self.assertIs(self._get(1, 10), self._get(1, 10))
+        self.assertEqual(1, self._builds)
+
+
+class TestPageCache(unittest.TestCase):
+    def _list_info(self, playing_index: int):
+        return {
+            "input": "usb",
+            "menu_layer": 1,
+            "max_line": 3,
+            "index": 0,
+            "playing_index": playing_index,
+            "menu_name": "Playlist",
+            "list_info": [{"text": "Track \"1\"", "attribute": 125}, {"text": "Трек 2", "attribute": 125}]
+        }
+
+    def _check_render(self, compact: bool):
+        responses = ResponseCache(compact=compact)
+        pages = PageCache(responses)
+        page = pages.get("page", lambda: self._list_info(0), "playing_index")
+        for playing_index in (0, 1, 2, -1, 1, 12345):
+            body = page.render(playing_index)
+            self.assertEqual(encode_json(self._list_info(playing_index), compact), bytes(body))
+            self.assertIs(page, pages.get("page", lambda: self.fail("page is built again"), "playing_index"))
+
+    def test_render_equals_encode_json(self):
+        self._check_render(compact=False)
+
+    def test_compact_render_equals_encode_json(self):
+        self._check_render(compact=True)
+
+    def test_render_etag_depends_on_value(self):
+        page = PageCache(ResponseCache()).get("page", lambda: self._list_info(0), "playing_index")
+        self.assertIs(page.render(1), page.render(1))
+        self.assertNotEqual(page.render(1).etag, page.render(2).etag)
+
+
+class TestAcceptedCoding(unittest.TestCase):
+    def test_no_header(self):
+        self.assertIsNone(accepted_coding(None))
+        self.assertIsNone(accepted_coding(""))
+        self.assertIsNone(accepted_coding("identity, br"))
+
+    def test_preference(self):
+        self.assertEqual("gzip", accepted_coding("gzip, deflate"))
+        self.assertEqual("gzip", accepted_coding("deflate, gzip"))
+        self.assertEqual("deflate", accepted_coding("deflate"))
+        self.assertEqual("deflate", accepted_coding("gzip;q=0.5, deflate"))
+        self.assertEqual("gzip", accepted_coding("GZIP;q=0.8, deflate;q=0.3"))
+
+    def test_zero_weight(self):
+        self.assertIsNone(accepted_coding("gzip;q=0"))
+        self.assertEqual("deflate", accepted_coding("gzip;q=0, deflate"))
+        self.assertIsNone(accepted_coding("gzip;q=bad"))
+
+    def test_wildcard(self):
+        self.assertEqual("gzip", accepted_coding("*"))
+        self.assertEqual("deflate", accepted_coding("gzip;q=0, *"))
+        self.assertEqual("gzip", accepted_coding("*;q=0.1, gzip;q=0.2"))
+        self.assertIsNone(accepted_coding("*;q=0"))
+
+    def test_compressed_body(self):
+        body = EncodedBody(b"{}" * 100)
+        for coding, decompress in (("gzip", gzip.decompress), ("deflate", zlib.decompress)):
+            compressed = body.compressed(coding)
+            self.assertIs(compressed, body.compressed(coding))
+            self.assertEqual(bytes(body), decompress(compressed))
+            self.assertNotEqual(body.etag, compressed.etag)
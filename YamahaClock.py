@@ -0,0 +1,188 @@
+import threading
+import time
+import unittest
+
+from unittest import mock
+
+
+# Часы эмулятора: от них считаются позиции во всех плейлистах и сроки таймеров.
+# Часы вызываются как функция времени (clock() -> секунды, как time.time()) и передаются в плейлисты
+# вместо whats_a_time. Один экземпляр часов общий для всех ресиверов процесса.
+#   RealClock        - реальное время
+#   AcceleratedClock - время идёт в rate раз быстрее реального: сутки воспроизведения за минуты
+#   ManualClock      - время стоит, пока его не сдвинут через /admin/clock/advance
+class RealClock:
+    kind = "real"
+
+    def __init__(self):
+        self._observers = []
+
+    def __call__(self):
+        return time.time()
+
+    def rate(self):
+        return 1.0
+
+    def real_delay(self, seconds: float):
+        # через сколько реальных секунд на часах пройдёт seconds; None - само по себе время не сдвинется
+        return seconds
+
+    def add_observer(self, callback):
+        # callback() вызывается после скачка времени или смены скорости - сроки таймеров нужно пересчитать
+        self._observers.append(callback)
+
+    def _notify(self):
+        for callback in list(self._observers):
+            callback()
+
+    def status(self):
+        return {"kind": self.kind, "time": self(), "rate": self.rate()}
+
+
+class AcceleratedClock(RealClock):
+    kind = "accelerated"
+
+    def __init__(self, rate: float, start: float = None):
+        assert rate > 0, "Clock rate must be positive"
+        super().__init__()
+        self._lock = threading.Lock()
+        self._rate = rate
+        self._origin_real = time.monotonic()
+        self._origin = time.time() if start is None else start
+
+    def __call__(self):
+        with self._lock:
+            return self._origin + (time.monotonic() - self._origin_real) * self._rate
+
+    def rate(self):
+        return self._rate
+
+    def real_delay(self, seconds: float):
+        return seconds / self._rate
+
+    def set_rate(self, rate: float):
+        # время не прыгает: новая скорость действует от текущего момента
+        assert rate > 0, "Clock rate must be positive"
+        with self._lock:
+            now_real = time.monotonic()
+            self._origin += (now_real - self._origin_real) * self._rate
+            self._origin_real = now_real
+            self._rate = rate
+        self._notify()
+
+    def advance(self, seconds: float):
+        assert seconds >= 0, "Clock can only go forward"
+        with self._lock:
+            self._origin += seconds
+        self._notify()
+
+
+class ManualClock(RealClock):
+    kind = "manual"
+
+    def __init__(self, start: float = None):
+        super().__init__()
+        self._lock = threading.Lock()
+        self._now = time.time() if start is None else start
+
+    def __call__(self):
+        return self._now
+
+    def rate(self):
+        return 0.0
+
+    def real_delay(self, seconds: float):
+        return None
+
+    def advance(self, seconds: float):
+        # назад часы не идут: плейлисты считают позицию от момента последнего изменения
+        assert seconds >= 0, "Clock can only go forward"
+        with self._lock:
+            self._now += seconds
+        self._notify()
+
+
+def parse_clock(spec: str, start: float = None):
+    # "real", "manual" или "<rate>x" (например "60x" - минута за секунду)
+    if spec == "real":
+        assert start is None, "Start time is not supported by the real clock"
+        return RealClock()
+    if spec == "manual":
+        return ManualClock(start)
+    assert spec.endswith("x"), f"Wrong clock '{spec}', real or manual or <rate>x expected"
+    return AcceleratedClock(float(spec[:-1]), start)
+
+
+class TestManualClock(unittest.TestCase):
+    def test_stands_still_until_advanced(self):
+        clock = ManualClock(1000.0)
+        self.assertEqual(1000.0, clock())
+        self.assertEqual(0.0, clock.rate())
+        self.assertIsNone(clock.real_delay(10))
+        clock.advance(90.5)
+        self.assertEqual(1090.5, clock())
+
+    def test_only_goes_forward(self):
+        clock = ManualClock(1000.0)
+        with self.assertRaises(AssertionError):
+            clock.advance(-1)
+        self.assertEqual(1000.0, clock())
+
+    def test_observers_are_notified(self):
+        clock = ManualClock(1000.0)
+        calls = []
+        clock.add_observer(lambda: calls.append(clock()))
+        clock.advance(5)
+        clock.advance(0)
+        self.assertEqual([1005.0, 1005.0], calls)
+
+
+class TestAcceleratedClock(unittest.TestCase):
+    def setUp(self):
+        # реальное время идёт только по команде
+        self._real = 500.0
+        patcher = mock.patch(__name__ + ".time", mock.Mock(monotonic=lambda: self._real, time=time.time))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_runs_faster(self):
+        clock = AcceleratedClock(60, start=1000.0)
+        self.assertEqual(1000.0, clock())
+        self._real += 2
+        self.assertEqual(1120.0, clock())
+        self.assertEqual(60, clock.rate())
+        self.assertEqual(0.5, clock.real_delay(30))
+
+    def test_set_rate_keeps_time(self):
+        clock = AcceleratedClock(10, start=1000.0)
+        calls = []
+        clock.add_observer(lambda: calls.append(clock()))
+        self._real += 1
+        clock.set_rate(100)
+        self.assertEqual([1010.0], calls)
+        self.assertEqual(1010.0, clock())
+        self._real += 1
+        self.assertEqual(1110.0, clock())
+        with self.assertRaises(AssertionError):
+            clock.set_rate(0)
+
+    def test_advance(self):
+        clock = AcceleratedClock(2, start=1000.0)
+        clock.advance(100)
+        self._real += 1
+        self.assertEqual(1102.0, clock())
+        with self.assertRaises(AssertionError):
+            clock.advance(-1)
+
+
+class TestParseClock(unittest.TestCase):
+    def test_kinds(self):
+        self.assertEqual("real", parse_clock("real").kind)
+        self.assertEqual(1000.0, parse_clock("manual", 1000.0)())
+        clock = parse_clock("60x", 1000.0)
+        self.assertEqual(("accelerated", 60.0), (clock.kind, clock.rate()))
+
+    def test_wrong_spec(self):
+        for spec, start in (("fast", None), ("0x", None), ("real", 1000.0)):
+            with self.assertRaises(AssertionError):
+                parse_clock(spec, start)
@@ -0,0 +1,174 @@
+import hashlib
+import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+
+# Скомпилированный конфиг "<конфиг>.cache" рядом с config.json: разобранный JSON вместе с уже
+# созданными объектами треков, сохранённый pickle. Файл читается одним read(), без разбора JSON
+# и проверки каждого трека. Формат файла - два pickle подряд:
+#   заголовок {"format", "key", "size", "mtime_ns", "sha1", "state"} и скомпилированная неизменяемая часть конфига.
+# Изменяемое состояние (зоны, пресеты) хранится в заголовке отдельно от скомпилированной части:
+# store() перезаписывает конфиг при каждом завершении, меняя только состояние, и обновляет заголовок
+# через refresh_cache() - скомпилированная часть при этом остаётся действительной.
+# Кэш действителен, пока совпадают формат, ключ компиляции (например, art_url_base) и конфиг:
+# сначала сравниваются размер и mtime, при расхождении - sha1 содержимого (конфиг перезаписан без изменений).
+# Устаревший или повреждённый кэш молча пересобирается из JSON.
+# Кэш, как и сам конфиг, считается доверенным файлом: pickle нельзя загружать из чужих источников.
+CACHE_FORMAT = 2
+CACHE_ERRORS = (OSError, pickle.UnpicklingError, EOFError, ValueError, TypeError, AttributeError, ImportError)
+
+
+def cache_path(config_file: str):
+    return config_file + ".cache"
+
+
+def _read_cache(path: str):
+    # заголовок и поток, из которого читается скомпилированный конфиг, если кэш того же формата
+    try:
+        with open(path, "rb") as file:
+            stream = io.BytesIO(file.read())
+        header = pickle.load(stream)
+    except CACHE_ERRORS:
+        return None, None
+    if not isinstance(header, dict) or header.get("format") != CACHE_FORMAT:
+        return None, None
+    return header, stream
+
+
+def _load_body(stream):
+    # у каждого pickle в файле своя таблица ссылок - читаем отдельным вызовом pickle.load()
+    try:
+        return pickle.load(stream)
+    except CACHE_ERRORS:
+        return None
+
+
+def _write_cache(path: str, header: dict, body: bytes):
+    # временный файл + подмена: параллельно запущенные эмуляторы не прочитают наполовину записанный кэш
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            pickle.dump(header, file, pickle.HIGHEST_PROTOCOL)
+            file.write(body)
+        os.replace(temp_path, path)
+    except OSError:
+        # каталог только для чтения - работаем без кэша
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+
+def _is_same_file(header: dict, stat):
+    return header["size"] == stat.st_size and header["mtime_ns"] == stat.st_mtime_ns
+
+
+def load_compiled(config_file: str, key, compile):
+    # compile(содержимое конфига в байтах) -> (скомпилированная часть, состояние),
+    # результат должен сериализоваться pickle. Возвращает ту же пару
+    path = cache_path(config_file)
+    with open(config_file, "rb") as file:
+        stat = os.fstat(file.fileno())
+        header, stream = _read_cache(path)
+        if header is not None and header["key"] != key:
+            header = None
+        if header is not None and _is_same_file(header, stat):
+            compiled = _load_body(stream)
+            if compiled is not None:
+                return compiled, header["state"]
+            header = None
+        content = file.read()
+
+    sha1 = hashlib.sha1(content).hexdigest()
+    compiled = None
+    if header is not None and header["sha1"] == sha1:
+        compiled = _load_body(stream)
+        state = header["state"]
+    if compiled is None:
+        compiled, state = compile(content)
+
+    _write_cache(path, {"format": CACHE_FORMAT, "key": key, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                        "sha1": sha1, "state": state}, pickle.dumps(compiled, pickle.HIGHEST_PROTOCOL))
+    return compiled, state
+
+
+def refresh_cache(config_file: str, previous_stat, content: bytes, state):
+    # конфиг перезаписан целиком (content), но изменилось только состояние: если кэш был действителен
+    # для прежнего файла (previous_stat), скомпилированная часть переносится без перекомпиляции
+    path = cache_path(config_file)
+    header, stream = _read_cache(path)
+    if header is None or not _is_same_file(header, previous_stat):
+        return
+    stat = os.stat(config_file)
+    header.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns, sha1=hashlib.sha1(content).hexdigest(), state=state)
+    _write_cache(path, header, stream.read())
+
+
+class TestLoadCompiled(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._config = os.path.join(self._dir, "config.json")
+        self._compiled = 0
+        self._write({"playlist": ["a", "b"], "zones_info": {"volume": 10}})
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, data: dict):
+        content = json.dumps(data).encode()
+        with open(self._config, "wb") as file:
+            file.write(content)
+        return content
+
+    def _compile(self, content: bytes):
+        self._compiled += 1
+        data = json.loads(content)
+        return data["playlist"], data["zones_info"]
+
+    def _load(self, key=None):
+        return load_compiled(self._config, key, self._compile)
+
+    def test_cache_is_reused(self):
+        self.assertEqual(self._load(), (["a", "b"], {"volume": 10}))
+        self.assertEqual(self._load(), (["a", "b"], {"volume": 10}))
+        self.assertEqual(self._compiled, 1)
+
+    def test_changed_config_is_recompiled(self):
+        self._load()
+        self._write({"playlist": ["a", "b", "c"], "zones_info": {"volume": 10}})
+        self.assertEqual(self._load(), (["a", "b", "c"], {"volume": 10}))
+        self.assertEqual(self._compiled, 2)
+
+    def test_changed_state_is_not_stale(self):
+        # состояние изменено не через store() - кэш не должен вернуть прежнее
+        self._load()
+        self._write({"playlist": ["a", "b"], "zones_info": {"volume": 30, "mute": True}})
+        self.assertEqual(self._load(), (["a", "b"], {"volume": 30, "mute": True}))
+
+    def test_changed_key_is_recompiled(self):
+        self._load("http://a/")
+        self._load("http://b/")
+        self.assertEqual(self._compiled, 2)
+
+    def test_refresh_keeps_compiled_part(self):
+        self._load()
+        previous_stat = os.stat(self._config)
+        content = self._write({"playlist": ["a", "b"], "zones_info": {"volume": 30, "mute": True}})
+        refresh_cache(self._config, previous_stat, content, {"volume": 30, "mute": True})
+        self.assertEqual(self._load(), (["a", "b"], {"volume": 30, "mute": True}))
+        self.assertEqual(self._compiled, 1)
+
+    def test_refresh_of_stale_cache_is_ignored(self):
+        # конфиг изменён после загрузки кэша - обновлять заголовок нельзя
+        self._load()
+        self._write({"playlist": ["c"], "zones_info": {"volume": 10}})
+        previous_stat = os.stat(self._config)
+        content = self._write({"playlist": ["c"], "zones_info": {"volume": 20}})
+        refresh_cache(self._config, previous_stat, content, {"volume": 20})
+        self.assertEqual(self._load(), (["c"], {"volume": 20}))
+        self.assertEqual(self._compiled, 2)
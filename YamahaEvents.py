@@ -0,0 +1,152 @@
+import json
+import socket
+import threading
+import time
+import unittest
+
+
+# имена полей зоны в событиях MusicCast
+ZONE_EVENT_FIELDS = {
+    "input_name": "input",
+    "mute": "mute",
+    "power": "power",
+    "volume": "volume",
+    "sound_program": "sound_program"
+}
+
+
+def zone_event(changes: dict):
+    event = {"status_updated": True}
+    for name, value in changes.items():
+        if name in ZONE_EVENT_FIELDS:
+            event[ZONE_EVENT_FIELDS[name]] = value
+    return event
+
+
+def input_event(changes: dict):
+    return {"play_info_updated": True}
+
+
+class YamahaEvents:
+    # Рассылка UDP-событий как у настоящих ресиверов MusicCast:
+    # клиент, приславший заголовки X-AppName и X-AppPort, получает события на свой адрес и порт,
+    # пока присылает запросы не реже чем раз в SUBSCRIPTION_TIMEOUT_SEC.
+    # Изменения, накопившиеся за FLUSH_INTERVAL_SEC, объединяются в одну датаграмму.
+    # Ошибки отправки передаются в журнал запросов (set_error_log()), без него - не сообщаются.
+    SUBSCRIPTION_TIMEOUT_SEC = 10 * 60
+    FLUSH_INTERVAL_SEC = 0.1
+
+    def __init__(self, subscription_timeout: float = SUBSCRIPTION_TIMEOUT_SEC,
+                 flush_interval: float = FLUSH_INTERVAL_SEC):
+        self._subscription_timeout = subscription_timeout
+        self._flush_interval = flush_interval
+        self._subscribers = {}  # (адрес, порт) -> время последнего запроса
+        self._pending = {}      # зона или источник -> накопленные изменения
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._socket = None
+        self._thread = None
+        self._error_log = None
+
+    def set_error_log(self, error_log):
+        # error_log(сообщение), например RequestLog.error; None - ошибки не сообщаются
+        self._error_log = error_log
+
+    def subscribe(self, address: str, port: int):
+        with self._lock:
+            self._subscribers[(address, port)] = time.monotonic()
+
+    def notify(self, section: str, event: dict):
+        with self._lock:
+            self._pending.setdefault(section, {}).update(event)
+        self._wakeup.set()
+
+    def start(self):
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        self._thread.join()
+        self._socket.close()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            # сбрасываем событие до проверки флага: иначе stop() во время паузы потеряется и поток не завершится
+            self._wakeup.clear()
+            if self._stopped:
+                return
+
+            # даём изменениям накопиться, чтобы отправить их одним пакетом
+            time.sleep(self._flush_interval)
+            self._flush()
+
+    def _flush(self):
+        now = time.monotonic()
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            expired = [key for key, last_seen in self._subscribers.items()
+                       if now - last_seen > self._subscription_timeout]
+            for key in expired:
+                del self._subscribers[key]
+            subscribers = list(self._subscribers.keys())
+
+        if not pending or not subscribers:
+            return
+
+        datagram = json.dumps(pending, separators=(",", ":")).encode('utf-8')
+        for address in subscribers:
+            try:
+                self._socket.sendto(datagram, address)
+            except OSError as e:
+                error_log = self._error_log
+                if error_log is not None:
+                    error_log(f"Event is not sent to {address[0]}:{address[1]}: {e}")
+
+
+class TestYamahaEvents(unittest.TestCase):
+    def setUp(self):
+        # подписчик - UDP-сокет на локальном адресе
+        self._receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(self._receiver.close)
+        self._receiver.bind(("127.0.0.1", 0))
+
+    def _start(self, **options):
+        events = YamahaEvents(**options)
+        events.start()
+        self.addCleanup(events.stop)
+        return events
+
+    def _receive(self, timeout: float):
+        self._receiver.settimeout(timeout)
+        try:
+            return self._receiver.recv(65536)
+        except socket.timeout:
+            return None
+
+    def test_events_are_coalesced(self):
+        events = self._start(flush_interval=0.2)
+        events.subscribe(*self._receiver.getsockname())
+        events.notify("main", zone_event({"volume": 10, "max_volume": 80}))
+        events.notify("main", zone_event({"volume": 20, "mute": True}))
+        events.notify("netusb", input_event({"play_time": 5}))
+        self.assertEqual(b'{"main":{"status_updated":true,"volume":20,"mute":true},'
+                         b'"netusb":{"play_info_updated":true}}', self._receive(5))
+        # все изменения ушли одной датаграммой
+        self.assertIsNone(self._receive(0.5))
+
+    def test_subscription_expires(self):
+        events = self._start(subscription_timeout=0.2, flush_interval=0.01)
+        address = self._receiver.getsockname()
+        events.subscribe(*address)
+        time.sleep(0.3)
+        events.notify("main", zone_event({"power": "on"}))
+        self.assertIsNone(self._receive(0.5))
+        # новый запрос клиента продлевает подписку
+        events.subscribe(*address)
+        events.notify("main", zone_event({"power": "standby"}))
+        self.assertEqual({"main": {"status_updated": True, "power": "standby"}}, json.loads(self._receive(5)))
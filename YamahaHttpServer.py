@@ -0,0 +1,209 @@
+import queue
+import socket
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class TimeoutHTTPServer(HTTPServer):
+    # однопоточный сервер: запросы обрабатываются по одному в потоке serve_forever()
+    def __init__(self, server_address, handler_class, backlog: int = 5, socket_timeout: float = None,
+                 keep_alive_timeout: float = 5.0, max_keep_alive_requests: int = 10000):
+        assert max_keep_alive_requests > 0, "Max keep-alive requests must be positive"
+        # request_queue_size используется в server_activate() как размер очереди accept (listen backlog)
+        self.request_queue_size = backlog
+        self.socket_timeout = socket_timeout
+        # сколько ждать следующий запрос в открытом соединении и сколько запросов обслужить в одном соединении
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_keep_alive_requests = max_keep_alive_requests
+        self._detached = {}  # соединение -> сколько раз обработчик оставил его открытым
+        self._detached_lock = threading.Lock()
+        super().__init__(server_address, handler_class)
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        # таймаут на чтение/запись, чтобы "зависший" клиент не держал обработчик вечно
+        request.settimeout(self.socket_timeout)
+        return request, client_address
+
+    def detach_request(self, request):
+        # обработчик передаёт соединение дальше (долгий опрос): после его завершения сокет не закрывается.
+        # Каждый detach_request() отменяет ровно одно следующее закрытие
+        with self._detached_lock:
+            self._detached[request] = self._detached.get(request, 0) + 1
+
+    def shutdown_request(self, request):
+        with self._detached_lock:
+            count = self._detached.get(request, 0)
+            if count > 1:
+                self._detached[request] = count - 1
+                return
+            if count == 1:
+                del self._detached[request]
+                return
+        super().shutdown_request(request)
+
+    def close_request_now(self, request):
+        # закрытие отсоединённого соединения в обход счётчика detach_request()
+        super().shutdown_request(request)
+
+
+class WorkerPool:
+    # ограниченный пул потоков с ограниченной очередью задач
+    def __init__(self, workers: int, queue_size: int):
+        assert workers > 0, "Workers count must be positive"
+        assert queue_size > 0, "Queue size must be positive"
+        self._tasks = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            task()
+
+    def try_submit(self, task):
+        # не блокируемся: если очередь заполнена - задача отклоняется
+        try:
+            self._tasks.put_nowait(task)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        for _ in self._threads:
+            self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+
+
+SERVICE_UNAVAILABLE = (b"HTTP/1.0 503 Service Unavailable\r\n"
+                       b"Content-Length: 0\r\n"
+                       b"Connection: close\r\n"
+                       b"\r\n")
+
+
+class ThreadPoolHTTPServer(TimeoutHTTPServer):
+    # принятые соединения обрабатываются в потоках пула,
+    # при переполнении очереди клиенту сразу отвечаем 503
+    # (поток пула занят, пока идёт запрос; простаивающие keep-alive соединения обработчик отдаёт в YamahaLongPoll).
+    # Несколько серверов на разных портах могут обслуживаться одним общим пулом.
+    def __init__(self, server_address, handler_class, workers: int = 32, queue_size: int = 64,
+                 backlog: int = 128, socket_timeout: float = 10.0,
+                 keep_alive_timeout: float = 5.0, max_keep_alive_requests: int = 10000, pool: WorkerPool = None):
+        super().__init__(server_address, handler_class, backlog=backlog, socket_timeout=socket_timeout,
+                         keep_alive_timeout=keep_alive_timeout, max_keep_alive_requests=max_keep_alive_requests)
+        self._own_pool = pool is None
+        self._pool = WorkerPool(workers=workers, queue_size=queue_size) if pool is None else pool
+
+    def process_request(self, request, client_address):
+        if not self._pool.try_submit(lambda: self._process_request_thread(request, client_address)):
+            self._reject_request(request)
+
+    def _process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def _reject_request(self, request):
+        try:
+            request.sendall(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def reject_detached(self, request):
+        try:
+            request.sendall(SERVICE_UNAVAILABLE)
+        except OSError:
+            pass
+        self.close_request_now(request)
+
+    def server_close(self):
+        super().server_close()
+        if self._own_pool:
+            self._pool.close()
+
+
+class _GateRequestHandler(BaseHTTPRequestHandler):
+    # отвечает, когда тест откроет server.gate; "/detach" оставляет соединение открытым без ответа
+    def do_GET(self):
+        if self.path == "/detach":
+            self.server.detach_request(self.request)
+            self.server.detached.put(self.request)
+            return
+        self.server.started.set()
+        self.server.gate.wait()
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestThreadPoolHTTPServer(unittest.TestCase):
+    def setUp(self):
+        # один поток и одна задача в очереди на два сервера
+        self._pool = WorkerPool(workers=1, queue_size=1)
+        self.addCleanup(self._pool.close)
+        self._gate = threading.Event()
+        self.addCleanup(self._gate.set)
+        self._servers = [self._start_server() for _ in range(2)]
+
+    def _start_server(self):
+        httpd = ThreadPoolHTTPServer(("127.0.0.1", 0), _GateRequestHandler, pool=self._pool)
+        httpd.started = threading.Event()
+        httpd.gate = self._gate
+        httpd.detached = queue.Queue()
+        thread = threading.Thread(target=httpd.serve_forever)
+        thread.start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(httpd.shutdown)
+        return httpd
+
+    def _request(self, httpd, path: str = "/"):
+        client = socket.create_connection(httpd.server_address, timeout=10)
+        self.addCleanup(client.close)
+        client.sendall(f"GET {path} HTTP/1.0\r\n\r\n".encode())
+        return client
+
+    def _response(self, client):
+        chunks = []
+        while True:
+            chunk = client.recv(4096)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    def test_third_request_is_rejected(self):
+        first = self._request(self._servers[0])
+        self.assertTrue(self._servers[0].started.wait(5), "Request is not started")
+        # поток пула занят первым запросом, второй запрос другого сервера ждёт в общей очереди
+        second = self._request(self._servers[1])
+        deadline = time.monotonic() + 5
+        while self._pool._tasks.qsize() < 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        third = self._request(self._servers[0])
+        self.assertEqual(SERVICE_UNAVAILABLE, self._response(third))
+
+        self._gate.set()
+        self.assertTrue(self._response(first).startswith(b"HTTP/1.0 200 "))
+        self.assertTrue(self._response(second).startswith(b"HTTP/1.0 200 "))
+
+    def test_reject_detached(self):
+        httpd = self._servers[0]
+        client = self._request(httpd, "/detach")
+        request = httpd.detached.get(timeout=5)
+        # соединение отсоединено: завершение обработчика его не закрыло, а reject_detached() закрывает
+        httpd.reject_detached(request)
+        self.assertEqual(SERVICE_UNAVAILABLE, self._response(client))
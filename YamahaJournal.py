@@ -0,0 +1,226 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from unittest import mock
+
+
+class YamahaJournal:
+    # Журнал изменений сохраняемого состояния (зоны и пресеты) рядом с конфигом.
+    # Каждое изменение - одна короткая запись [ключ, значение] в конце файла,
+    # при повторе журнала побеждает последняя запись по ключу.
+    # Записи сбрасываются на диск группами: пока идёт fsync, новые записи копятся для следующей группы.
+    # Команда отвечает клиенту после wait_flushed(): её записи к этому моменту уже на диске,
+    # а блокировку писателя она к этому времени отпустила - следующие команды попадают в ту же группу.
+    # Когда записей становится много, вызывается compact(): состояние сохраняется в конфиг, журнал очищается.
+    # Ошибка записи (диск заполнен, EIO) не останавливает поток журнала: группа помечается несохранённой,
+    # wait_flushed() её команд возвращает False, ошибка передаётся в журнал запросов (set_error_log()).
+    COMPACT_RECORDS = 10000
+
+    def __init__(self, path: str, compact_records: int = COMPACT_RECORDS):
+        self._path = path
+        self._compact_records = compact_records
+        self._compact = None
+        self._last_values = {}
+        self._pending = []
+        self._records = 0
+        self._appended = 0  # номер последней добавленной записи
+        self._flushed = 0   # номер последней записи, сброшенной на диск
+        self._failed = 0    # номер последней записи из группы, которую не удалось сохранить
+        self._stopped = False
+        self._lock = threading.Lock()
+        self._condition = threading.Condition(self._lock)       # новые записи для потока журнала
+        self._flushed_condition = threading.Condition(self._lock)  # группа записей сброшена на диск
+        self._file = None
+        self._thread = None
+        self._error_log = None
+
+    def set_error_log(self, error_log):
+        # error_log(сообщение), например RequestLog.error; None - ошибки не сообщаются
+        self._error_log = error_log
+
+    def replay(self):
+        # незавершённая последняя строка (сбой во время записи) пропускается
+        result = {}
+        if not os.path.exists(self._path):
+            return result
+
+        with open(self._path, "rb") as file:
+            for line in file:
+                try:
+                    key, value = json.loads(line)
+                except ValueError:
+                    continue
+                result[key] = value
+                self._records += 1
+        self._last_values = dict(result)
+        return result
+
+    def start(self, compact):
+        self._compact = compact
+        self._file = open(self._path, "ab")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+        self._compact()
+        self._file.close()
+
+    def append(self, key: str, value):
+        with self._condition:
+            if self._last_values.get(key) == value:
+                return
+            self._last_values[key] = value
+            self._pending.append(json.dumps([key, value], separators=(",", ":")).encode('utf-8') + b"\n")
+            self._appended += 1
+            self._condition.notify()
+
+    def wait_flushed(self):
+        # ждёт, пока все записи, добавленные до вызова, окажутся на диске;
+        # False - запись не удалась, изменение не сохранено
+        with self._condition:
+            target = self._appended
+            while self._flushed < target and self._failed < target and self._thread is not None:
+                self._flushed_condition.wait()
+            return self._flushed >= target or self._thread is None
+
+    def reset(self):
+        # вызывается из compact() после сохранения состояния в конфиг
+        with self._condition:
+            self._pending.clear()
+            self._file.seek(0)
+            self._file.truncate()
+            self._records = 0
+            # отброшенные записи уже сохранены в конфиге
+            self._set_flushed(self._appended)
+
+    def _set_flushed(self, flushed: int):
+        # вызывается под блокировкой
+        self._flushed = max(self._flushed, flushed)
+        self._flushed_condition.notify_all()
+
+    def _report_error(self, message: str):
+        error_log = self._error_log
+        if error_log is not None:
+            error_log(message)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopped:
+                    self._condition.wait()
+                if not self._pending and self._stopped:
+                    return
+                pending, self._pending = self._pending, []
+                written = self._appended
+                try:
+                    self._file.write(b"".join(pending))
+                    self._file.flush()
+                except OSError as e:
+                    self._fail(written, e)
+                    continue
+                self._records += len(pending)
+                need_compact = self._records >= self._compact_records
+
+            try:
+                os.fsync(self._file.fileno())
+            except OSError as e:
+                with self._condition:
+                    self._fail(written, e)
+                continue
+            with self._condition:
+                self._set_flushed(written)
+            if need_compact:
+                try:
+                    self._compact()
+                except Exception as e:
+                    # записи уже на диске, журнал сожмётся при следующей попытке
+                    self._report_error(f"Journal compaction failed: {e}")
+
+    def _fail(self, written: int, error: OSError):
+        # вызывается под блокировкой. Записи группы могли не сохраниться: следующие изменения
+        # тех же ключей записываются заново, даже если значение совпадает с последним записанным
+        self._failed = max(self._failed, written)
+        self._last_values.clear()
+        self._flushed_condition.notify_all()
+        self._report_error(f"Journal write failed: {error}")
+
+
+class TestYamahaJournal(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "config.json.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _write(self, content: bytes):
+        with open(self._path, "wb") as file:
+            file.write(content)
+
+    def test_replay_without_journal(self):
+        self.assertEqual({}, YamahaJournal(self._path).replay())
+
+    def test_replay_last_record_wins(self):
+        self._write(b'["zone:main",{"volume":10}]\n'
+                    b'["presets:tuner",[]]\n'
+                    b'["zone:main",{"volume":20}]\n')
+        self.assertEqual({"zone:main": {"volume": 20}, "presets:tuner": []}, YamahaJournal(self._path).replay())
+
+    def test_replay_skips_truncated_last_line(self):
+        self._write(b'["zone:main",{"volume":10}]\n'
+                    b'["zone:main",{"vol')
+        self.assertEqual({"zone:main": {"volume": 10}}, YamahaJournal(self._path).replay())
+
+    def test_appended_records_are_replayed(self):
+        journal = YamahaJournal(self._path)
+        journal.replay()
+        journal.start(compact=lambda: None)
+        journal.append("zone:main", {"volume": 10})
+        journal.append("zone:main", {"volume": 10})  # без изменений - не записывается
+        journal.append("zone:main", {"volume": 30})
+        journal.wait_flushed()
+        with open(self._path, "rb") as file:
+            self.assertEqual(2, len(file.readlines()))
+        self.assertEqual({"zone:main": {"volume": 30}}, YamahaJournal(self._path).replay())
+        journal.stop()
+
+    def _journal_with_errors(self, **patches):
+        errors = []
+        journal = YamahaJournal(self._path, **patches)
+        journal.set_error_log(errors.append)
+        return journal, errors
+
+    def test_fsync_error_does_not_block(self):
+        journal, errors = self._journal_with_errors()
+        journal.start(compact=lambda: None)
+        with mock.patch(__name__ + ".os.fsync", side_effect=OSError("No space left on device")):
+            journal.append("zone:main", {"volume": 10})
+            self.assertFalse(journal.wait_flushed())
+        self.assertEqual(["Journal write failed: No space left on device"], errors)
+        # поток журнала продолжает работать: то же значение записывается заново
+        journal.append("zone:main", {"volume": 10})
+        self.assertTrue(journal.wait_flushed())
+        journal.stop()
+        self.assertEqual({"zone:main": {"volume": 10}}, YamahaJournal(self._path).replay())
+
+    def test_compact_error_does_not_block(self):
+        def compact():
+            raise OSError("Read-only file system")
+
+        journal, errors = self._journal_with_errors(compact_records=1)
+        journal.start(compact=compact)
+        journal.append("zone:main", {"volume": 10})
+        self.assertTrue(journal.wait_flushed())
+        journal.append("zone:main", {"volume": 20})
+        self.assertTrue(journal.wait_flushed())
+        journal._compact = lambda: None
+        journal.stop()
+        self.assertEqual(["Journal compaction failed: Read-only file system"] * 2, errors)
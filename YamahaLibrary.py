@@ -0,0 +1,185 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+from array import array
+from functools import lru_cache
+from itertools import accumulate
+from YamahaTrack import load_track
+
+
+# Внешняя медиатека: файл JSON Lines (один трек на строку, поля как в config.json)
+# и рядом индекс "<файл>.idx", построенный заранее:
+#   заголовок: INDEX_MAGIC, количество треков (uint64)
+#   смещения начала строк: count + 1 значений uint64 (последнее - конец файла)
+#   накопленные длительности: count + 1 значений int64 (время начала каждого трека, последнее - общая длительность)
+#   длительности треков: count значений uint32
+# Числа записаны в порядке байт текущей машины. Оба файла отображаются в память,
+# треки разбираются только при обращении к ним. Индекс другого формата перестраивается.
+INDEX_MAGIC = b"YLIBIDX2"
+INDEX_HEADER = struct.Struct("=8sQ")
+
+
+def index_path(library_path: str):
+    return library_path + ".idx"
+
+
+def build_library_index(library_path: str):
+    offsets = []
+    durations = []
+    offset = 0
+    with open(library_path, "rb") as file:
+        for line in file:
+            if line.strip():
+                offsets.append(offset)
+                durations.append(json.loads(line)["total_time"])
+            offset += len(line)
+    offsets.append(offset)
+
+    with open(index_path(library_path), "wb") as file:
+        file.write(INDEX_HEADER.pack(INDEX_MAGIC, len(durations)))
+        file.write(array("Q", offsets).tobytes())
+        file.write(array("q", accumulate(durations, initial=0)).tobytes())
+        file.write(array("I", durations).tobytes())
+
+
+def is_index_stale(library_path: str):
+    path = index_path(library_path)
+    if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(library_path):
+        return True
+    with open(path, "rb") as file:
+        return file.read(len(INDEX_MAGIC)) != INDEX_MAGIC
+
+
+def map_file(path: str):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class YamahaLibrary:
+    TRACKS_CACHE_SIZE = 1024
+
+    def __init__(self, library_path: str, art_url_base: str = None):
+        if is_index_stale(library_path):
+            build_library_index(library_path)
+
+        self._data = map_file(library_path)
+        self._index = map_file(index_path(library_path))
+
+        magic, count = INDEX_HEADER.unpack_from(self._index, 0)
+        assert magic == INDEX_MAGIC, f"Wrong library index format: {index_path(library_path)}"
+        index = memoryview(self._index)
+        offsets_begin = INDEX_HEADER.size
+        start_times_begin = offsets_begin + (count + 1) * 8
+        durations_begin = start_times_begin + (count + 1) * 8
+        self._count = count
+        self._offsets = index[offsets_begin:start_times_begin].cast("Q")
+        self._start_times = index[start_times_begin:durations_begin]  # байты int64, копируются в start_times()
+        self._durations = index[durations_begin:durations_begin + count * 4].cast("I")
+        self._art_url_base = art_url_base
+        self._track = lru_cache(maxsize=YamahaLibrary.TRACKS_CACHE_SIZE)(self._load_track)
+
+    def _load_track(self, index: int):
+        return load_track(json.loads(self._data[self._offsets[index]:self._offsets[index + 1]]), self._art_url_base)
+
+    def durations(self):
+        return self._durations
+
+    def start_times(self):
+        # накопленные длительности в исходном порядке для PlaybackOrder: копия одним memcpy, без сложений
+        start_times = array("q")
+        start_times.frombytes(self._start_times)
+        return start_times
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._track(i) for i in range(*index.indices(self._count))]
+
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("Track index is out of range")
+        return self._track(index)
+
+
+def write_library(library_path: str, tracks: list):
+    with open(library_path, "w") as file:
+        for track in tracks:
+            file.write(json.dumps(track) + "\n")
+
+
+def library_track(number: int):
+    return {"track": f"Track {number}", "album": "Album", "artist": "Artist", "total_time": 100 + number,
+            "albumart_file": f"{number}.jpg"}
+
+
+class TestYamahaLibrary(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._library = os.path.join(self._dir, "library.jsonl")
+        write_library(self._library, [library_track(i) for i in range(5)])
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_index_is_built(self):
+        self.assertTrue(is_index_stale(self._library))
+        library = YamahaLibrary(self._library, "http://emulator/img/")
+        self.assertFalse(is_index_stale(self._library))
+        self.assertEqual(5, len(library))
+        self.assertEqual([100, 101, 102, 103, 104], list(library.durations()))
+        self.assertEqual(array("q", [0, 100, 201, 303, 406, 510]), library.start_times())
+        self.assertEqual("Track 3", library[3].track)
+        self.assertEqual("Track 4", library[-1].track)
+        self.assertEqual("http://emulator/img/2.jpg", library[2].albumart_url)
+        self.assertEqual(["Track 1", "Track 2"], [track.track for track in library[1:3]])
+        with self.assertRaises(IndexError):
+            library[5]
+
+    def test_index_is_reused(self):
+        YamahaLibrary(self._library)
+        index_mtime = os.stat(index_path(self._library)).st_mtime_ns
+        self.assertEqual(5, len(YamahaLibrary(self._library)))
+        self.assertEqual(index_mtime, os.stat(index_path(self._library)).st_mtime_ns)
+
+    def test_stale_index_is_rebuilt(self):
+        YamahaLibrary(self._library)
+        write_library(self._library, [library_track(i) for i in range(7)])
+        # медиатека изменена позже индекса
+        index_mtime = os.stat(index_path(self._library)).st_mtime
+        os.utime(self._library, (index_mtime + 10, index_mtime + 10))
+        self.assertTrue(is_index_stale(self._library))
+        library = YamahaLibrary(self._library)
+        self.assertEqual(7, len(library))
+        self.assertEqual("Track 6", library[6].track)
+
+    def test_old_index_is_rebuilt(self):
+        YamahaLibrary(self._library)
+        with open(index_path(self._library), "r+b") as file:
+            file.write(b"YLIBIDX1")
+        self.assertTrue(is_index_stale(self._library))
+        self.assertEqual(510, YamahaLibrary(self._library).start_times()[-1])
+
+    def test_empty_lines_are_skipped(self):
+        with open(self._library, "a") as file:
+            file.write("\n" + json.dumps(library_track(5)) + "\n\n")
+        library = YamahaLibrary(self._library)
+        self.assertEqual(6, len(library))
+        self.assertEqual("Track 5", library[5].track)
+
+
+if __name__ == "__main__":
+    # построение индекса заранее: python YamahaLibrary.py library.jsonl [...]
+    for path in sys.argv[1:]:
+        build_library_index(path)
+        print(f"{index_path(path)}: {len(YamahaLibrary(path))} tracks")
@@ -0,0 +1,166 @@
+import json
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+
+def is_feedbacks_filter(filter: str):
+    return filter in ("feedbacks", "f", "feed")
+
+
+def is_commands_filter(filter: str):
+    return filter in ("commands", "c", "comm")
+
+
+class RequestLog:
+    # Журнал запросов без блокировок в обработчиках: сообщения кладутся в ограниченную очередь,
+    # вывод на консоль и запись в файл (JSON Lines с ротацией) выполняет фоновый поток.
+    # Если очередь переполнена - сообщение отбрасывается и учитывается в счётчике потерянных.
+    QUEUE_SIZE = 10000
+    MAX_FILE_BYTES = 10 * 1024 * 1024
+    BACKUP_COUNT = 5
+
+    COLORS = {
+        "command": "\033[33m",
+        "feedback": "\033[32m"
+    }
+
+    def __init__(self, filter: str = None, log_file: str = None, console: bool = True,
+                 queue_size: int = QUEUE_SIZE, max_file_bytes: int = MAX_FILE_BYTES,
+                 backup_count: int = BACKUP_COUNT):
+        self._filter = filter
+        self._log_file = log_file
+        self._console = console
+        self._max_file_bytes = max_file_bytes
+        self._backup_count = backup_count
+        self._messages = queue.Queue(maxsize=queue_size)
+        self._dropped = 0
+        self._reported_dropped = 0
+        self._file = None
+        self._thread = None
+
+    def __enter__(self):
+        if self._log_file is not None:
+            self._file = open(self._log_file, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self._messages.put(None)
+        self._thread.join()
+        if self._file is not None:
+            self._file.close()
+
+    def dropped(self):
+        return self._dropped
+
+    def command(self, requestline: str):
+        if not is_feedbacks_filter(self._filter):
+            self._put("command", requestline)
+
+    def feedback(self, requestline: str):
+        if not is_commands_filter(self._filter):
+            self._put("feedback", requestline)
+
+    def error(self, message: str):
+        self._put("error", message)
+
+    def _put(self, kind: str, message: str):
+        try:
+            self._messages.put_nowait((time.time(), kind, message))
+        except queue.Full:
+            self._dropped += 1
+
+    def _run(self):
+        while True:
+            record = self._messages.get()
+            if record is None:
+                self._report_dropped()
+                return
+
+            self._write(*record)
+            if self._messages.empty():
+                self._report_dropped()
+                self._flush()
+
+    def _report_dropped(self):
+        dropped = self._dropped
+        if dropped != self._reported_dropped:
+            self._write(time.time(), "error", f"Request log: {dropped - self._reported_dropped} messages dropped")
+            self._reported_dropped = dropped
+
+    def _write(self, timestamp: float, kind: str, message: str):
+        if self._console:
+            color = RequestLog.COLORS.get(kind)
+            sys.stdout.write(f"{color}{message}\033[0m\n" if color is not None else message + "\n")
+
+        if self._file is not None:
+            self._file.write(json.dumps({"time": timestamp, "kind": kind, "message": message}) + "\n")
+            if self._file.tell() >= self._max_file_bytes:
+                self._rotate()
+
+    def _flush(self):
+        if self._console:
+            sys.stdout.flush()
+        if self._file is not None:
+            self._file.flush()
+
+    def _rotate(self):
+        # request.log -> request.log.1 -> ... -> request.log.<backup_count>
+        self._file.close()
+        for index in range(self._backup_count - 1, 0, -1):
+            source = f"{self._log_file}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self._log_file}.{index + 1}")
+        if self._backup_count > 0:
+            os.replace(self._log_file, f"{self._log_file}.1")
+        else:
+            os.remove(self._log_file)
+        self._file = open(self._log_file, "a", encoding="utf-8")
+
+
+class TestRequestLog(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, "request.log")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def _records(self, path: str):
+        with open(path, "r", encoding="utf-8") as file:
+            return [(record["kind"], record["message"]) for record in map(json.loads, file)]
+
+    def test_filter(self):
+        with RequestLog("f", self._path, console=False) as log:
+            log.command("GET /setVolume")
+            log.feedback("GET /getStatus")
+            log.error("Unknown request")
+        self.assertEqual([("feedback", "GET /getStatus"), ("error", "Unknown request")], self._records(self._path))
+
+    def test_dropped_messages_are_counted(self):
+        # поток журнала ещё не запущен: в очередь помещается одно сообщение
+        log = RequestLog(log_file=self._path, console=False, queue_size=1)
+        for index in range(3):
+            log.command(f"GET /{index}")
+        self.assertEqual(2, log.dropped())
+        with log:
+            pass
+        self.assertEqual([("command", "GET /0"), ("error", "Request log: 2 messages dropped")],
+                         self._records(self._path))
+
+    def test_rotation(self):
+        # каждая запись превышает предел размера файла
+        with RequestLog(log_file=self._path, console=False, max_file_bytes=1, backup_count=2) as log:
+            for index in range(4):
+                log.error(str(index))
+        self.assertEqual([], self._records(self._path))
+        self.assertEqual([("error", "3")], self._records(self._path + ".1"))
+        self.assertEqual([("error", "2")], self._records(self._path + ".2"))
+        self.assertFalse(os.path.exists(self._path + ".3"))
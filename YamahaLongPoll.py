@@ -0,0 +1,212 @@
+import heapq
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+from YamahaClock import RealClock
+
+
+class LongPollWaiter:
+    # соединение, отсоединённое от потока пула: запрос, ожидающий изменения состояния,
+    # или простаивающее keep-alive соединение (state=None), ожидающее следующего запроса
+    def __init__(self, sock, state, token: str, deadline: float, resume, reject, expire=None):
+        self.sock = sock
+        self.state = state          # YamahaState, за изменениями которого следит запрос
+        self.token = token          # версия состояния, которую клиент уже видел
+        self.deadline = deadline    # time.monotonic(), когда нужно ответить в любом случае
+        self.resume = resume        # продолжение обработки запроса в потоке пула
+        self.reject = reject        # ответ клиенту, если пул переполнен или сервер останавливается
+        self.expire = expire        # вызывается в срок вместо resume (закрытие простаивающего соединения)
+        self.parked = True
+        self.timer = None           # номер действующей записи в куче таймеров
+
+
+class YamahaLongPoll:
+    # Долгие опросы без занятых потоков: сокеты ожидающих клиентов хранятся здесь,
+    # один фоновый поток ждёт одно из событий:
+    # - изменение состояния (наблюдатель YamahaState будит поток через socketpair)
+    # - смену трека, время которой заранее вычисляет плейлист (по часам эмулятора, см. YamahaClock)
+    # - таймаут запроса
+    # - активность клиента (закрыл соединение или прислал следующий запрос)
+    # и передаёт запрос обратно в пул потоков для ответа.
+    # Так же ждут и простаивающие keep-alive соединения: поток пула занят, только пока идёт запрос.
+    MAX_WAITERS = 10000
+    BOUNDARY_MARGIN_SEC = 0.01
+    RETRY_SEC = 0.005  # очередь пула заполнена - повторная попытка передать ответ
+
+    def __init__(self, submit, max_waiters: int = MAX_WAITERS, clock: RealClock = None):
+        self._submit = submit
+        self._clock = clock or RealClock()
+        self.max_waiters = max_waiters
+        self._lock = threading.Lock()
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._waiters = {}       # состояние -> множество ожидающих запросов
+        self._new_waiters = []
+        self._changed = set()
+        self._clock_changed = False
+        self._watched = set()
+        self._timers = []        # куча (время, номер, ожидающий запрос)
+        self._retry = []         # готовые запросы, которые не поместились в очередь пула
+        self._sequence = itertools.count()
+        self._count = 0
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        self._clock.add_observer(self._on_clock_changed)
+        self._selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+        self._wakeup()
+        self._thread.join()
+        self._selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+
+    def park(self, waiter: LongPollWaiter):
+        # False - запрос не принят, отвечать нужно сразу
+        with self._lock:
+            if self._stopped or self._count >= self.max_waiters:
+                return False
+            self._count += 1
+            self._new_waiters.append(waiter)
+            if waiter.state is not None and waiter.state not in self._watched:
+                self._watched.add(waiter.state)
+                waiter.state.add_observer(lambda changes, state=waiter.state: self._state_changed(state))
+        self._wakeup()
+        return True
+
+    def waiters(self):
+        return self._count
+
+    def _state_changed(self, state):
+        # вызывается в потоке писателя под его блокировкой - только отмечаем изменение
+        with self._lock:
+            self._changed.add(state)
+        self._wakeup()
+
+    def _on_clock_changed(self):
+        # время на часах эмулятора прыгнуло или пошло с другой скоростью - сроки смены треков пересчитываются
+        with self._lock:
+            if self._stopped:
+                return
+            self._clock_changed = True
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self._wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            pass  # поток уже разбужен
+
+    def _schedule(self, waiter: LongPollWaiter, now: float):
+        wake_time = waiter.deadline
+        delay = None if waiter.state is None else waiter.state.next_transition_delay()
+        if delay is not None:
+            delay = self._clock.real_delay(delay)
+        if delay is not None:
+            wake_time = min(wake_time, now + delay + YamahaLongPoll.BOUNDARY_MARGIN_SEC)
+        waiter.timer = next(self._sequence)
+        heapq.heappush(self._timers, (wake_time, waiter.timer, waiter))
+
+    def _add(self, waiter: LongPollWaiter, now: float):
+        self._waiters.setdefault(waiter.state, set()).add(waiter)
+        self._selector.register(waiter.sock, selectors.EVENT_READ, waiter)
+        self._schedule(waiter, now)
+
+    def _remove(self, waiter: LongPollWaiter):
+        waiter.parked = False
+        self._waiters[waiter.state].discard(waiter)
+        self._selector.unregister(waiter.sock)
+        with self._lock:
+            self._count -= 1
+
+    def _is_ready(self, waiter: LongPollWaiter, now: float):
+        return now >= waiter.deadline or (waiter.state is not None and waiter.state.transition_token() != waiter.token)
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._timers:
+                timeout = max(0.0, self._timers[0][0] - time.monotonic())
+            if self._retry:
+                timeout = YamahaLongPoll.RETRY_SEC if timeout is None else min(timeout, YamahaLongPoll.RETRY_SEC)
+            events = self._selector.select(timeout)
+
+            with self._lock:
+                stopped = self._stopped
+                new_waiters, self._new_waiters = self._new_waiters, []
+                changed, self._changed = self._changed, set()
+                clock_changed, self._clock_changed = self._clock_changed, False
+
+            now = time.monotonic()
+            ready = []
+            for key, _ in events:
+                if key.fileobj is self._wakeup_reader:
+                    try:
+                        while self._wakeup_reader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                elif key.data.parked:
+                    ready.append(key.data)
+
+            for waiter in new_waiters:
+                self._add(waiter, now)
+                if self._is_ready(waiter, now):
+                    ready.append(waiter)
+
+            for state in changed:
+                for waiter in self._waiters.get(state, ()):
+                    if waiter.state.transition_token() != waiter.token:
+                        ready.append(waiter)
+
+            if clock_changed:
+                for state, waiters in self._waiters.items():
+                    if state is None:
+                        continue  # простаивающим соединениям часы эмулятора не важны
+                    for waiter in waiters:
+                        if self._is_ready(waiter, now):
+                            ready.append(waiter)
+                        else:
+                            self._schedule(waiter, now)
+
+            while self._timers and self._timers[0][0] <= now:
+                _, timer, waiter = heapq.heappop(self._timers)
+                if not waiter.parked or timer != waiter.timer:
+                    continue
+                if waiter.expire is not None and now >= waiter.deadline and waiter not in ready:
+                    self._remove(waiter)
+                    waiter.expire()
+                elif self._is_ready(waiter, now):
+                    ready.append(waiter)
+                else:
+                    self._schedule(waiter, now)
+
+            if stopped:
+                ready = [waiter for waiters in self._waiters.values() for waiter in waiters]
+
+            for waiter in ready:
+                if waiter.parked:
+                    self._remove(waiter)
+                    self._retry.append(waiter)
+
+            retry, self._retry = self._retry, []
+            for i, waiter in enumerate(retry):
+                if stopped:
+                    waiter.reject()
+                elif not self._submit(waiter.resume):
+                    self._retry = retry[i:]
+                    break
+
+            if stopped:
+                return
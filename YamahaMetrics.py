@@ -0,0 +1,202 @@
+import threading
+import unittest
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+
+
+# границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+                   0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+PHASES = ("parse", "dispatch", "serialize", "write", "total")
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    # гистограмма с фиксированными корзинами: память не растёт с числом наблюдений
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, count in enumerate(list(other.counts)):
+            self.counts[i] += count
+        self.sum += other.sum
+
+
+class MetricsShard:
+    # метрики одного потока: пишет в них только поток-владелец, поэтому блокировки не нужны,
+    # при выдаче метрик шарды всех потоков суммируются
+    def __init__(self):
+        self.requests = {}   # (действие, отправитель, код ответа) -> число запросов
+        self.bytes_out = {}  # (действие, отправитель) -> байт в телах ответов
+        self.latency = {}    # (фаза, действие) -> Histogram
+        self.connections = 0
+
+
+class YamahaMetrics:
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()  # только для регистрации нового шарда
+        self._request_log = None
+
+    def set_request_log(self, request_log):
+        # журнал запросов, число потерянных сообщений которого публикуется вместе с метриками
+        self._request_log = request_log
+
+    def shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = MetricsShard()
+            with self._lock:
+                self._shards.append(shard)
+        return shard
+
+    def connection_opened(self):
+        self.shard().connections += 1
+
+    def connection_closed(self):
+        self.shard().connections -= 1
+
+    def request(self, endpoint: str, sender: str, code: int, bytes_out: int, phases: tuple):
+        # phases - длительности фаз запроса в порядке PHASES
+        shard = self.shard()
+        key = (endpoint, sender, code)
+        shard.requests[key] = shard.requests.get(key, 0) + 1
+        key = (endpoint, sender)
+        shard.bytes_out[key] = shard.bytes_out.get(key, 0) + bytes_out
+        for phase, duration in zip(PHASES, phases):
+            if duration is None:
+                continue
+            histogram = shard.latency.get((phase, endpoint))
+            if histogram is None:
+                histogram = shard.latency[(phase, endpoint)] = Histogram()
+            histogram.observe(duration)
+
+    def _collect(self):
+        requests, bytes_out, latency, connections = {}, {}, {}, 0
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            for key, value in dict(shard.requests).items():
+                requests[key] = requests.get(key, 0) + value
+            for key, value in dict(shard.bytes_out).items():
+                bytes_out[key] = bytes_out.get(key, 0) + value
+            for key, histogram in dict(shard.latency).items():
+                latency.setdefault(key, Histogram(histogram.buckets)).merge(histogram)
+            connections += shard.connections
+        return requests, bytes_out, latency, connections
+
+    def render(self):
+        # текстовый формат Prometheus
+        requests, bytes_out, latency, connections = self._collect()
+        lines = [
+            "# HELP yamaha_requests_total Requests by endpoint, sender and response code.",
+            "# TYPE yamaha_requests_total counter",
+        ]
+        for (endpoint, sender, code), value in sorted(requests.items()):
+            lines.append(f'yamaha_requests_total{{endpoint="{endpoint}",sender="{sender}",code="{code}"}} {value}')
+
+        lines += [
+            "# HELP yamaha_response_bytes_total Response body bytes by endpoint and sender.",
+            "# TYPE yamaha_response_bytes_total counter",
+        ]
+        for (endpoint, sender), value in sorted(bytes_out.items()):
+            lines.append(f'yamaha_response_bytes_total{{endpoint="{endpoint}",sender="{sender}"}} {value}')
+
+        lines += [
+            "# HELP yamaha_request_duration_seconds Request latency by phase and endpoint.",
+            "# TYPE yamaha_request_duration_seconds histogram",
+        ]
+        for (phase, endpoint), histogram in sorted(latency.items()):
+            labels = f'endpoint="{endpoint}",phase="{phase}"'
+            cumulative = 0
+            for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                cumulative += count
+                lines.append(f'yamaha_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"yamaha_request_duration_seconds_sum{{{labels}}} {histogram.sum:.9f}")
+            lines.append(f"yamaha_request_duration_seconds_count{{{labels}}} {cumulative}")
+
+        lines += [
+            "# HELP yamaha_active_connections Open client connections.",
+            "# TYPE yamaha_active_connections gauge",
+            f"yamaha_active_connections {connections}",
+        ]
+
+        request_log = self._request_log
+        if request_log is not None:
+            lines += [
+                "# HELP yamaha_log_dropped_total Request log messages dropped because the log queue was full.",
+                "# TYPE yamaha_log_dropped_total counter",
+                f"yamaha_log_dropped_total {request_log.dropped()}",
+            ]
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    # отдельный порт только для метрик, чтобы сбор метрик не занимал потоки пула основного сервера
+    def do_GET(self):
+        if self.path.partition("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = self.server.metrics.render()
+        self.send_response(200)
+        self.send_header("Content-Type", PROMETHEUS_CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestYamahaMetrics(unittest.TestCase):
+    REQUESTS = 1000
+
+    def test_shards_are_merged(self):
+        metrics = YamahaMetrics()
+        metrics.set_request_log(mock.Mock(**{"dropped.return_value": 3}))
+
+        def record(sender: str):
+            metrics.connection_opened()
+            for _ in range(TestYamahaMetrics.REQUESTS):
+                metrics.request("getStatus", sender, 200, 100, (0.0003, None, None, None, 0.002))
+            metrics.request("setVolume", sender, 500, 0, (None, None, None, None, 0.2))
+
+        # каждый поток пишет в свой шард
+        threads = [threading.Thread(target=record, args=(sender,)) for sender in ("app", "app", "web")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(3, len(metrics._shards))
+
+        lines = metrics.render().decode("utf-8").splitlines()
+        for line in ('yamaha_requests_total{endpoint="getStatus",sender="app",code="200"} 2000',
+                     'yamaha_requests_total{endpoint="getStatus",sender="web",code="200"} 1000',
+                     'yamaha_requests_total{endpoint="setVolume",sender="app",code="500"} 2',
+                     'yamaha_response_bytes_total{endpoint="getStatus",sender="app"} 200000',
+                     'yamaha_response_bytes_total{endpoint="setVolume",sender="web"} 0',
+                     'yamaha_request_duration_seconds_bucket{endpoint="getStatus",phase="parse",le="0.00025"} 0',
+                     'yamaha_request_duration_seconds_bucket{endpoint="getStatus",phase="parse",le="0.0005"} 3000',
+                     'yamaha_request_duration_seconds_count{endpoint="getStatus",phase="total"} 3000',
+                     'yamaha_request_duration_seconds_bucket{endpoint="setVolume",phase="total",le="0.1"} 0',
+                     'yamaha_request_duration_seconds_bucket{endpoint="setVolume",phase="total",le="+Inf"} 3',
+                     'yamaha_active_connections 3',
+                     'yamaha_log_dropped_total 3'):
+            self.assertIn(line, lines)
+        # фазы без измерений не публикуются
+        self.assertFalse([line for line in lines if 'phase="dispatch"' in line])
+        self.assertIn("# TYPE yamaha_request_duration_seconds histogram", lines)
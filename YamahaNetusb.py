@@ -1,6 +1,7 @@
 import os
 
 from YamahaPlaylist import YamahaPlaylist
+from YamahaState import YamahaState
 from YamahaTrack import YamahaTrack
 from YamahaZone import YamahaZone
 
@@ -11,16 +12,29 @@ class YamahaNetusbPreset:
         self.text = text
 
 
-class YamahaNetusb:
+class YamahaNetusb(YamahaState):
     def __init__(self, presets: list, playlist: YamahaPlaylist):
+        super().__init__()
         self._input = "spotify"
         self._repeat_mode = "off"   # "off" / "one" / "all"
         self._shuffle_mode = "off"  # "off" / "on" / "songs" / "albums"
         self._playlist = playlist
         self._presets = presets
+        self._playlist.add_observer(lambda changes: self._touch())
+
+    def state_key(self):
+        # воспроизведение зависит от времени - в ключ входит текущее состояние списка воспроизведения
+        return self.version(), self._playlist.state_key()
+
+    def transition_token(self):
+        return f"{self.version()}-{self._playlist.transition_token()}"
+
+    def next_transition_delay(self):
+        return self._playlist.next_transition_delay()
 
     def set_input(self, input: str):
         self._input = input
+        self._touch()
 
     def play(self):
         self._playlist.play()
@@ -71,6 +85,7 @@ class YamahaNetusb:
             self._playlist.repeat_one()
         else:
             self._playlist.repeat_all()
+        self._touch()
 
     def toggle_shuffle(self):
         next_shuffle_mode = {
@@ -85,6 +100,7 @@ class YamahaNetusb:
             self._playlist.shuffle_off()
         else:
             self._playlist.shuffle_on()
+        self._touch()
 
     def presets_list(self):
         return self._presets
@@ -93,6 +109,7 @@ class YamahaNetusb:
         assert 1 <= num <= len(self._presets), f"Preset num is out of range [1, {len(self._presets)}]"
         preset_index = num - 1
         self._presets[preset_index] = YamahaNetusbPreset(input_name=self._input, text=f"Preset for {self._input}")
+        self._touch()
 
     def recall_preset(self, zone: YamahaZone, num: int):
         assert 1 <= num <= len(self._presets), f"Preset num is out of range [1, {len(self._presets)}]"
@@ -101,17 +118,18 @@ class YamahaNetusb:
         current_preset = self._presets[preset_index]
         self._input = current_preset.input
         zone.input_name = current_preset.input
+        self._touch()
 
     def play_info(self):
-        track_index, play_time = self._playlist.sync()
-        current_track = self._playlist.current_track()
+        position = self._playlist.position()
+        current_track = self._playlist.track_at(position)
 
         return {
             "input": self._input,
-            "playback": self._playlist.play_state(),
+            "playback": position.play_state.name,
             "repeat": self._repeat_mode,
             "shuffle": self._shuffle_mode,
-            "play_time": play_time,
+            "play_time": position.play_time_sec,
             "total_time": current_track.total_time,
             "artist": current_track.artist,
             "album": current_track.album,
@@ -119,5 +137,11 @@ class YamahaNetusb:
             "track": current_track.track
         }
 
+    def list_version(self):
+        return self._playlist.list_version()
+
+    def playing_index(self):
+        return self._playlist.position().track_index
+
     def list_info(self, index_from: int, chunk_size: int):
         return self._playlist.slice_to_list_info(index_from, chunk_size)
@@ -1,9 +1,18 @@
+import os
 import random
+import shutil
+import tempfile
 import time
 import unittest
 
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate
 from enum import Enum
-from YamahaTrack import YamahaTrack
+from YamahaLibrary import YamahaLibrary, write_library, library_track
+from YamahaState import YamahaState
+from YamahaTrack import YamahaTrack, YamahaTrackList
 
 
 class RepeatMode(Enum):
@@ -21,145 +30,295 @@ class PlayState(Enum):
     fast_forward = 4
 
 
-class YamahaPlaylist:
+class PlaybackOrder:
+    # порядок воспроизведения - перестановка треков и обратная к ней:
+    # tracks_indexes[позиция в списке воспроизведения] = индекс трека в библиотеке,
+    # positions[индекс трека в библиотеке] = позиция в списке воспроизведения.
+    # Исходный порядок хранится как range - без копий и за O(1) в обе стороны.
+    # Накопленные длительности треков в этом порядке:
+    # start_times[i] - время от начала списка до начала i-го по порядку трека, start_times[-1] - общая длительность
+    # Для больших медиатек все индексы хранятся в array - по 8 байт на трек.
+    # Для исходного порядка накопленные длительности можно передать готовыми (start_times из индекса медиатеки).
+    def __init__(self, durations, tracks_indexes, start_times=None):
+        self.tracks_indexes = tracks_indexes
+        if isinstance(tracks_indexes, range):
+            self.positions = tracks_indexes
+            if start_times is None:
+                start_times = array("q", accumulate(durations, initial=0))
+            self.start_times = start_times
+        else:
+            self.positions = array("q", bytes(8 * len(tracks_indexes)))
+            for position, index in enumerate(tracks_indexes):
+                self.positions[index] = position
+            self.start_times = array("q", accumulate((durations[i] for i in tracks_indexes), initial=0))
+        self.total_time = self.start_times[-1]
+
+    def find(self, list_time_sec: int):
+        # индекс трека, который звучит через list_time_sec секунд от начала списка, за O(log n)
+        return bisect_right(self.start_times, list_time_sec) - 1
+
+
+# неизменяемое состояние воспроизведения: писатели заменяют его целиком,
+# поэтому читатель, один раз прочитавший self._state, видит согласованную картину
+PlaybackState = namedtuple("PlaybackState", ("order", "track_index", "play_time_sec",
+                                             "play_state", "repeat_mode", "last_sync_sec"))
+
+
+class YamahaPlaylist(YamahaState):
     FAST_FORWARD_SPEED = 5
 
-    def __init__(self, tracks: list, whats_a_time=time.time):
+    def __init__(self, tracks, whats_a_time=time.time, shuffle_seed=None):
+        # tracks - список YamahaTrack, YamahaTrackList из кэша конфига
+        # или внешняя медиатека YamahaLibrary (треки читаются по требованию)
+        super().__init__()
         self._tracks = tracks
-        self._tracks_indexes = list(range(len(tracks)))
-        self._current_track_index = 0
-        self._last_sync_sec = int(time.time())
-        self._play_time_sec = 0
-        self._play_state = PlayState.stop
-        self._repeat_mode = RepeatMode.ALL
+        start_times = None
+        if isinstance(tracks, YamahaLibrary):
+            self._durations = tracks.durations()
+            start_times = tracks.start_times()
+        elif isinstance(tracks, YamahaTrackList):
+            self._durations = tracks.durations()
+        else:
+            self._durations = [track.total_time for track in tracks]
         self._whats_a_time = whats_a_time  # функция для отчёта времени - подменяется в тестах
+        self._random = random.Random(shuffle_seed)  # с одинаковым seed перемешивания повторяются
+        self._sorted_order = PlaybackOrder(self._durations, range(len(tracks)), start_times)
+        self._state = PlaybackState(order=self._sorted_order,
+                                    track_index=0,
+                                    play_time_sec=0,
+                                    play_state=PlayState.stop,
+                                    repeat_mode=RepeatMode.ALL,
+                                    last_sync_sec=int(whats_a_time()))
+        self._last_position = (None, None, None)
+        self._list_version = 0  # меняется вместе со списком треков или порядком воспроизведения
+
+    # поля состояния на текущий момент времени (только для чтения)
+
+    @property
+    def _tracks_indexes(self):
+        return self._state.order.tracks_indexes
+
+    @property
+    def _current_track_index(self):
+        return self.position().track_index
+
+    @property
+    def _play_time_sec(self):
+        return self.position().play_time_sec
+
+    @property
+    def _play_state(self):
+        return self.position().play_state
+
+    @property
+    def _repeat_mode(self):
+        return self._state.repeat_mode
+
+    def position(self):
+        # чтение не изменяет плейлист: состояние вычисляется от последней записи до текущего момента.
+        # Пока не изменилось ни состояние, ни текущая секунда - возвращаем уже вычисленную позицию,
+        # так что все части одного запроса видят один и тот же (трек, время, состояние)
+        state = self._state
+        current_time_sec = int(self._whats_a_time())
+        last_state, last_time_sec, last_position = self._last_position
+        if last_state is state and last_time_sec == current_time_sec:
+            return last_position
+
+        position = self._sync_time(state, current_time_sec)
+        self._last_position = (state, current_time_sec, position)
+        return position
 
     def sync(self):
-        return self._sync_time(int(self._whats_a_time()))
+        position = self.position()
+        return position.track_index, position.play_time_sec
 
-    def _sync_time(self, current_time_sec: int):
+    def _sync_time(self, state: PlaybackState, current_time_sec: int):
         # Сверим часы:
-        # 1. Определим какой сейчас играет трек: self._current_track_index
-        # 2. Выставим соответствующее время проигрывания: self._play_time
-        elapsed_time_sec = current_time_sec - self._last_sync_sec
-        self._last_sync_sec = current_time_sec
-        if self._play_state != PlayState.play and \
-                self._play_state != PlayState.fast_reverse and \
-                self._play_state != PlayState.fast_forward:
-            return self._current_track_index, self._play_time_sec
-
-        if self._play_state == PlayState.fast_reverse:
+        # 1. Определим какой сейчас играет трек: track_index
+        # 2. Выставим соответствующее время проигрывания: play_time_sec
+        elapsed_time_sec = current_time_sec - state.last_sync_sec
+        state = state._replace(last_sync_sec=current_time_sec)
+        if state.play_state != PlayState.play and \
+                state.play_state != PlayState.fast_reverse and \
+                state.play_state != PlayState.fast_forward:
+            return state
+
+        if state.play_state == PlayState.fast_reverse:
             elapsed_time_sec *= -YamahaPlaylist.FAST_FORWARD_SPEED
-        elif self._play_state == PlayState.fast_forward:
+        elif state.play_state == PlayState.fast_forward:
             elapsed_time_sec *= YamahaPlaylist.FAST_FORWARD_SPEED
 
-        current_track = self._tracks[self._tracks_indexes[self._current_track_index]]
-        if self._repeat_mode == RepeatMode.ONE:
-            self._play_time_sec = (self._play_time_sec + elapsed_time_sec) % current_track.total_time
-            return self._current_track_index, self._play_time_sec
-
-        # self._repeat_mode == RepeatMode.OFF и весь список уже проигрался
-        if self._repeat_mode == RepeatMode.OFF and (self._play_time_sec + elapsed_time_sec) > self.summary_time():
-            self._current_track_index = 0
-            self._play_time_sec = 0
-            self._play_state = PlayState.stop
-            return self._current_track_index, self._play_time_sec
-
-        # self._repeat_mode == RepeatMode.ALL
-        self._play_time_sec = (self._play_time_sec + elapsed_time_sec) % self.summary_time()
-        while self._play_time_sec > current_track.total_time:
-            self._play_time_sec -= current_track.total_time
-            self._current_track_index = (self._current_track_index + 1) % self.count_tracks()
-            current_track = self._tracks[self._tracks_indexes[self._current_track_index]]
-
-        return self._current_track_index, self._play_time_sec
+        order = state.order
+        track_index = state.track_index
+        track_start_sec = order.start_times[track_index]
+        track_time_sec = order.start_times[track_index + 1] - track_start_sec
+        if state.repeat_mode == RepeatMode.ONE:
+            if track_time_sec == 0:
+                return state
+            return state._replace(play_time_sec=(state.play_time_sec + elapsed_time_sec) % track_time_sec)
+
+        # время от начала всего списка воспроизведения
+        list_time_sec = track_start_sec + state.play_time_sec + elapsed_time_sec
+
+        # state.repeat_mode == RepeatMode.OFF и весь список уже проигрался
+        if state.repeat_mode == RepeatMode.OFF and list_time_sec >= order.total_time:
+            return state._replace(track_index=0, play_time_sec=0, play_state=PlayState.stop)
+
+        # чаще всего остаёмся в пределах того же трека - поиск не нужен
+        if track_start_sec <= list_time_sec < track_start_sec + track_time_sec:
+            return state._replace(play_time_sec=list_time_sec - track_start_sec)
+
+        if order.total_time == 0:
+            return state
+
+        # state.repeat_mode == RepeatMode.ALL
+        list_time_sec %= order.total_time
+        track_index = order.find(list_time_sec)
+        return state._replace(track_index=track_index, play_time_sec=list_time_sec - order.start_times[track_index])
+
+    def _commit(self, **changes):
+        # запись: сверяем часы, применяем изменения и публикуем новое состояние одним присваиванием
+        self._state = self._sync_time(self._state, int(self._whats_a_time()))._replace(**changes)
+        self._touch()
+
+    def apply_transition(self):
+        # вызывается планировщиком (YamahaScheduler) под блокировкой писателя в момент смены трека:
+        # позиция на текущий момент становится состоянием, наблюдатели узнают о смене трека или остановке
+        position = self.position()
+        state = self._state
+        if position.track_index == state.track_index and position.play_state == state.play_state:
+            return False
+        self._state = position
+        self._touch()
+        return True
+
+    def checkpoint(self):
+        # треки не меняются - достаточно неизменяемого состояния воспроизведения и генератора перемешивания
+        return self._state, self._random.getstate()
+
+    def restore(self, checkpoint):
+        self._state, random_state = checkpoint
+        self._random.setstate(random_state)
+        # версия списка только растёт: страницы getListInfo из кэша не должны совпасть с откаченным порядком
+        self._list_version += 1
+        self._touch()
+
+    def list_version(self):
+        return self._list_version
+
+    def state_key(self):
+        position = self.position()
+        return self.version(), position.track_index, position.play_time_sec, position.play_state
+
+    def transition_token(self):
+        position = self.position()
+        return f"{position.track_index}-{position.play_state.name}"
+
+    def next_transition_delay(self):
+        # время до конца текущего трека (в секундах часов плейлиста): смена трека или остановка в конце списка
+        position = self.position()
+        speed = 1
+        if position.play_state == PlayState.fast_forward or position.play_state == PlayState.fast_reverse:
+            speed = YamahaPlaylist.FAST_FORWARD_SPEED
+        elif position.play_state != PlayState.play:
+            return None
+
+        order = position.order
+        if position.repeat_mode == RepeatMode.ONE or order.total_time == 0:
+            return None  # трек повторяется по кругу или все треки нулевой длины: номер трека сам не изменится
+        if position.play_state == PlayState.fast_reverse:
+            remaining_sec = position.play_time_sec + 1
+        else:
+            remaining_sec = order.start_times[position.track_index + 1] - order.start_times[position.track_index] \
+                            - position.play_time_sec
+        # позиция считается в целых секундах: переход случится, когда часы дойдут до нужной целой секунды.
+        # После сверки часов позиция находится внутри трека ненулевой длины, поэтому remaining_sec > 0
+        now = self._whats_a_time()
+        boundary_sec = int(now) + -(-remaining_sec // speed)
+        return max(0.0, boundary_sec - now)
 
     def play_time(self):
-        self.sync()
-        return self._play_time_sec
+        return self.position().play_time_sec
 
     def play_state(self):
-        self.sync()
-        return self._play_state.name
+        return self.position().play_state.name
 
     def play(self):
-        self.sync()
-        self._play_state = PlayState.play
+        self._commit(play_state=PlayState.play)
 
     def pause(self):
-        self.sync()
-        self._play_state = PlayState.pause
+        self._commit(play_state=PlayState.pause)
 
     def stop(self):
-        self.sync()
-        self._play_state = PlayState.stop
-        self._play_time_sec = 0
+        self._commit(play_state=PlayState.stop, play_time_sec=0)
 
     def fast_reverse_start(self):
-        self.sync()
-        self._play_state = PlayState.fast_reverse
+        self._commit(play_state=PlayState.fast_reverse)
 
     def fast_reverse_end(self):
-        self.sync()
-        self._play_state = PlayState.play
+        self._commit(play_state=PlayState.play)
 
     def fast_forward_start(self):
-        self.sync()
-        self._play_state = PlayState.fast_forward
+        self._commit(play_state=PlayState.fast_forward)
 
     def fast_forward_end(self):
-        self.sync()
-        self._play_state = PlayState.play
+        self._commit(play_state=PlayState.play)
 
     def count_tracks(self):
         return len(self._tracks)
 
+    def track_at(self, position: PlaybackState):
+        return self._tracks[position.order.tracks_indexes[position.track_index]]
+
     def current_track(self):
-        self.sync()
-        return self._tracks[self._tracks_indexes[self._current_track_index]]
+        return self.track_at(self.position())
 
     def set_track_index(self, index: int):
         assert 0 <= index < self.count_tracks(), f"Track index is out of range [0, {self.count_tracks()})"
-        self._current_track_index = self._tracks_indexes.index(index)
-        self._play_time_sec = 0
+        self._commit(track_index=self._state.order.positions[index], play_time_sec=0)
 
     def next_track(self):
-        self.sync()
-        self._current_track_index += 1
-        if self._current_track_index >= self.count_tracks():
-            self._current_track_index = 0
-        self._play_time_sec = 0
+        track_index = self.position().track_index + 1
+        if track_index >= self.count_tracks():
+            track_index = 0
+        self._commit(track_index=track_index, play_time_sec=0)
 
     def previous_track(self):
-        self.sync()
-        self._current_track_index -= 1
-        if self._current_track_index < 0:
-            self._current_track_index = self.count_tracks() - 1
-        self._play_time_sec = 0
+        track_index = self.position().track_index - 1
+        if track_index < 0:
+            track_index = self.count_tracks() - 1
+        self._commit(track_index=track_index, play_time_sec=0)
 
     def summary_time(self):
-        return sum(self._tracks[i].total_time for i in range(self.count_tracks()))
+        return self._state.order.total_time
 
     def shuffle_on(self):
-        random.shuffle(self._tracks_indexes)
-        self._current_track_index = self._tracks_indexes.index(self._current_track_index)
+        # список индексов не изменяется на месте - создаётся новый, чтобы не испортить состояние у читателей
+        position = self.position()
+        tracks_indexes = array("q", position.order.tracks_indexes)
+        self._random.shuffle(tracks_indexes)
+        order = PlaybackOrder(self._durations, tracks_indexes)
+        current_track_index = position.order.tracks_indexes[position.track_index]
+        self._list_version += 1
+        self._commit(order=order, track_index=order.positions[current_track_index])
 
     def shuffle_off(self):
         # восстанавливаем порядок следования индексов треков:
         # 1. индекс трека равен порядковому номеру трека
-        self._current_track_index = self._tracks_indexes[self._current_track_index]
-
         # 2. индексы треков в списке воспроизведения расположены друг за другом по возрастанию
-        self._tracks_indexes.sort()
+        position = self.position()
+        self._list_version += 1
+        self._commit(order=self._sorted_order,
+                     track_index=position.order.tracks_indexes[position.track_index])
 
     def repeat_off(self):
-        self._repeat_mode = RepeatMode.OFF
+        self._commit(repeat_mode=RepeatMode.OFF)
 
     def repeat_one(self):
-        self._repeat_mode = RepeatMode.ONE
+        self._commit(repeat_mode=RepeatMode.ONE)
 
     def repeat_all(self):
-        self._repeat_mode = RepeatMode.ALL
+        self._commit(repeat_mode=RepeatMode.ALL)
 
     def slice_to_list_info(self, index_from: int, chunk_size: int):
         list_info = list(map(lambda track: {"text": track.track, "attribute": 2},
@@ -169,7 +328,7 @@ class YamahaPlaylist:
             "menu_layer": 0,
             "max_line": len(self._tracks),
             "index": index_from,
-            "playing_index": self._current_track_index,
+            "playing_index": self.position().track_index,
             "menu_name": "Queen",
             "list_info": list_info
         }
@@ -252,6 +411,13 @@ class TestYamahaPlaylist(unittest.TestCase):
         self.assertEqual(0, self._yamahaPlaylist._play_time_sec)
         self.assertEqual(PlayState.stop, self._yamahaPlaylist._play_state)
 
+    def test_sync_after_many_loops(self):
+        # после нескольких полных проходов списка в режиме RepeatMode.ALL трек находится по накопленным длительностям
+        play_time = 164 + 168 + 5
+        self._yamahaPlaylist.play()
+        self._time += self._yamahaPlaylist.summary_time() * 7 + play_time
+        self.assertEqual((2, 5), self._yamahaPlaylist.sync())
+
     def test_repeat_one(self):
         # после проигрывания текущего трека в режиме RepeatMode.ONE
         # этот трек начнёт проигрываться снова и так далее
@@ -382,3 +548,117 @@ class TestYamahaPlaylist(unittest.TestCase):
         self.assertEqual(play_time, self._yamahaPlaylist._play_time_sec)
         self.assertEqual(PlayState.play, self._yamahaPlaylist._play_state)
 
+    def test_position_is_read_only(self):
+        # чтение текущей позиции не изменяет опубликованное состояние и версию плейлиста
+        self._yamahaPlaylist.play()
+        state = self._yamahaPlaylist._state
+        version = self._yamahaPlaylist.version()
+        self._time += 164 + 3
+        self.assertEqual((1, 3), self._yamahaPlaylist.sync())
+        self.assertIs(state, self._yamahaPlaylist._state)
+        self.assertEqual(version, self._yamahaPlaylist.version())
+
+    def test_shuffle_seed(self):
+        # с одним и тем же seed порядок после перемешивания воспроизводится
+        tracks = [YamahaTrack(track=str(i), total_time=100 + i) for i in range(50)]
+        first = YamahaPlaylist(tracks, lambda: self._time, shuffle_seed=42)
+        second = YamahaPlaylist(tracks, lambda: self._time, shuffle_seed=42)
+        for _ in range(3):
+            first.shuffle_on()
+            second.shuffle_on()
+            self.assertEqual(first._tracks_indexes, second._tracks_indexes)
+
+        # обратная перестановка согласована с прямой
+        order = first._state.order
+        for position, index in enumerate(order.tracks_indexes):
+            self.assertEqual(position, order.positions[index])
+
+    def test_checkpoint_restore(self):
+        # откат к снимку возвращает порядок и позицию, но версии только растут
+        self._yamahaPlaylist.play()
+        checkpoint = self._yamahaPlaylist.checkpoint()
+        version = self._yamahaPlaylist.version()
+        list_version = self._yamahaPlaylist.list_version()
+        self._yamahaPlaylist.set_track_index(2)
+        self._yamahaPlaylist.shuffle_on()
+        self._yamahaPlaylist.restore(checkpoint)
+        self.assertEqual((0, 0), self._yamahaPlaylist.sync())
+        self.assertEqual([0, 1, 2], list(self._yamahaPlaylist._tracks_indexes))
+        self.assertGreater(self._yamahaPlaylist.version(), version)
+        self.assertGreater(self._yamahaPlaylist.list_version(), list_version)
+
+    def test_apply_transition(self):
+        # внутри трека переход не фиксируется, после его окончания - одно изменение версии
+        self._yamahaPlaylist.play()
+        self.assertEqual(164, self._yamahaPlaylist.next_transition_delay())
+        self._time = 100
+        self.assertFalse(self._yamahaPlaylist.apply_transition())
+        version = self._yamahaPlaylist.version()
+        self._time = 170
+        self.assertTrue(self._yamahaPlaylist.apply_transition())
+        self.assertFalse(self._yamahaPlaylist.apply_transition())
+        self.assertEqual(version + 1, self._yamahaPlaylist.version())
+        self.assertEqual((1, 6), self._yamahaPlaylist.sync())
+
+    def test_repeat_off_stops_at_list_end(self):
+        # ровно в момент окончания последнего трека плейлист останавливается, а не начинает список заново
+        playlist = YamahaPlaylist([
+            YamahaTrack(track="One", album="Ben", artist="Michael Jackson", total_time=10),
+            YamahaTrack(track="Two", album="Ben", artist="Michael Jackson", total_time=10),
+        ], lambda: self._time)
+        playlist.repeat_off()
+        playlist.play()
+        playlist.set_track_index(1)
+        self.assertEqual(10, playlist.next_transition_delay())
+
+        self._time += 10
+        self.assertEqual((0, 0), playlist.sync())
+        self.assertEqual(PlayState.stop, playlist._play_state)
+        self.assertTrue(playlist.apply_transition())
+        self.assertEqual(PlayState.stop, playlist._state.play_state)
+        self.assertIsNone(playlist.next_transition_delay())
+
+        self._time += 5
+        self.assertEqual((0, 0), playlist.sync())
+        self.assertEqual(PlayState.stop, playlist._play_state)
+
+    def test_no_transition_without_track_change(self):
+        # повтор одного трека и плейлист из треков нулевой длины не требуют пробуждений планировщика
+        self._yamahaPlaylist.play()
+        self._yamahaPlaylist.repeat_one()
+        self.assertIsNone(self._yamahaPlaylist.next_transition_delay())
+
+        playlist = YamahaPlaylist([YamahaTrack(track="Silence", album="", artist="", total_time=0)],
+                                  lambda: self._time)
+        playlist.play()
+        self.assertIsNone(playlist.next_transition_delay())
+
+
+class TestLibraryPlaylist(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._library = os.path.join(self._dir, "library.jsonl")
+        write_library(self._library, [library_track(i) for i in range(10)])
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_slice_to_list_info(self):
+        playlist = YamahaPlaylist(YamahaLibrary(self._library), lambda: 0)
+        playlist.set_track_index(4)
+        list_info = playlist.slice_to_list_info(8, 8)
+        self.assertEqual(10, list_info["max_line"])
+        self.assertEqual(8, list_info["index"])
+        self.assertEqual(4, list_info["playing_index"])
+        self.assertEqual([{"text": "Track 8", "attribute": 2}, {"text": "Track 9", "attribute": 2}],
+                         list_info["list_info"])
+        self.assertEqual(playlist.slice_to_list_info(0, 3)["list_info"],
+                         [{"text": f"Track {i}", "attribute": 2} for i in range(3)])
+
+    def test_start_times_from_index(self):
+        playlist = YamahaPlaylist(YamahaLibrary(self._library), lambda: 0)
+        self.assertEqual(sum(range(100, 110)), playlist.summary_time())
+        playlist.shuffle_on()
+        self.assertEqual(sum(range(100, 110)), playlist.summary_time())
+        playlist.shuffle_off()
+        self.assertEqual(array("q", [0, 100, 201]), playlist.position().order.start_times[:3])
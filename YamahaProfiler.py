@@ -0,0 +1,165 @@
+import cProfile
+import io
+import itertools
+import marshal
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+class YamahaProfiler:
+    # Профилирование работающего эмулятора по команде, без перезапуска:
+    # cProfile включается вокруг обработки отдельных запросов (все запросы N секунд или каждый N-й),
+    # результаты по запросам складываются в одну статистику pstats.
+    # Одновременно профилируется только один запрос: профилировщик у процесса один (в Python 3.12+
+    # включение второго cProfile.Profile() из другого потока - ValueError), параллельные запросы пропускаются.
+    # Параллельно tracemalloc сравнивает снимки памяти на старте и в момент отчёта.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = False
+        self._deadline = None
+        self._every = 1
+        self._counter = itertools.count()
+        self._profile = None
+        self._stats = None
+        self._profiled_requests = 0
+        self._started_at = None
+        self._stopped_at = None
+        self._own_tracemalloc = False
+        self._start_snapshot = None
+        self._stop_snapshot = None
+
+    def start(self, seconds: float = None, every: int = 1, frames: int = 1, memory: bool = True):
+        assert seconds is None or seconds > 0, "Profiling duration must be positive"
+        assert every > 0, "Profiling step must be positive"
+        assert frames > 0, "Traceback frames count must be positive"
+        with self._lock:
+            self._stop_tracemalloc()
+            self._active = True
+            self._deadline = None if seconds is None else time.monotonic() + seconds
+            self._every = every
+            self._counter = itertools.count()
+            self._stats = None
+            self._profiled_requests = 0
+            self._started_at = time.time()
+            self._stopped_at = None
+            self._stop_snapshot = None
+            self._start_snapshot = None
+            if memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(frames)
+                    self._own_tracemalloc = True
+                self._start_snapshot = self._take_snapshot()
+
+    def stop(self):
+        with self._lock:
+            self._stop()
+
+    def _stop(self):
+        if not self._active:
+            return
+        self._active = False
+        self._stopped_at = time.time()
+        if self._start_snapshot is not None:
+            self._stop_snapshot = self._take_snapshot()
+        self._stop_tracemalloc()
+
+    def _stop_tracemalloc(self):
+        if self._own_tracemalloc:
+            tracemalloc.stop()
+            self._own_tracemalloc = False
+
+    @staticmethod
+    def _take_snapshot():
+        # выделения памяти самого профилировщика в отчёт не попадают
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, pstats.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def begin_request(self):
+        # вызывается перед обработкой запроса: профиль или None, если этот запрос не профилируется
+        if not self._active:
+            return None
+        if self._deadline is not None and time.monotonic() >= self._deadline:
+            self.stop()
+            return None
+        if next(self._counter) % self._every != 0:
+            return None
+
+        with self._lock:
+            if self._profile is not None:
+                return None
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                return None  # профилировщик процесса занят другим инструментом
+            self._profile = profile
+            return profile
+
+    def end_request(self, profile: cProfile.Profile):
+        if profile is None:
+            return
+        profile.disable()
+        with self._lock:
+            self._profile = None
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self._profiled_requests += 1
+
+    def status(self):
+        return {
+            "active": self._active,
+            "profiled_requests": self._profiled_requests,
+            "every": self._every,
+            "seconds_left": None if self._deadline is None or not self._active
+            else max(0.0, round(self._deadline - time.monotonic(), 3)),
+            "memory": self._start_snapshot is not None
+        }
+
+    def _memory_diff(self, group_by: str):
+        if self._start_snapshot is None:
+            return []
+        snapshot = self._stop_snapshot
+        if snapshot is None:
+            snapshot = self._take_snapshot()
+        return snapshot.compare_to(self._start_snapshot, group_by)
+
+    def pstats_dump(self):
+        # тот же формат, что у pstats.Stats.dump_stats(): открывается через pstats.Stats(filename)
+        with self._lock:
+            assert self._stats is not None, "No profiled requests"
+            return marshal.dumps(self._stats.stats)
+
+    def report(self, sort: str = "cumulative", limit: int = 30, group_by: str = "lineno"):
+        assert group_by in ("lineno", "filename", "traceback"), "Wrong group, lineno or filename or traceback expected"
+        with self._lock:
+            if self._active and self._deadline is not None and time.monotonic() >= self._deadline:
+                self._stop()
+
+            output = io.StringIO()
+            status = self.status()
+            output.write("profiling: " + ", ".join(f"{key}={value}" for key, value in status.items()) + "\n\n")
+
+            if self._stats is None:
+                output.write("no profiled requests\n")
+            else:
+                stats = pstats.Stats(stream=output)
+                stats.add(self._stats)
+                stats.sort_stats(sort).print_stats(limit)
+
+            memory_diff = self._memory_diff(group_by)
+            if memory_diff:
+                output.write(f"top {limit} allocation sites (difference since start):\n")
+                for stat in memory_diff[:limit]:
+                    output.write(f"{stat}\n")
+                    if group_by == "traceback":
+                        for line in stat.traceback.format():
+                            output.write(f"    {line}\n")
+            return output.getvalue().encode("utf-8")
@@ -0,0 +1,194 @@
+import unittest
+import urllib.parse
+
+
+API_PREFIX = "YamahaExtendedControl"
+API_VERSIONS = ("v1",)
+
+ZONES = ("main", "zone1", "zone2", "zone3")
+INPUTS = ("netusb", "tuner", "cd")
+SENDERS = ("system",) + ZONES + INPUTS
+
+
+def to_boolean(value: str):
+    assert value in ("true", "false")
+    return value == "true"
+
+
+def one_of(*values):
+    def convert(value: str):
+        assert value in values, "Wrong value '" + value + "', " + " or ".join(values) + " expected"
+        return value
+
+    return convert
+
+
+class optional:
+    # необязательный параметр запроса: если его нет - в обработчик передаётся None
+    def __init__(self, convert):
+        self.convert = convert
+
+
+class Route:
+    def __init__(self, action: str, handler, senders: tuple, params: dict, feedback: bool, watch=None):
+        self.action = action
+        self.handler = handler
+        self.senders = senders
+        self.params = params
+        self.feedback = feedback
+        # watch(system, sender) -> YamahaState, изменения которого ждёт долгий опрос этого действия
+        self.watch = watch
+
+    def parse_params(self, query: str):
+        raw_params = dict(urllib.parse.parse_qsl(query)) if query else {}
+        params = {}
+        for name, convert in self.params.items():
+            if isinstance(convert, optional):
+                if name not in raw_params:
+                    params[name] = None
+                    continue
+                convert = convert.convert
+
+            assert name in raw_params, f"Missing query parameter '{name}'"
+            params[name] = convert(raw_params[name])
+        return params
+
+    def invoke(self, system, sender: str, params: dict):
+        return self.handler(system, sender, **params)
+
+    def __call__(self, system, sender: str, query: str):
+        return self.invoke(system, sender, self.parse_params(query))
+
+
+class RouteTable:
+    # таблица маршрутов строится один раз при импорте модуля с обработчиками:
+    # (версия api, отправитель, действие) -> маршрут
+    def __init__(self, prefix: str = API_PREFIX, versions: tuple = API_VERSIONS):
+        self._prefix = prefix
+        self._versions = versions
+        self._routes = {}
+        self._actions = {}
+
+    def route(self, action: str, senders: tuple, params: dict = None, feedback: bool = False, watch=None):
+        def register(handler):
+            self.add(Route(action, handler, senders, params or {}, feedback, watch))
+            return handler
+
+        return register
+
+    def add(self, route: Route):
+        assert route.action not in self._actions, f"Route '{route.action}' is already registered"
+        assert all(sender in SENDERS for sender in route.senders), "Unknown sender"
+        self._actions[route.action] = route
+        for version in self._versions:
+            for sender in route.senders:
+                self._routes[(version, sender, route.action)] = route
+
+    def resolve(self, path: str):
+        # пример пути: "/YamahaExtendedControl/v1/main/getStatus"
+        # разобьётся на: ['', 'YamahaExtendedControl', 'v1', 'main', 'getStatus']
+        parts = path.split("/")
+        if len(parts) != 5 or parts[0] != "" or parts[1] != self._prefix:
+            return None, None
+
+        _, _, version, sender, action = parts
+        route = self.find(version, sender, action)
+        if route is not None:
+            return route, sender
+        return None, None
+
+    def resolve_batch(self, path: str):
+        # пакет команд: "/YamahaExtendedControl/v1/batch" -> версия api или None
+        parts = path.split("/")
+        if len(parts) != 4 or parts[0] != "" or parts[1] != self._prefix or parts[3] != "batch" \
+                or parts[2] not in self._versions:
+            return None
+        return parts[2]
+
+    def find(self, version: str, sender: str, action: str):
+        route = self._routes.get((version, sender, action))
+        if route is not None:
+            return route
+
+        # неизвестное действие - 404, известное действие с неподходящим отправителем - ошибка запроса
+        route = self._actions.get(action)
+        if route is None or version not in self._versions:
+            return None
+
+        assert sender in SENDERS, "Unknown sender"
+        assert False, "Wrong sender, " + " or ".join(route.senders) + " expected"
+
+    def endpoints(self):
+        result = []
+        for (version, sender, action), route in self._routes.items():
+            endpoint = f"/{self._prefix}/{version}/{sender}/{action}"
+            if route.params:
+                endpoint += "?" + "&".join(route.params.keys())
+            result.append(endpoint)
+        return sorted(result)
+
+
+class TestRouteTable(unittest.TestCase):
+    def setUp(self):
+        self._routes = RouteTable()
+
+        @self._routes.route("setVolume", ZONES, params={"volume": int, "step": optional(int)})
+        def set_volume(system, sender, volume, step):
+            return sender, volume, step
+
+        @self._routes.route("getStatus", ZONES, feedback=True)
+        def get_status(system, sender):
+            return sender
+
+    def test_resolve(self):
+        route, sender = self._routes.resolve("/YamahaExtendedControl/v1/zone2/setVolume")
+        self.assertEqual("setVolume", route.action)
+        self.assertEqual("zone2", sender)
+        self.assertTrue(self._routes.resolve("/YamahaExtendedControl/v1/main/getStatus")[0].feedback)
+
+    def test_resolve_unknown_path(self):
+        for path in ("/YamahaExtendedControl/v1/main/unknownAction",
+                     "/YamahaExtendedControl/v2/main/getStatus",
+                     "/OtherPrefix/v1/main/getStatus",
+                     "/YamahaExtendedControl/v1/main",
+                     "/YamahaExtendedControl/v1/main/getStatus/extra",
+                     "YamahaExtendedControl/v1/main/getStatus/"):
+            self.assertEqual((None, None), self._routes.resolve(path), path)
+
+    def test_find_unknown_action(self):
+        self.assertIsNone(self._routes.find("v1", "main", "unknownAction"))
+
+    def test_find_unknown_sender(self):
+        with self.assertRaisesRegex(AssertionError, "Unknown sender"):
+            self._routes.find("v1", "kitchen", "getStatus")
+
+    def test_find_wrong_sender(self):
+        with self.assertRaisesRegex(AssertionError, "Wrong sender"):
+            self._routes.find("v1", "netusb", "getStatus")
+
+    def test_parse_params(self):
+        route = self._routes.find("v1", "main", "setVolume")
+        self.assertEqual({"volume": 20, "step": None}, route.parse_params("volume=20"))
+        self.assertEqual({"volume": 20, "step": 5}, route.parse_params("volume=20&step=5&unused=1"))
+        self.assertEqual(("main", 20, None), route(None, "main", "volume=20"))
+
+    def test_parse_missing_params(self):
+        route = self._routes.find("v1", "main", "setVolume")
+        for query in ("", None, "step=5"):
+            with self.assertRaisesRegex(AssertionError, "Missing query parameter 'volume'"):
+                route.parse_params(query)
+
+    def test_parse_bad_params(self):
+        route = self._routes.find("v1", "main", "setVolume")
+        with self.assertRaises(ValueError):
+            route.parse_params("volume=loud")
+        with self.assertRaises(ValueError):
+            route.parse_params("volume=20&step=up")
+
+    def test_parse_one_of(self):
+        convert = one_of("on", "standby")
+        self.assertEqual("on", convert("on"))
+        with self.assertRaisesRegex(AssertionError, "on or standby expected"):
+            convert("off")
+        with self.assertRaises(AssertionError):
+            to_boolean("yes")
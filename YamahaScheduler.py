@@ -0,0 +1,162 @@
+import heapq
+import itertools
+import threading
+import time
+import unittest
+
+from YamahaClock import RealClock, AcceleratedClock, ManualClock
+from YamahaPlaylist import YamahaPlaylist
+from YamahaTrack import YamahaTrack
+
+
+class ScheduledPlaylist:
+    def __init__(self, playlist, lock):
+        self.playlist = playlist
+        self.lock = lock    # блокировка писателя ресивера, которому принадлежит плейлист
+        self.timer = None   # номер действующей записи в куче таймеров
+
+
+class YamahaScheduler:
+    # Смена треков в момент окончания трека, а не при следующем чтении: одна куча сроков
+    # для всех плейлистов всех ресиверов и один фоновый поток.
+    # В срок поток под блокировкой писателя фиксирует новую позицию в плейлисте (YamahaPlaylist.apply_transition),
+    # так что наблюдатели - UDP-события, журнал, долгие опросы - срабатывают вовремя,
+    # а чтения не пересчитывают пропущенные переходы.
+    # Срок пересчитывается после каждого изменения плейлиста и после скачка или смены скорости часов.
+    BOUNDARY_MARGIN_SEC = 0.01
+
+    def __init__(self, clock: RealClock = None):
+        self._clock = clock or RealClock()
+        self._condition = threading.Condition()
+        self._timers = []       # куча (time.monotonic(), номер, плейлист)
+        self._pending = set()   # плейлисты, для которых нужно пересчитать срок
+        self._playlists = []
+        self._sequence = itertools.count()
+        self._stopped = False
+        self._thread = None
+
+    def add(self, playlist, lock):
+        scheduled = ScheduledPlaylist(playlist, lock)
+        self._playlists.append(scheduled)
+        playlist.add_observer(lambda changes: self._reschedule(scheduled))
+        self._reschedule(scheduled)
+
+    def start(self):
+        self._clock.add_observer(self._reschedule_all)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _reschedule(self, scheduled: ScheduledPlaylist):
+        # наблюдатель плейлиста: вызывается в потоке писателя, поэтому только отмечаем плейлист
+        if threading.current_thread() is self._thread:
+            return  # изменение сделал сам планировщик, срок будет пересчитан сразу после него
+        with self._condition:
+            self._pending.add(scheduled)
+            self._condition.notify()
+
+    def _reschedule_all(self):
+        with self._condition:
+            self._pending.update(self._playlists)
+            self._condition.notify()
+
+    def _schedule(self, scheduled: ScheduledPlaylist, now: float):
+        scheduled.timer = None
+        delay = scheduled.playlist.next_transition_delay()
+        if delay is not None:
+            delay = self._clock.real_delay(delay)
+        if delay is None:
+            return  # плейлист не играет или ручные часы: переход случится только после команды или сдвига часов
+        scheduled.timer = next(self._sequence)
+        heapq.heappush(self._timers,
+                       (now + delay + YamahaScheduler.BOUNDARY_MARGIN_SEC, scheduled.timer, scheduled))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not self._pending:
+                    timeout = None
+                    if self._timers:
+                        timeout = self._timers[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    self._condition.wait(timeout)
+                if self._stopped:
+                    return
+
+                now = time.monotonic()
+                due, self._pending = self._pending, set()
+                while self._timers and self._timers[0][0] <= now:
+                    _, timer, scheduled = heapq.heappop(self._timers)
+                    if timer == scheduled.timer:
+                        due.add(scheduled)
+
+            for scheduled in due:
+                with scheduled.lock:
+                    scheduled.playlist.apply_transition()
+                with self._condition:
+                    self._schedule(scheduled, time.monotonic())
+
+
+class TestYamahaScheduler(unittest.TestCase):
+    def _start(self, clock, durations: list):
+        playlist = YamahaPlaylist([YamahaTrack(track=f"Track {i}", album="", artist="", total_time=duration)
+                                   for i, duration in enumerate(durations)], clock)
+        playlist.play()
+        scheduler = YamahaScheduler(clock)
+        scheduler.add(playlist, threading.RLock())
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+
+        self._changes = []
+        self._changed = threading.Event()
+
+        def observer(changes):
+            self._changes.append(playlist._state.track_index)
+            self._changed.set()
+
+        playlist.add_observer(observer)
+        return playlist, scheduler
+
+    def _wait_change(self):
+        self.assertTrue(self._changed.wait(5), "Transition is not applied")
+        time.sleep(0.1)  # лишние уведомления успели бы прийти
+
+    def test_manual_clock_advance(self):
+        clock = ManualClock(1000)
+        playlist, scheduler = self._start(clock, [10, 20, 30])
+        # ручные часы сами не идут - таймеров нет
+        self.assertEqual([], scheduler._timers)
+        clock.advance(12)
+        self._wait_change()
+        self.assertEqual([1], self._changes)
+        self.assertEqual(1, playlist._state.track_index)
+        self.assertEqual(2, playlist._state.play_time_sec)
+
+    def test_timer_is_rescheduled(self):
+        # 100 секунд часов за секунду: первый трек заканчивается через 0.1 с, второй - ещё через 0.2 с
+        clock = AcceleratedClock(100, start=1000)
+        playlist, scheduler = self._start(clock, [10, 20, 30])
+        scheduled = scheduler._playlists[0]
+        first_timer = scheduled.timer
+        self.assertIsNotNone(first_timer)
+        self.assertTrue(self._changed.wait(5), "Transition is not applied")
+        deadline = time.monotonic() + 5
+        while scheduled.timer == first_timer and time.monotonic() < deadline:
+            time.sleep(0.001)
+        with scheduler._condition:
+            self.assertEqual(1, playlist._state.track_index)
+            self.assertEqual([1], self._changes)
+            # в куче действующий срок окончания второго трека
+            live = [timer for timer in scheduler._timers if timer[1] == scheduled.timer]
+            self.assertEqual(1, len(live))
+            self.assertLessEqual(live[0][0] - time.monotonic(),
+                                 clock.real_delay(20) + YamahaScheduler.BOUNDARY_MARGIN_SEC)
+        self._changed.clear()
+        self.assertTrue(self._changed.wait(5), "Transition is not applied")
+        self.assertEqual([1, 2], self._changes)
@@ -0,0 +1,37 @@
+class YamahaState:
+    # счётчик версии состояния: каждый изменяющий метод увеличивает его,
+    # по версии проверяется актуальность закэшированных ответов
+    def __init__(self):
+        self._version = 0
+        self._observers = []
+
+    def version(self):
+        return self._version
+
+    def transition_token(self):
+        # версия для долгого опроса: меняется при изменениях состояния, но не от хода времени внутри трека
+        return str(self._version)
+
+    def next_transition_delay(self):
+        # через сколько секунд состояние изменится само по себе (None - только по команде)
+        return None
+
+    def add_observer(self, observer):
+        # observer(changes: dict) вызывается после каждого изменения, в потоке писателя
+        self._observers.append(observer)
+
+    def checkpoint(self):
+        # снимок полей состояния для отката пакета команд (версия и наблюдатели не откатываются);
+        # списки и словари копируются, потому что изменяются на месте
+        return {name: value.copy() if isinstance(value, (list, dict)) else value
+                for name, value in self.__dict__.items() if name not in ("_version", "_observers")}
+
+    def restore(self, checkpoint):
+        # версия после отката увеличивается, как после любого изменения: закэшированные ответы устаревают
+        self.__dict__.update(checkpoint)
+        self._touch()
+
+    def _touch(self, **changes):
+        self._version += 1
+        for observer in self._observers:
+            observer(changes)
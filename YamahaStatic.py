@@ -0,0 +1,190 @@
+import hashlib
+import mimetypes
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from collections import OrderedDict
+
+
+class StaticFile:
+    def __init__(self, path: str, size: int, mtime_ns: int, etag: str, content_type: str):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.etag = etag
+        self.content_type = content_type
+        self.content = None  # содержимое небольших часто запрашиваемых файлов хранится в памяти
+
+
+def file_etag(path: str):
+    # строгий ETag: хэш содержимого, не зависит от времени изменения файла
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return '"' + digest.hexdigest() + '"'
+
+
+def parse_range(header: str, size: int):
+    # поддерживается один диапазон "bytes=start-end", "bytes=start-" или "bytes=-suffix";
+    # возвращает (start, end) включительно, None - заголовок игнорируется, False - диапазон вне файла
+    unit, _, ranges = header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+
+    start, _, end = ranges.strip().partition("-")
+    if not (start or end) or (start and not start.isdigit()) or (end and not end.isdigit()):
+        return None
+
+    if not start:
+        suffix = int(end)
+        if suffix == 0 or size == 0:
+            return False
+        return max(0, size - suffix), size - 1
+
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+class StaticFiles:
+    # Файлы из каталогов с обложками альбомов (img/ и каталоги из --art-dir).
+    # Метаданные файла (размер, ETag) вычисляются один раз и обновляются при изменении файла,
+    # небольшие файлы держатся в памяти в LRU с ограничением по суммарному размеру.
+    MAX_CACHED_BYTES = 16 * 1024 * 1024
+    MAX_CACHED_FILE_BYTES = 1024 * 1024
+
+    def __init__(self, directories: list, max_cached_bytes: int = MAX_CACHED_BYTES,
+                 max_cached_file_bytes: int = MAX_CACHED_FILE_BYTES):
+        self._directories = [os.path.realpath(directory) for directory in directories]
+        self._max_cached_bytes = max_cached_bytes
+        self._max_cached_file_bytes = max_cached_file_bytes
+        self._files = OrderedDict()  # имя -> StaticFile
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    def _find(self, name: str):
+        for directory in self._directories:
+            path = os.path.realpath(os.path.join(directory, name))
+            # не выпускаем запросы за пределы каталога ("../config.json", симлинки наружу)
+            if os.path.commonpath((directory, path)) != directory:
+                continue
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def lookup(self, name: str):
+        path = self._find(name)
+        if path is None:
+            return None
+
+        stat = os.stat(path)
+        with self._lock:
+            static_file = self._files.get(name)
+            if static_file is not None and static_file.path == path and \
+                    static_file.mtime_ns == stat.st_mtime_ns and static_file.size == stat.st_size:
+                self._files.move_to_end(name)
+                return static_file
+
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        static_file = StaticFile(path, stat.st_size, stat.st_mtime_ns, file_etag(path), content_type)
+        if stat.st_size <= self._max_cached_file_bytes:
+            with open(path, "rb") as file:
+                static_file.content = file.read()
+
+        with self._lock:
+            self._forget(name)
+            self._files[name] = static_file
+            if static_file.content is not None:
+                self._cached_bytes += len(static_file.content)
+            while self._cached_bytes > self._max_cached_bytes:
+                self._forget(next(iter(self._files)))
+        return static_file
+
+    def _forget(self, name: str):
+        static_file = self._files.pop(name, None)
+        if static_file is not None and static_file.content is not None:
+            self._cached_bytes -= len(static_file.content)
+
+
+class TestParseRange(unittest.TestCase):
+    def test_ranges(self):
+        self.assertEqual((0, 99), parse_range("bytes=0-99", 1000))
+        self.assertEqual((900, 999), parse_range("bytes=900-", 1000))
+        self.assertEqual((990, 999), parse_range("bytes=990-2000", 1000))
+        self.assertEqual((5, 5), parse_range(" bytes = 5-5", 1000))
+
+    def test_suffix_range(self):
+        self.assertEqual((900, 999), parse_range("bytes=-100", 1000))
+        self.assertEqual((0, 999), parse_range("bytes=-5000", 1000))
+
+    def test_unsatisfiable_range(self):
+        self.assertIs(False, parse_range("bytes=1000-", 1000))
+        self.assertIs(False, parse_range("bytes=500-400", 1000))
+        self.assertIs(False, parse_range("bytes=-0", 1000))
+        self.assertIs(False, parse_range("bytes=-10", 0))
+
+    def test_ignored_header(self):
+        for header in ("items=0-10", "bytes=0-10,20-30", "bytes=-", "bytes=a-10", "bytes=0-b", "bytes=1.5-"):
+            self.assertIsNone(parse_range(header, 1000), header)
+
+
+class TestStaticFiles(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._art_dir = os.path.join(self._dir, "img")
+        os.mkdir(self._art_dir)
+        self._write(os.path.join(self._art_dir, "cover.jpg"), b"cover")
+        self._write(os.path.join(self._dir, "config.json"), b"{}")
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    @staticmethod
+    def _write(path: str, content: bytes):
+        with open(path, "wb") as file:
+            file.write(content)
+
+    def test_lookup(self):
+        static_file = StaticFiles([self._art_dir]).lookup("cover.jpg")
+        self.assertEqual(b"cover", static_file.content)
+        self.assertEqual(5, static_file.size)
+        self.assertEqual("image/jpeg", static_file.content_type)
+        self.assertEqual(file_etag(static_file.path), static_file.etag)
+
+    def test_traversal(self):
+        static_files = StaticFiles([self._art_dir])
+        for name in ("../config.json", "../img/../config.json", os.path.join(self._dir, "config.json"),
+                     "missing.jpg", "."):
+            self.assertIsNone(static_files.lookup(name), name)
+
+    def test_symlink_outside(self):
+        os.symlink(os.path.join(self._dir, "config.json"), os.path.join(self._art_dir, "link.jpg"))
+        self.assertIsNone(StaticFiles([self._art_dir]).lookup("link.jpg"))
+
+    def test_changed_file_is_reloaded(self):
+        static_files = StaticFiles([self._art_dir])
+        first = static_files.lookup("cover.jpg")
+        self.assertIs(first, static_files.lookup("cover.jpg"))
+        path = os.path.join(self._art_dir, "cover.jpg")
+        self._write(path, b"new cover")
+        os.utime(path, ns=(first.mtime_ns + 10 ** 9, first.mtime_ns + 10 ** 9))
+        second = static_files.lookup("cover.jpg")
+        self.assertEqual(b"new cover", second.content)
+        self.assertNotEqual(first.etag, second.etag)
+
+    def test_cache_limits(self):
+        self._write(os.path.join(self._art_dir, "big.jpg"), b"x" * 10)
+        self._write(os.path.join(self._art_dir, "other.jpg"), b"y" * 8)
+        static_files = StaticFiles([self._art_dir], max_cached_bytes=12, max_cached_file_bytes=8)
+        self.assertIsNone(static_files.lookup("big.jpg").content)
+        static_files.lookup("cover.jpg")
+        static_files.lookup("other.jpg")
+        # 5 + 8 байт не помещаются: вытесняются самые давние файлы
+        self.assertEqual(["other.jpg"], list(static_files._files))
+        self.assertEqual(8, static_files._cached_bytes)
@@ -1,11 +1,20 @@
 import json
+import os
+import threading
+import time
+import unittest
 
 from YamahaZone import YamahaZone
 from YamahaNetusb import YamahaNetusb, YamahaNetusbPreset
 from YamahaTuner import YamahaTuner, YamahaTunerPreset
 from YamahaCD import YamahaCD
-from YamahaTrack import YamahaTrack
+from YamahaTrack import load_track, YamahaTrackList
+from YamahaLibrary import YamahaLibrary
 from YamahaPlaylist import YamahaPlaylist
+from YamahaCache import ResponseCache, PageCache
+from YamahaEvents import YamahaEvents, zone_event, input_event
+from YamahaJournal import YamahaJournal
+from YamahaConfigCache import load_compiled, refresh_cache
 
 
 def load_zones(data: dict):
@@ -21,17 +30,40 @@ def load_zones(data: dict):
     return zones
 
 
-def load_playlist(playlist: list):
+def load_playlist(playlist, config_dir: str = "", art_url_base: str = None):
+    # плейлист задаётся списком треков прямо в конфиге
+    # или ссылкой на внешнюю медиатеку: {"library": "library.jsonl"} (путь относительно конфига)
+    if isinstance(playlist, dict):
+        return YamahaLibrary(os.path.join(config_dir, playlist["library"]), art_url_base)
+
     result = []
     for item in playlist:
-        result.append(YamahaTrack(track=item["track"],
-                                  album=item["album"],
-                                  albumart_url=item.get("albumart_url", ""),
-                                  artist=item["artist"],
-                                  total_time=item["total_time"]))
+        result.append(load_track(item, art_url_base))
     return result
 
 
+# разделы конфига, которые меняются во время работы (store(), журнал)
+STATE_SECTIONS = ("zones_info", "presets")
+
+
+def compile_config(content: bytes, art_url_base: str = None):
+    # разбор конфига и загрузка треков плейлистов; результат хранится в кэше конфига (YamahaConfigCache).
+    # Изменяемые разделы возвращаются отдельно: они не входят в скомпилированную часть кэша
+    data = json.loads(content)
+    for name, playlist in data["playlist"].items():
+        if not isinstance(playlist, dict):
+            data["playlist"][name] = YamahaTrackList(load_playlist(playlist, art_url_base=art_url_base))
+    state = {section: data.pop(section) for section in STATE_SECTIONS}
+    return data, state
+
+
+def open_playlist(playlist, config_dir: str, art_url_base: str = None):
+    # внешняя медиатека не кэшируется: у неё свой индекс, файлы отображаются в память при каждом запуске
+    if isinstance(playlist, dict):
+        return load_playlist(playlist, config_dir, art_url_base)
+    return playlist
+
+
 def store_zones_info(zones_list: list):
     result = {}
     for zone in zones_list:
@@ -67,6 +99,42 @@ def store_netusb_presets_list(presets: list):
     return result
 
 
+def merge_config(data: dict, overrides: dict):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(data.get(key), dict):
+            merge_config(data[key], value)
+        else:
+            data[key] = value
+    return data
+
+
+def create_config_from_template(config_file: str, template_file: str, overrides: dict):
+    # конфиг ресивера создаётся один раз из общего шаблона, дальше состояние хранится в нём
+    if os.path.exists(config_file):
+        return
+
+    with open(template_file, "r") as file:
+        data = json.load(file)
+    with open(config_file, "w") as file:
+        file.write(json.dumps(merge_config(data, overrides), indent=4))
+
+
+def journal_path(config_file: str):
+    return config_file + ".journal"
+
+
+def replay_journal(data: dict, records: dict):
+    # записи журнала новее конфига - подставляем их вместо сохранённых значений
+    for key, value in records.items():
+        if key.startswith("zone:"):
+            data["zones_info"][key[len("zone:"):]] = value
+        elif key == "presets:tuner":
+            data["presets"]["tuner"] = value
+        elif key == "presets:netusb":
+            data["presets"]["netusb"] = value
+    return data
+
+
 def is_tuner_input(input: str):
     return input == "tuner"
 
@@ -80,40 +148,180 @@ def is_netusb_input(input: str):
 
 
 class YamahaSystem:
-    def __new__(cls):
-        return cls.instance
+    # состояние одного ресивера; в одном процессе может работать несколько независимых ресиверов
+    def __init__(self, data: dict, journal: YamahaJournal, config_file: str, compact_json: bool = False,
+                 shuffle_seed: int = None, whats_a_time=time.time, art_url_base: str = None):
+        # data - конфиг с уже применённым журналом (см. load())
+        self._config_file = config_file
+        self._features = data["features"]
+        self._zones = load_zones(data)
+        config_dir = os.path.dirname(config_file)
+        netusb_playlist = YamahaPlaylist(open_playlist(data["playlist"]["netusb"], config_dir, art_url_base),
+                                         whats_a_time=whats_a_time, shuffle_seed=shuffle_seed)
+        cd_playlist = YamahaPlaylist(open_playlist(data["playlist"]["cd"], config_dir, art_url_base),
+                                     whats_a_time=whats_a_time, shuffle_seed=shuffle_seed)
+        self._netusb = YamahaNetusb(load_netusb_presets(data["presets"]["netusb"]), netusb_playlist)
+        self._tuner = YamahaTuner(load_tuner_presets(data["presets"]["tuner"]))
+        self._cd = YamahaCD(cd_playlist)
+        self._playlists = [netusb_playlist, cd_playlist]
+        # всё изменяемое состояние ресивера - для снимков при выполнении пакета команд
+        self._states = [netusb_playlist, cd_playlist, self._netusb, self._tuner, self._cd] + self._zones
+
+        # все изменения состояния выполняются под одной блокировкой писателя,
+        # читатели её не берут: плейлисты и тюнер отдают неизменяемые снимки состояния.
+        # Пока выполняется пакет команд, поколение нечётное (см. begin_batch() и read())
+        self._write_lock = threading.RLock()
+        self._batch_generation = 0
+        self._deferred_hooks = None
+
+        # getFeatures не меняется во время работы - кодируем ответ один раз при загрузке
+        self._responses = ResponseCache(compact=compact_json)
+        self._features_response = self._responses.encode(self._features)
+        self._success_response = self._responses.encode({})
+        self._list_pages = PageCache(self._responses)
+
+        # изменения зон и источников рассылаются подписчикам UDP-событиями
+        events = YamahaEvents()
+        for zone in self._zones:
+            self._add_hook(zone, lambda changes, name=zone.name: events.notify(name, zone_event(changes)))
+        for name in ("netusb", "tuner", "cd"):
+            self._add_hook(self.get_input(name),
+                           lambda changes, name=name: events.notify(name, input_event(changes)))
+        self._events = events
+
+        # изменения зон и пресетов дописываются в журнал, а не сохраняются перезаписью всего конфига
+        tuner = self._tuner
+        netusb = self._netusb
+        for zone in self._zones:
+            self._add_hook(zone, lambda changes, zone=zone: journal.append("zone:" + zone.name, zone.status()))
+        self._add_hook(tuner, lambda changes: journal.append("presets:tuner",
+                                                             store_tuner_presets_list(tuner.presets_list())))
+        self._add_hook(netusb, lambda changes: journal.append("presets:netusb",
+                                                              store_netusb_presets_list(netusb.presets_list())))
+        self._journal = journal
 
     @classmethod
-    def load(cls, filename: str, filter: str):
-        data = None
-        with open(filename, "r") as file:
-            data = json.load(file)
-
-        cls.instance = super(YamahaSystem, cls).__new__(cls)
-        cls.instance._features = data["features"]
-        cls.instance._zones = load_zones(data)
-        cls.instance._netusb = YamahaNetusb(load_netusb_presets(data["presets"]["netusb"]),
-                                            YamahaPlaylist(load_playlist(data["playlist"]["netusb"])))
+    def load(cls, filename: str, compact_json: bool = False, shuffle_seed: int = None, whats_a_time=time.time,
+             art_url_base: str = None):
+        compiled, state = load_compiled(filename, art_url_base, lambda content: compile_config(content, art_url_base))
+        data = dict(compiled, **state)
 
-        cls.instance._tuner = YamahaTuner(load_tuner_presets(data["presets"]["tuner"]))
-        cls.instance._cd = YamahaCD(YamahaPlaylist(load_playlist(data["playlist"]["cd"])))
-        cls.instance._filter = filter
+        journal = YamahaJournal(journal_path(filename))
+        replay_journal(data, journal.replay())
+        return cls(data, journal, filename, compact_json, shuffle_seed, whats_a_time, art_url_base)
 
-    @classmethod
-    def store(cls, filename: str):
+    def store(self, filename: str):
         data = None
         with open(filename, "r") as file:
+            previous_stat = os.fstat(file.fileno())
             data = json.load(file)
 
-        data["zones_info"] = store_zones_info(cls.instance._zones)
-        data["presets"]["tuner"] = store_tuner_presets_list(cls.instance._tuner.presets_list())
-        data["presets"]["netusb"] = store_netusb_presets_list(cls.instance._netusb.presets_list())
-        with open(filename, "w") as file:
-            file.write(json.dumps(data, indent=4))
+        data["zones_info"] = store_zones_info(self._zones)
+        data["presets"]["tuner"] = store_tuner_presets_list(self._tuner.presets_list())
+        data["presets"]["netusb"] = store_netusb_presets_list(self._netusb.presets_list())
+
+        # пишем во временный файл и подменяем конфиг целиком, чтобы сбой не оставил его наполовину записанным
+        content = json.dumps(data, indent=4).encode()
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, "wb") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_filename, filename)
+        # плейлисты и возможности не изменились - скомпилированный кэш конфига остаётся действительным
+        refresh_cache(filename, previous_stat, content, {section: data[section] for section in STATE_SECTIONS})
+
+    def compact_journal(self):
+        # снимок состояния в конфиг + очистка журнала, без параллельных изменений
+        with self.writer():
+            self.store(self._config_file)
+            self._journal.reset()
+
+    def schedule_transitions(self, scheduler):
+        # смена треков в срок, а не при следующем запросе (YamahaScheduler)
+        for playlist in self._playlists:
+            scheduler.add(playlist, self._write_lock)
+
+    def checkpoint(self):
+        # вызывается под блокировкой писателя
+        return [state.checkpoint() for state in self._states]
+
+    def restore(self, checkpoint: list):
+        for state, state_checkpoint in zip(self._states, checkpoint):
+            state.restore(state_checkpoint)
+
+    def journal(self):
+        return self._journal
 
     def features(self):
         return self._features
 
+    def events(self):
+        return self._events
+
+    def writer(self):
+        return self._write_lock
+
+    def _add_hook(self, state, hook):
+        # внешние наблюдатели (UDP-события, журнал): во время пакета команд откладываются до его завершения
+        state.add_observer(lambda changes: self._run_hook(hook, changes))
+
+    def _run_hook(self, hook, changes: dict):
+        if self._deferred_hooks is not None:
+            self._deferred_hooks.append((hook, changes))
+        else:
+            hook(changes)
+
+    def begin_batch(self):
+        # вызывается под блокировкой писателя: промежуточные состояния пакета не видны ни читателям,
+        # ни подписчикам событий, ни журналу
+        self._batch_generation += 1
+        self._deferred_hooks = []
+
+    def end_batch(self, commit: bool):
+        # commit=False - пакет откатан: отложенные события и записи журнала отбрасываются
+        deferred, self._deferred_hooks = self._deferred_hooks, None
+        self._batch_generation += 1
+        if commit:
+            for hook, changes in deferred:
+                hook(changes)
+
+    def read(self, read):
+        # читатели не берут блокировку писателя. Если во время чтения выполнялся пакет команд
+        # (поколение нечётное или изменилось), чтение повторяется под блокировкой - после завершения пакета
+        generation = self._batch_generation
+        if generation % 2 == 0:
+            result = read()
+            if self._batch_generation == generation:
+                return result
+        with self._write_lock:
+            return read()
+
+    def responses(self):
+        return self._responses
+
+    def features_response(self):
+        return self._features_response
+
+    def success_response(self):
+        return self._success_response
+
+    def status_response(self, zone_name: str):
+        zone = self.get_zone(zone_name)
+        return self._responses.get(("getStatus", zone_name), zone.state_key(), zone.status)
+
+    def list_info_response(self, index_from: int, chunk_size: int):
+        # страница списка кэшируется целиком, в неё подставляется только текущий playing_index
+        netusb = self.netusb()
+        page = self._list_pages.get((netusb.list_version(), index_from, chunk_size),
+                                    lambda: netusb.list_info(index_from=index_from, chunk_size=chunk_size),
+                                    "playing_index")
+        return page.render(netusb.playing_index())
+
+    def play_info_response(self, input_name: str):
+        yamaha_input = self.get_input(input_name)
+        return self._responses.get(("getPlayInfo", input_name), yamaha_input.state_key(), yamaha_input.play_info)
+
     def get_zone(self, name):
         zones = list(filter(lambda z: z.name == name, self._zones))
         if len(zones) > 0:
@@ -146,13 +354,45 @@ class YamahaSystem:
 
 
 class load_yamaha:
-    def __init__(self, config_file: str, filter: str):
+    def __init__(self, config_file: str, compact_json: bool = False, shuffle_seed: int = None, whats_a_time=time.time,
+                 art_url_base: str = None):
         self._config_file = config_file
-        self._filter = filter
+        self._compact_json = compact_json
+        self._shuffle_seed = shuffle_seed
+        self._whats_a_time = whats_a_time
+        self._art_url_base = art_url_base
+        self._system = None
 
     def __enter__(self):
-        YamahaSystem.load(self._config_file, self._filter)
+        self._system = YamahaSystem.load(self._config_file, self._compact_json, self._shuffle_seed, self._whats_a_time,
+                                         self._art_url_base)
+        self._system.events().start()
+        self._system.journal().start(compact=self._system.compact_journal)
+        return self._system
 
     def __exit__(self, type, value, traceback):
-        YamahaSystem.store(self._config_file)
-
+        self._system.events().stop()
+        self._system.journal().stop()
+
+
+class TestReplayJournal(unittest.TestCase):
+    def _data(self):
+        return {
+            "zones_info": {"main": {"volume": 10}, "zone2": {"volume": 20}},
+            "presets": {"tuner": [{"band": "fm", "number": 1}], "netusb": []}
+        }
+
+    def test_replays_zones_and_presets(self):
+        data = replay_journal(self._data(), {
+            "zone:main": {"volume": 30},
+            "presets:tuner": [],
+            "presets:netusb": [{"input": "server", "text": "Track"}]
+        })
+        self.assertEqual({"main": {"volume": 30}, "zone2": {"volume": 20}}, data["zones_info"])
+        self.assertEqual({"tuner": [], "netusb": [{"input": "server", "text": "Track"}]}, data["presets"])
+
+    def test_empty_journal_keeps_config(self):
+        self.assertEqual(self._data(), replay_journal(self._data(), {}))
+
+    def test_unknown_keys_are_ignored(self):
+        self.assertEqual(self._data(), replay_journal(self._data(), {"unknown": 1}))
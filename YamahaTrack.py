@@ -1,15 +1,41 @@
 class YamahaTrack(object):
-    def __init__(self):
-        self.track = ""
-        self.album = ""
-        self.albumart_url = ""
-        self.artist = ""
-        self.total_time = 0
-
-    def __init__(self, track: str, album: str, albumart_url: str, artist: str, total_time: int):
+    def __init__(self, track: str = "", album: str = "", albumart_url: str = "", artist: str = "", total_time: int = 0):
         self.track = track
         self.album = album
         self.albumart_url = albumart_url
         self.artist = artist
         self.total_time = total_time
 
+
+def load_track(item: dict, art_url_base: str = None):
+    # albumart_file - имя файла обложки в каталоге img/; если задан art_url_base,
+    # клиенты получают обложку с этого эмулятора, а не по внешнему адресу из albumart_url
+    albumart_url = item.get("albumart_url", "")
+    if art_url_base is not None and "albumart_file" in item:
+        albumart_url = art_url_base + item["albumart_file"]
+
+    return YamahaTrack(track=item["track"],
+                       album=item["album"],
+                       albumart_url=albumart_url,
+                       artist=item["artist"],
+                       total_time=item["total_time"])
+
+
+class YamahaTrackList:
+    # треки плейлиста из конфига по столбцам: несколько списков строк и чисел сохраняются в кэш конфига
+    # и читаются из него намного быстрее, чем тысячи объектов; YamahaTrack создаётся при обращении к треку
+    FIELDS = ("track", "album", "albumart_url", "artist", "total_time")
+
+    def __init__(self, tracks: list):
+        self._columns = tuple([getattr(track, field) for track in tracks] for field in YamahaTrackList.FIELDS)
+
+    def durations(self):
+        return self._columns[-1]
+
+    def __len__(self):
+        return len(self._columns[-1])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return YamahaTrack(*(column[index] for column in self._columns))
@@ -1,3 +1,6 @@
+import unittest
+
+from YamahaState import YamahaState
 from YamahaZone import YamahaZone
 
 
@@ -28,11 +31,12 @@ class YamahaTunerPreset:
         return self._number
 
 
-class YamahaTuner:
+class YamahaTuner(YamahaState):
     MIN_DAB_FREQ = 174000
     MAX_DAB_FREQ = 240000
 
     def __init__(self, presets: list):
+        super().__init__()
         self._band = "am"  # "am" / "fm" / "dab
         self._frequencies = {
             "am": 103100,
@@ -43,11 +47,21 @@ class YamahaTuner:
         self._current_preset = 0
         self._presets = presets
         self._no_preset = False
+        self._play_info = self._make_play_info()
+
+    def _touch(self, **changes):
+        # снимок для читателей публикуется после того, как изменение полностью применено
+        self._play_info = self._make_play_info()
+        super()._touch(**changes)
 
     def _apply_preset(self, preset):
+        # без _touch(): вызывающий метод публикует изменение один раз, когда обновлены все поля
         self._band = preset.band()
         self._frequencies[self._band] = preset.number()
 
+    def state_key(self):
+        return self.version()
+
     def frequency(self):
         return self._frequencies[self._band]
 
@@ -56,6 +70,7 @@ class YamahaTuner:
             self._no_preset = True
 
         self._frequencies[self._band] = freq
+        self._touch()
 
     def next_preset(self):
         self._current_preset += 1
@@ -63,6 +78,7 @@ class YamahaTuner:
             self._current_preset = 0
 
         self._apply_preset(self._presets[self._current_preset])
+        self._touch()
 
     def previous_preset(self):
         self._current_preset -= 1
@@ -70,6 +86,7 @@ class YamahaTuner:
             self._current_preset = len(self._presets) - 1
 
         self._apply_preset(self._presets[self._current_preset])
+        self._touch()
 
     def next_dab(self):
         self._dab_service_id = min(self._dab_service_id + 1, 65)
@@ -77,6 +94,7 @@ class YamahaTuner:
 
         if self._presets[self._current_preset].number() != self.frequency():
             self._no_preset = True
+        self._touch()
 
     def prev_dab(self):
         self._dab_service_id = max(self._dab_service_id - 1, 0)
@@ -84,8 +102,12 @@ class YamahaTuner:
 
         if self._presets[self._current_preset].number() != self.frequency():
             self._no_preset = True
+        self._touch()
 
     def play_info(self):
+        return self._play_info
+
+    def _make_play_info(self):
         preset_num = 0 if self._no_preset else int(self._current_preset + 1)
         result = {
             "band": self._band,
@@ -105,6 +127,7 @@ class YamahaTuner:
         self._no_preset = False
         self._current_preset = preset_index
         self._presets[preset_index] = YamahaTunerPreset(band=self._band, number=self._frequencies[self._band])
+        self._touch()
 
     def recall_preset(self, zone: YamahaZone, band: str, num: int):
         assert is_valid_band(band) or band == "common", "Wrong band"
@@ -119,6 +142,7 @@ class YamahaTuner:
         self._apply_preset(preset)
         self._current_preset = preset_index
         self._no_preset = False
+        self._touch()
 
     def set_band(self, band: str):
         assert is_valid_band(band), "Wrong band"
@@ -126,6 +150,7 @@ class YamahaTuner:
             self._no_preset = True
 
         self._band = band
+        self._touch()
 
 
 def switch_preset(tuner: YamahaTuner, direction: str):
@@ -134,3 +159,31 @@ def switch_preset(tuner: YamahaTuner, direction: str):
         tuner.next_preset()
     elif direction == "previous":
         tuner.previous_preset()
+
+
+class TestYamahaTuner(unittest.TestCase):
+    def setUp(self):
+        self._tuner = YamahaTuner([YamahaTunerPreset("fm", 98000), YamahaTunerPreset("am", 999)])
+        self._zone = YamahaZone(name="main", input_name="tv", mute=False, power="on", volume=20,
+                                sound_program="straight")
+        self._tuner.set_frequency(100000)
+        self._published = []
+        self._tuner.add_observer(lambda changes: self._published.append(self._tuner.play_info()))
+
+    def test_recall_preset_is_published_once(self):
+        version = self._tuner.version()
+        self._tuner.recall_preset(self._zone, "fm", 2)
+        self.assertEqual(version + 1, self._tuner.version())
+        # единственное уведомление видит уже полностью применённый пресет
+        self.assertEqual(1, len(self._published))
+        self.assertEqual("am", self._published[0]["band"])
+        self.assertEqual({"freq": 999, "preset": 2}, self._published[0]["am"])
+        self.assertEqual("tuner", self._zone.input_name)
+
+    def test_switch_preset_is_published_once(self):
+        for direction, band in (("next", "am"), ("next", "fm"), ("previous", "am")):
+            version = self._tuner.version()
+            switch_preset(self._tuner, direction)
+            self.assertEqual(version + 1, self._tuner.version())
+            self.assertEqual(band, self._published[-1]["band"])
+        self.assertEqual(3, len(self._published))
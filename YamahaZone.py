@@ -1,3 +1,6 @@
+from YamahaState import YamahaState
+
+
 def is_valid_power_mode(power: str):
     return power in {"on", "standby"}
 
@@ -16,9 +19,10 @@ def is_valid_sound_program(sound_program: str):
                              "11ch_stereo", "stereo", "surr_decoder", "my_surround", "target", "straight", "off"}
 
 
-class YamahaZone:
+class YamahaZone(YamahaState):
     def __init__(self, name: str, input_name: str, mute: bool, power: str, volume: int, sound_program: str):
         assert is_valid_power_mode(power), "Invalid power mode"
+        super().__init__()
         self.name = name
         self.input_name = input_name
         self.mute = mute
@@ -26,6 +30,20 @@ class YamahaZone:
         self.volume = volume
         self.sound_program = sound_program
 
+    def __setattr__(self, name, value):
+        # поля зоны меняются и напрямую (zone.volume = ...), поэтому версия увеличивается здесь
+        super().__setattr__(name, value)
+        if not name.startswith("_"):
+            self._touch(**{name: value})
+
+    def state_key(self):
+        return self.version()
+
+    def restore(self, checkpoint):
+        # подписчики событий получают восстановленные значения полей
+        self.__dict__.update(checkpoint)
+        self._touch(**{name: value for name, value in checkpoint.items() if not name.startswith("_")})
+
     def set_power(self, power: str):
         assert is_valid_power_mode(power), "Invalid power mode"
         self.power = power
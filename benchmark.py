@@ -0,0 +1,254 @@
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from email.message import Message
+from types import SimpleNamespace
+from YamahaApi import ROUTES
+from YamahaCache import encode_json
+from YamahaLog import RequestLog
+from YamahaPlaylist import YamahaPlaylist
+from YamahaSystem import load_yamaha
+from YamahaTrack import YamahaTrack
+from YamahaZone import YamahaZone
+from main import SimpleHTTPRequestHandler
+
+
+# Микробенчмарки горячих путей эмулятора: python benchmark.py [-o results.jsonl] [-b baseline.jsonl]
+# Время подменяется искусственными часами, поэтому результаты не зависят от момента запуска.
+# Каждый запуск дописывает в файл результатов одну строку JSON - так видна история изменений.
+
+
+# запросы для диспетчеризации: по одному на каждое действие из таблицы маршрутов
+REQUESTS = [
+    "/YamahaExtendedControl/v1/system/getFeatures",
+    "/YamahaExtendedControl/v1/main/getStatus",
+    "/YamahaExtendedControl/v1/netusb/getPlayInfo",
+    "/YamahaExtendedControl/v1/tuner/getPlayInfo",
+    "/YamahaExtendedControl/v1/cd/getPlayInfo",
+    "/YamahaExtendedControl/v1/netusb/getListInfo?input=usb&index=0&size=8",
+    "/YamahaExtendedControl/v1/main/setInput?input=spotify",
+    "/YamahaExtendedControl/v1/main/setMute?enable=false",
+    "/YamahaExtendedControl/v1/main/setVolume?volume=20",
+    "/YamahaExtendedControl/v1/main/setPower?power=on",
+    "/YamahaExtendedControl/v1/main/setSoundProgram?program=straight",
+    "/YamahaExtendedControl/v1/netusb/toggleRepeat",
+    "/YamahaExtendedControl/v1/cd/toggleShuffle",
+    "/YamahaExtendedControl/v1/netusb/setPlayback?playback=next",
+    "/YamahaExtendedControl/v1/tuner/switchPreset?dir=next",
+    "/YamahaExtendedControl/v1/tuner/setDabService?dir=next",
+    "/YamahaExtendedControl/v1/netusb/storePreset?num=1",
+    "/YamahaExtendedControl/v1/tuner/setBand?band=fm",
+    "/YamahaExtendedControl/v1/tuner/setFreq?band=fm&tuning=direct&num=98000",
+    "/YamahaExtendedControl/v1/tuner/recallPreset?zone=main&band=fm&num=1",
+    "/YamahaExtendedControl/v1/netusb/setListControl?type=select&index=1",
+]
+
+
+class FakeClock:
+    # часы, которые идут только по команде: каждый вызов advance() - новая секунда
+    def __init__(self, now: int = 1000000):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds: int = 1):
+        self.now += seconds
+        return self.now
+
+
+def make_tracks(count: int):
+    return [YamahaTrack(track=f"Track {i}", album="Album", artist="Artist", total_time=120 + i % 240)
+            for i in range(count)]
+
+
+def calibrate(func, number: int, max_repeat_sec: float):
+    # медленные операции (например перемешивание большого плейлиста) выполняются реже,
+    # чтобы один повтор занимал не больше max_repeat_sec
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    if elapsed <= 0:
+        return number
+    return max(1, min(number, int(max_repeat_sec / elapsed)))
+
+
+def measure(func, number: int, repeat: int):
+    # время одной операции в наносекундах для каждого из повторов
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            func()
+        timings.append((time.perf_counter_ns() - start) / number)
+    return timings
+
+
+class InProcessRequest:
+    # обработчик запросов без сокета: _make_response() пишет ответ в буфер в памяти
+    def __init__(self, system, request_log: RequestLog):
+        self._handler = SimpleHTTPRequestHandler.__new__(SimpleHTTPRequestHandler)
+        self._handler.server = SimpleNamespace(receivers={None: system}, request_log=request_log, long_poll=None,
+                                               compress_min_bytes=1024)
+        self._handler.client_address = ("127.0.0.1", 0)
+        self._handler.request_version = "HTTP/1.1"
+        self._handler.command = "GET"
+        self._handler.headers = Message()
+        self._handler.headers["Host"] = "localhost"
+
+    def __call__(self, path: str):
+        handler = self._handler
+        handler.path = path
+        handler.requestline = "GET " + path + " HTTP/1.1"
+        handler.close_connection = False
+        handler.wfile = io.BytesIO()
+        handler._make_response()
+        response = handler.wfile.getvalue()
+        assert response.startswith(b"HTTP/1.1 200"), f"{path}: {response[:40]}"
+        return response
+
+
+def playlist_benchmarks(sizes: list):
+    clock = FakeClock()
+    for size in sizes:
+        playlist = YamahaPlaylist(make_tracks(size), clock, shuffle_seed=1)
+        playlist.play()
+
+        def sync():
+            clock.advance()
+            playlist.sync()
+
+        def sync_time():
+            playlist._sync_time(playlist._state, clock.advance(97))
+
+        def shuffle():
+            playlist.shuffle_on()
+
+        def set_track_index(index=[0]):
+            index[0] = (index[0] + 7919) % size
+            playlist.set_track_index(index[0])
+
+        yield f"playlist.sync[{size}]", sync
+        yield f"playlist._sync_time[{size}]", sync_time
+        yield f"playlist.set_track_index[{size}]", set_track_index
+        yield f"playlist.slice_to_list_info[{size}]", lambda: playlist.slice_to_list_info(size // 2, 8)
+        yield f"playlist.shuffle_on[{size}]", shuffle
+
+
+def zone_benchmarks():
+    zone = YamahaZone(name="main", input_name="tv", mute=False, power="on", volume=20, sound_program="straight")
+    yield "zone.status", zone.status
+
+
+def json_benchmarks(system):
+    status = system.get_zone("main").status()
+    play_info = system.netusb().play_info()
+    list_info = system.netusb().list_info(0, 8)
+    for name, json_answer in (("status", status), ("play_info", play_info), ("list_info", list_info)):
+        yield f"encode_json.{name}", lambda json_answer=json_answer: encode_json(json_answer)
+        yield f"encode_json.{name}.compact", lambda json_answer=json_answer: encode_json(json_answer, True)
+
+
+def dispatch_benchmarks(system, request_log: RequestLog, clock: FakeClock):
+    request = InProcessRequest(system, request_log)
+    for path in REQUESTS:
+        route, sender = ROUTES.resolve(path.partition("?")[0])
+        yield f"dispatch.{sender}.{route.action}", lambda path=path: request(path)
+
+    def cold_play_info():
+        # каждый запрос в новую секунду - позиция и ответ вычисляются заново
+        clock.advance()
+        request("/YamahaExtendedControl/v1/netusb/getPlayInfo")
+
+    yield "dispatch.netusb.getPlayInfo.cold", cold_play_info
+
+
+def run_benchmarks(args, config_file: str):
+    clock = FakeClock()
+    # журнал и конфиг ресивера пишутся во временный каталог, чтобы не трогать рабочий config.json
+    with tempfile.TemporaryDirectory() as temp_dir, \
+            RequestLog(console=False) as request_log:
+        temp_config = os.path.join(temp_dir, "config.json")
+        shutil.copy(config_file, temp_config)
+        with load_yamaha(temp_config, whats_a_time=clock) as system:
+            suites = [
+                playlist_benchmarks(args.sizes),
+                zone_benchmarks(),
+                json_benchmarks(system),
+                dispatch_benchmarks(system, request_log, clock),
+            ]
+            for suite in suites:
+                for name, func in suite:
+                    if args.filter and args.filter not in name:
+                        continue
+                    number = calibrate(func, args.number, args.max_repeat_sec)
+                    timings = measure(func, number, args.repeat)
+                    yield {
+                        "name": name,
+                        "number": number,
+                        "repeat": args.repeat,
+                        "best_ns": round(min(timings), 1),
+                        "median_ns": round(statistics.median(timings), 1)
+                    }
+
+
+def load_baseline(filename: str):
+    # последний запуск из файла результатов
+    last_line = None
+    with open(filename, "r") as file:
+        for line in file:
+            if line.strip():
+                last_line = line
+    assert last_line is not None, f"No results in '{filename}'"
+    return {result["name"]: result for result in json.loads(last_line)["results"]}
+
+
+def print_result(result: dict, baseline: dict):
+    line = f"{result['name']:<48} {result['best_ns']:>14.1f} ns {result['median_ns']:>14.1f} ns"
+    previous = baseline.get(result["name"])
+    if previous is not None and previous["best_ns"] > 0:
+        line += f" {(result['best_ns'] / previous['best_ns'] - 1) * 100:>+8.1f}%"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-c", "--config", default="config.json")
+    parser.add_argument("-o", "--output", help="append results as one JSON line to this file")
+    parser.add_argument("-b", "--baseline", help="results file to compare with (last run is used)")
+    parser.add_argument("-k", "--filter", help="run only benchmarks whose name contains this text")
+    parser.add_argument("-n", "--number", type=int, default=1000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("--max-repeat-sec", type=float, default=0.5)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100000])
+    parsed_args = parser.parse_args(sys.argv[1:])
+
+    baseline = load_baseline(parsed_args.baseline) if parsed_args.baseline else {}
+    print(f"{'benchmark':<48} {'best':>17} {'median':>17}")
+    results = []
+    for result in run_benchmarks(parsed_args, parsed_args.config):
+        print_result(result, baseline)
+        results.append(result)
+
+    if parsed_args.output is not None:
+        run = {
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "results": results
+        }
+        with open(parsed_args.output, "a") as file:
+            file.write(json.dumps(run, separators=(",", ":")) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+
+
+# Генератор нагрузки для эмулятора: python loadgen.py --port 80 --clients 64 --duration 30 [--json report.json]
+# Каждый клиент держит одно keep-alive соединение и отправляет запросы по очереди,
+# вид запроса выбирается случайно с весами из --mix.
+
+API = "/YamahaExtendedControl/v1"
+
+PLAYBACKS = ("play", "pause", "next", "previous")
+
+
+class ClientState:
+    # состояние одного клиента между запросами: позиция прокрутки списка
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.list_index = 0
+
+
+def get_status(client: ClientState, args):
+    return f"{API}/{args.zone}/getStatus"
+
+
+def get_play_info(client: ClientState, args):
+    return f"{API}/{client.rng.choice(('netusb', 'cd', 'tuner'))}/getPlayInfo"
+
+
+def get_list_info(client: ClientState, args):
+    # клиент листает список страницами, как приложение при прокрутке
+    index = client.list_index
+    client.list_index = (index + args.list_page) % args.list_size
+    return f"{API}/netusb/getListInfo?input=usb&index={index}&size={args.list_page}"
+
+
+def set_volume(client: ClientState, args):
+    return f"{API}/{args.zone}/setVolume?volume={client.rng.randint(0, 60)}"
+
+
+def set_playback(client: ClientState, args):
+    return f"{API}/netusb/setPlayback?playback={client.rng.choice(PLAYBACKS)}"
+
+
+def recall_preset(client: ClientState, args):
+    return f"{API}/tuner/recallPreset?zone={args.zone}&band=common&num={client.rng.randint(1, args.presets)}"
+
+
+SCENARIOS = {
+    "getStatus": get_status,
+    "getPlayInfo": get_play_info,
+    "getListInfo": get_list_info,
+    "setVolume": set_volume,
+    "setPlayback": set_playback,
+    "recallPreset": recall_preset,
+}
+
+DEFAULT_MIX = "getStatus=40,getPlayInfo=30,getListInfo=10,setVolume=10,setPlayback=6,recallPreset=4"
+
+
+def parse_mix(mix: str):
+    result = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        assert name in SCENARIOS, f"Unknown request '{name}', " + " or ".join(SCENARIOS) + " expected"
+        result[name] = float(weight) if weight else 1.0
+    assert sum(result.values()) > 0, "Mix weights must not be all zero"
+    return result
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []  # секунды, только успешные ответы
+        self.errors = 0      # коды ответа кроме 200
+        self.failures = 0    # ошибки соединения и таймауты
+        self.bytes_in = 0
+
+    def merge(self, other):
+        self.latencies.extend(other.latencies)
+        self.errors += other.errors
+        self.failures += other.failures
+        self.bytes_in += other.bytes_in
+
+
+class LoadClient:
+    def __init__(self, args, mix: dict, seed: int, deadline: float, requests_limit: int):
+        self._args = args
+        self._names = list(mix.keys())
+        self._weights = list(mix.values())
+        self._client = ClientState(random.Random(seed))
+        self._deadline = deadline
+        self._requests_limit = requests_limit
+        self._connection = None
+        self.stats = {name: EndpointStats() for name in self._names}
+        self.reconnects = 0
+
+    def _connect(self):
+        if self._connection is not None:
+            self._connection.close()
+        self._connection = http.client.HTTPConnection(self._args.host, self._args.port, timeout=self._args.timeout)
+        self.reconnects += 1
+
+    def _request(self, path: str):
+        headers = {"Host": self._args.host_header} if self._args.host_header else {}
+        self._connection.request("GET", path, headers=headers)
+        response = self._connection.getresponse()
+        body = response.read()
+        if response.will_close:
+            self._connect()
+        return response.status, len(body)
+
+    def run(self):
+        self._connect()
+        sent = 0
+        rng = self._client.rng
+        while time.monotonic() < self._deadline and (self._requests_limit is None or sent < self._requests_limit):
+            name = rng.choices(self._names, self._weights)[0]
+            path = SCENARIOS[name](self._client, self._args)
+            stats = self.stats[name]
+            start = time.perf_counter()
+            try:
+                status, size = self._request(path)
+            except (OSError, http.client.HTTPException):
+                stats.failures += 1
+                self._connect()
+                continue
+            finally:
+                sent += 1
+
+            stats.bytes_in += size
+            if status == 200:
+                stats.latencies.append(time.perf_counter() - start)
+            else:
+                stats.errors += 1
+        self._connection.close()
+
+
+def percentile(sorted_values: list, fraction: float):
+    # метод ближайшего ранга
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[rank]
+
+
+def endpoint_report(stats: EndpointStats, elapsed: float):
+    latencies = sorted(stats.latencies)
+    requests = len(latencies) + stats.errors + stats.failures
+    to_ms = lambda value: None if value is None else round(value * 1000, 3)
+    return {
+        "requests": requests,
+        "requests_per_sec": round(requests / elapsed, 1) if elapsed > 0 else 0,
+        "errors": stats.errors,
+        "failures": stats.failures,
+        "error_rate": round((stats.errors + stats.failures) / requests, 6) if requests else 0,
+        "bytes_in": stats.bytes_in,
+        "latency_ms": {
+            "p50": to_ms(percentile(latencies, 0.50)),
+            "p95": to_ms(percentile(latencies, 0.95)),
+            "p99": to_ms(percentile(latencies, 0.99)),
+            "p999": to_ms(percentile(latencies, 0.999)),
+            "max": to_ms(latencies[-1] if latencies else None)
+        }
+    }
+
+
+def run_load(args, mix: dict):
+    deadline = time.monotonic() + args.duration
+    requests_limit = None
+    if args.requests is not None:
+        requests_limit = (args.requests + args.clients - 1) // args.clients
+
+    clients = [LoadClient(args, mix, args.seed + i, deadline, requests_limit) for i in range(args.clients)]
+    threads = [threading.Thread(target=client.run, daemon=True) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    total = EndpointStats()
+    endpoints = {}
+    for name in mix:
+        stats = EndpointStats()
+        for client in clients:
+            stats.merge(client.stats[name])
+        total.merge(stats)
+        endpoints[name] = endpoint_report(stats, elapsed)
+
+    return {
+        "target": f"{args.host}:{args.port}",
+        "clients": args.clients,
+        "duration_sec": round(elapsed, 3),
+        "mix": mix,
+        "connections": sum(client.reconnects for client in clients),
+        "total": endpoint_report(total, elapsed),
+        "endpoints": endpoints
+    }
+
+
+def print_report(report: dict):
+    print(f"target {report['target']}, {report['clients']} clients, {report['duration_sec']} s, "
+          f"{report['connections']} connections")
+    print(f"{'endpoint':<14} {'requests':>9} {'req/s':>9} {'err%':>7} "
+          f"{'p50':>8} {'p95':>8} {'p99':>8} {'p999':>8} {'max':>8}  (ms)")
+    rows = list(report["endpoints"].items()) + [("total", report["total"])]
+    for name, endpoint in rows:
+        latency = endpoint["latency_ms"]
+        cells = " ".join(f"{'-' if latency[key] is None else latency[key]:>8}"
+                         for key in ("p50", "p95", "p99", "p999", "max"))
+        print(f"{name:<14} {endpoint['requests']:>9} {endpoint['requests_per_sec']:>9} "
+              f"{endpoint['error_rate'] * 100:>7.2f} {cells}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=80)
+    parser.add_argument("--host-header", help="Host header to select a receiver")
+    parser.add_argument("-c", "--clients", type=int, default=64)
+    parser.add_argument("-d", "--duration", type=float, default=10.0)
+    parser.add_argument("-n", "--requests", type=int, help="stop after this many requests in total")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights, for example " + DEFAULT_MIX)
+    parser.add_argument("--zone", default="main")
+    parser.add_argument("--list-size", type=int, default=64)
+    parser.add_argument("--list-page", type=int, default=8)
+    parser.add_argument("--presets", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the report to this file as JSON")
+    parsed_args = parser.parse_args(sys.argv[1:])
+    assert parsed_args.clients > 0, "Clients count must be positive"
+
+    report = run_load(parsed_args, parse_mix(parsed_args.mix))
+    print_report(report)
+    if parsed_args.json is not None:
+        with open(parsed_args.json, "w") as file:
+            file.write(json.dumps(report, indent=4))
+
+
+if __name__ == "__main__":
+    main()
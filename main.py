@@ -1,233 +1,1012 @@
-import urllib
-import json
 import threading
+import time
 import sys
 import argparse
-
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from YamahaSystem import YamahaSystem, load_yamaha
-from YamahaTuner import YamahaTuner, switch_preset
-from YamahaNetusb import YamahaNetusb
-
-
-def to_boolean(value: str):
-    assert value in ("true", "false")
-    return value == "true"
-
-
-def set_playback(yamaha_input, playback: str):
-    assert playback in ("play", "stop", "pause", "next", "previous",
-                        "fast_reverse_start", "fast_reverse_end",
-                        "fast_forward_start", "fast_forward_end")
-
-    if playback == "play":
-        yamaha_input.play()
-    elif playback == "stop":
-        yamaha_input.stop()
-    elif playback == "pause":
-        yamaha_input.pause()
-    elif playback == "next":
-        yamaha_input.next_track()
-    elif playback == "previous":
-        yamaha_input.previous_track()
-    elif playback == "fast_reverse_start":
-        yamaha_input.fast_reverse_start()
-    elif playback == "fast_reverse_end":
-        yamaha_input.fast_reverse_end()
-    elif playback == "fast_forward_start":
-        yamaha_input.fast_forward_start()
-    elif playback == "fast_forward_end":
-        yamaha_input.fast_forward_end()
-
-
-def get_sender_from_path(path: str):
-    # пример пути: "/YamahaExtendedControl/v1/main/getStatus"
-    # разобьётся на: ['', 'YamahaExtendedControl', 'v1', 'main', 'getStatus']
-    # элемент под индексом 3 ('main' - имя зоны) - то что нам нужно
-    sender = path.split("/")[3]
-    assert sender in ("system", "main", "zone1", "zone2", "zone3", "netusb", "tuner", "cd"), "Unknown sender"
-    return sender
-
-
-def is_feedback(path: str):
-    return path.endswith("getStatus") or path.endswith("getPlayInfo") or path.endswith("getListInfo")
-
-
-def set_list_control(netusb: YamahaNetusb, query_params: dict):
-    type_ = query_params["type"]
-    assert type_ in ("select", "play", "return")
-
-    if type_ == "return":
-        return
-
-    index = int(query_params["index"])
-    if type_ == "select":
-        netusb.select_track_index(index)
-    elif type_ == "play":
-        netusb.play_track_index(index)
+import json
+import marshal
+import os
+import contextlib
+import urllib.parse
+import http.client
+import gzip
+import zlib
+import shutil
+import tempfile
+import unittest
+
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+from YamahaHttpServer import TimeoutHTTPServer, ThreadPoolHTTPServer, WorkerPool
+from YamahaSystem import load_yamaha, create_config_from_template
+from YamahaApi import ROUTES
+from YamahaRoutes import to_boolean
+from YamahaLog import RequestLog
+from YamahaMetrics import YamahaMetrics, MetricsRequestHandler, PROMETHEUS_CONTENT_TYPE
+from YamahaProfiler import YamahaProfiler
+from YamahaStatic import StaticFiles, parse_range
+from YamahaBatch import parse_batch, run_batch
+from YamahaCache import EncodedBody, accepted_coding, compress
+from YamahaLongPoll import YamahaLongPoll, LongPollWaiter
+from YamahaClock import RealClock, parse_clock
+from YamahaScheduler import YamahaScheduler
+
+
+def host_name(host: str):
+    # имя из заголовка Host или манифеста без порта, в нижнем регистре: "[::1]:8080" -> "::1", "host:" -> "host";
+    # пустое или неразборчивое значение - None
+    try:
+        return urllib.parse.urlsplit("//" + host).hostname or None
+    except ValueError:
+        return None
 
 
 class SimpleHTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # заголовки и тело ответа уходят отдельными записями в сокет: с алгоритмом Нейгла тело
+    # в keep-alive соединении ждало бы подтверждения заголовков (delayed ACK клиента, ~40 мс)
+    disable_nagle_algorithm = True
+    # долгий опрос: ?wait=<секунды>&since=<X-State-Version из предыдущего ответа>
+    MAX_LONG_POLL_SEC = 60.0
+
     def __init__(self, request, client_address, server):
-        self._yamahaSystem = YamahaSystem()
+        self._yamahaSystem = None
+        self._requests_served = 0
+        self._request_start = None
+        self._waiter = None
+        self._resumed = False
         super().__init__(request, client_address, server)
 
-    def _send_json(self, json_answer):
-        self.send_response(200)
-        self.send_header("Content-Type", "application/json")
-        self.end_headers()
-        json_answer["response_code"] = 0
-        self.wfile.write(json.dumps(json_answer, indent=4).encode('utf-8'))
+    def setup(self):
+        super().setup()
+        self.server.metrics.connection_opened()
+
+    def handle(self):
+        # как BaseHTTPRequestHandler.handle(), но между запросами keep-alive соединение
+        # не держит поток пула: простаивающий сокет ждёт следующего запроса в YamahaLongPoll
+        self.close_connection = True
+        self.handle_one_request()
+        self._serve_keep_alive()
+
+    def _serve_keep_alive(self):
+        while not self.close_connection:
+            if self._park_idle():
+                return
+            self.handle_one_request()
+
+    def finish(self):
+        if self._waiter is not None:
+            # соединение остаётся открытым и ждёт в YamahaLongPoll: ответ на долгий опрос
+            # отправит _resume_long_poll(), следующий запрос обработает _resume_connection()
+            waiter, self._waiter = self._waiter, None
+            self.wfile.flush()
+            if not self.server.long_poll.park(waiter):
+                waiter.reject()
+            return
 
-    def _send_success(self):
-        self._send_json({"response_code": 0})
+        try:
+            super().finish()
+        finally:
+            self.server.metrics.connection_closed()
+
+    def _park_long_poll(self, state, token: str, query: str):
+        # True - запрос ждёт изменения состояния, ответ будет отправлен позже из другого потока пула
+        if self.server.long_poll is None or self._resumed:
+            return False
+        params = dict(urllib.parse.parse_qsl(query)) if query else {}
+        if params.get("since") != token or "wait" not in params:
+            return False
+        wait = min(float(params["wait"]), SimpleHTTPRequestHandler.MAX_LONG_POLL_SEC)
+        if wait <= 0 or self.server.long_poll.waiters() >= self.server.long_poll.max_waiters:
+            return False
+
+        self._close_after_wait = self.close_connection
+        self.close_connection = True
+        self._waiter = LongPollWaiter(self.request, state, token, time.monotonic() + wait,
+                                      self._resume_long_poll, self._reject_long_poll)
+        self.server.detach_request(self.request)
+        return True
+
+    def _park_idle(self):
+        # True - соединение без следующего запроса отдано YamahaLongPoll до keep_alive_timeout
+        if self.server.long_poll is None or self._has_buffered_request():
+            return False
+        self.close_connection = True
+        self._waiter = LongPollWaiter(self.request, None, None, time.monotonic() + self.server.keep_alive_timeout,
+                                      self._resume_connection, self._close_idle, self._close_idle)
+        self.server.detach_request(self.request)
+        return True
+
+    def _has_buffered_request(self):
+        # следующий запрос уже в буфере rfile или в сокете - проверяем, не блокируясь
+        self.connection.settimeout(0)
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except OSError:
+            return True  # ошибку соединения обработает handle_one_request()
+        finally:
+            self.connection.settimeout(self.server.keep_alive_timeout)
+
+    def _resume_detached(self, serve):
+        # тот же обработчик продолжает работу с соединением в потоке пула
+        try:
+            serve()
+        except OSError:
+            pass  # клиент закрыл соединение, не дождавшись ответа
+        except Exception:
+            self.server.handle_error(self.request, self.client_address)
+        finally:
+            self.finish()
+            self.server.shutdown_request(self.request)
+
+    def _resume_long_poll(self):
+        # ответ на отложенный запрос и следующие запросы keep-alive соединения
+        def serve():
+            self.close_connection = self._close_after_wait
+            self._resumed = True
+            self._request_start = time.perf_counter()
+            self._parse_time = 0.0
+            self.do_GET()
+            self._resumed = False
+            self._serve_keep_alive()
+
+        self._resume_detached(serve)
+
+    def _resume_connection(self):
+        # в простаивавшем соединении пришёл следующий запрос (или клиент закрыл соединение)
+        def serve():
+            self.close_connection = True
+            self.handle_one_request()
+            self._serve_keep_alive()
+
+        self._resume_detached(serve)
+
+    def _close_detached(self):
+        try:
+            super().finish()
+        except OSError:
+            pass
+        finally:
+            self.server.metrics.connection_closed()
+
+    def _reject_long_poll(self):
+        self._close_detached()
+        self.server.reject_detached(self.request)
+
+    def _close_idle(self):
+        self._close_detached()
+        self.server.close_request_now(self.request)
+
+    def handle_one_request(self):
+        # перед повторным запросом в том же соединении ждём не дольше keep_alive_timeout
+        if self._requests_served > 0:
+            self.connection.settimeout(self.server.keep_alive_timeout)
+        super().handle_one_request()
+
+    def parse_request(self):
+        # строка запроса получена - дальше действует обычный таймаут на чтение/запись
+        self.connection.settimeout(self.server.socket_timeout)
+        self._request_start = time.perf_counter()
+        self._requests_served += 1
+        parsed = super().parse_request()
+        self._parse_time = time.perf_counter() - self._request_start
+        if not parsed:
+            return False
+
+        if self._requests_served >= self.server.max_keep_alive_requests:
+            self.close_connection = True
+        return True
+
+    def _send_body(self, code: int, body: bytes, content_type: str = None, headers: dict = None):
+        write_start = time.perf_counter()
+        self._send_headers(code, len(body), content_type, headers)
+        self.wfile.write(body)
+        self._write_time = time.perf_counter() - write_start
+
+    def _send_headers(self, code: int, content_length: int, content_type: str = None, headers: dict = None):
+        self._response_code = code
+        self._bytes_out = content_length
+        self.send_response(code)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if code != 304:
+            self.send_header("Content-Length", str(content_length))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        elif self.request_version == "HTTP/1.0":
+            self.send_header("Connection", "keep-alive")
+        self.end_headers()
 
-    def _check_sender(self, sender: str, expected_senders):
-        if type(expected_senders) is str:
-            assert sender == expected_senders, "Wrong sender, " + expected_senders + " expected"
+    def _compress(self, body: bytes, headers: dict):
+        # сжатие JSON по Accept-Encoding; небольшие ответы не сжимаются - выигрыш меньше затрат.
+        # Сжатый вариант ответа из кэша хранится вместе с ним (EncodedBody.compressed)
+        min_bytes = self.server.compress_min_bytes
+        if min_bytes is None:
+            return body
+        headers["Vary"] = "Accept-Encoding"
+        if len(body) < min_bytes:
+            return body
+        coding = accepted_coding(self.headers.get("Accept-Encoding"))
+        if coding is None:
+            return body
+
+        compress_start = time.perf_counter()
+        compressed = body.compressed(coding) if isinstance(body, EncodedBody) else compress(body, coding)
+        self._serialize_time = (self._serialize_time or 0.0) + time.perf_counter() - compress_start
+        headers["Content-Encoding"] = coding
+        return compressed
+
+    def _send_json(self, json_answer, headers: dict = None):
+        if not isinstance(json_answer, bytes):
+            serialize_start = time.perf_counter()
+            json_answer = self._yamahaSystem.responses().encode(json_answer)
+            self._serialize_time = time.perf_counter() - serialize_start
+        headers = dict(headers or {})
+        self._send_body(200, self._compress(json_answer, headers), "application/json", headers)
+
+    def _send_feedback(self, body: EncodedBody, headers: dict):
+        # условный GET: опрос без изменений состояния получает 304 без тела;
+        # у сжатого и несжатого вариантов разные ETag
+        body = self._compress(body, headers)
+        headers.update({"ETag": body.etag, "Cache-Control": "no-cache"})
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None and body.etag in (etag.strip() for etag in if_none_match.split(",")):
+            headers.pop("Content-Encoding", None)
+            self._send_body(304, b"", headers=headers)
         else:
-            assert sender in expected_senders, "Wrong sender, " + " or ".join(expected_senders) + " expected"
+            self._send_body(200, body, "application/json", headers)
+
+    def _send_success(self):
+        self._send_json(self._yamahaSystem.success_response())
+
+    def _subscribe_to_events(self):
+        # клиенты MusicCast сообщают порт для UDP-событий в заголовках запроса
+        app_port = self.headers.get("X-AppPort")
+        if self.headers.get("X-AppName") is None or app_port is None or not app_port.isdigit():
+            return
+        self._yamahaSystem.events().subscribe(self.client_address[0], int(app_port))
+
+    def _select_receiver(self):
+        # ресивер выбирается по заголовку Host (без порта), иначе - ресивер по умолчанию для этого порта
+        receivers = self.server.receivers
+        host = host_name(self.headers.get("Host", ""))
+        system = receivers.get(host, receivers.get(None))
+        assert system is not None, f"Unknown receiver host '{host}'"
+        return system
 
     def _make_response(self):
-        parsed = urllib.parse.urlparse(self.path)
-        parsed_path = parsed.path
-        query_params = dict(urllib.parse.parse_qsl(parsed.query))
-        sender = get_sender_from_path(parsed_path)
+        self._yamahaSystem = self._select_receiver()
+        self._subscribe_to_events()
+        path, _, query = self.path.partition("?")
+        route, sender = ROUTES.resolve(path)
+        if route is None:
+            self.print_command()
+            self.server.request_log.error(f"Unknown request: {self.path}")
+            self._send_body(404, b"")
+            return
 
-        if is_feedback(parsed_path):
+        self._endpoint = route.action
+        self._sender = sender
+        if route.feedback:
             self.print_feedback()
         else:
             self.print_command()
 
-        if parsed_path.endswith("getFeatures"):
-            self._check_sender(sender, "system")
-            self._send_json(self._yamahaSystem.features())
-        elif parsed_path.endswith("getStatus"):
-            self._send_json(self._yamahaSystem.get_zone(sender).status())
-        elif parsed_path.endswith("getPlayInfo"):
-            self._send_json(self._yamahaSystem.get_input(sender).play_info())
-        elif parsed_path.endswith("getListInfo"):
-            self._check_sender(sender, "netusb")
-            input_name = query_params["input"]
-            self._send_json(self._yamahaSystem.netusb().list_info(index_from=int(query_params["index"]),
-                                                                  chunk_size=int(query_params["size"])))
-
-        elif parsed_path.endswith("setInput"):
-            self._yamahaSystem.set_input(zone=sender, input=query_params["input"])
-            self._send_success()
-        elif parsed_path.endswith("setMute"):
-            self._yamahaSystem.get_zone(sender).mute = to_boolean(query_params["enable"])
-            self._send_success()
-        elif parsed_path.endswith("setVolume"):
-            self._yamahaSystem.get_zone(sender).volume = int(query_params["volume"])
-            self._send_success()
-        elif parsed_path.endswith("setPower"):
-            self._yamahaSystem.get_zone(sender).set_power(query_params["power"])
-            self._send_success()
-        elif parsed_path.endswith("setSoundProgram"):
-            self._yamahaSystem.get_zone(sender).set_sound_program(query_params["program"])
-            self._send_success()
-
-        elif parsed_path.endswith("toggleRepeat"):
-            self._yamahaSystem.get_input(sender).toggle_repeat()
-            self._send_success()
-        elif parsed_path.endswith("toggleShuffle"):
-            self._yamahaSystem.get_input(sender).toggle_shuffle()
-            self._send_success()
-        elif parsed_path.endswith("setPlayback"):
-            if query_params["playback"] == "track_select":
-                assert sender == "cd", "Wrong sender, cd expected"
-                self._yamahaSystem.cd().set_track_num(int(query_params["num"]))
-            else:
-                set_playback(self._yamahaSystem.get_input(sender), query_params["playback"])
-            self._send_success()
-        elif parsed_path.endswith("switchPreset"):
-            self._check_sender(sender, "tuner")
-            switch_preset(self._yamahaSystem.tuner(), query_params["dir"])
-            self._send_success()
-        elif parsed_path.endswith("setDabService"):
-            self._check_sender(sender, "tuner")
-
-            direction = query_params["dir"]
-            assert direction in ("previous", "next"), 'Wrong direction, "previous" or "next" expected'
-
-            if direction == "previous":
-                self._yamahaSystem.tuner().prev_dab()
-            elif direction == "next":
-                self._yamahaSystem.tuner().next_dab()
-
-            self._send_success()
-        elif parsed_path.endswith("storePreset"):
-            self._check_sender(sender, ("tuner", "netusb"))
-            self._yamahaSystem.get_input(sender).store_preset(int(query_params["num"]))
-            self._send_success()
-        elif parsed_path.endswith("setBand"):
-            self._check_sender(sender, "tuner")
-            self._yamahaSystem.tuner().set_band(query_params["band"])
-            self._send_success()
-        elif parsed_path.endswith("setFreq"):
-            self._check_sender(sender, "tuner")
-            assert query_params["band"] in ("am", "fm"), 'Wrong band, "am" or "fm" expected'
-            assert query_params["tuning"] == "direct", 'Wrong tuning, only "direct" is supported by emulator'
-            self._yamahaSystem.tuner().set_frequency(int(query_params["num"]))
-            self._send_success()
-        elif parsed_path.endswith("recallPreset"):
-            self._check_sender(sender, ("tuner", "netusb"))
-
-            zone = self._yamahaSystem.get_zone(query_params["zone"])
-            preset_num = int(query_params["num"])
-            if sender == "tuner":
-                self._yamahaSystem.tuner().recall_preset(zone=zone, band=query_params["band"], num=preset_num)
-            elif sender == "netusb":
-                self._yamahaSystem.netusb().recall_preset(zone=zone, num=preset_num)
-            self._send_success()
-        elif parsed_path.endswith("setListControl"):
-            set_list_control(netusb=self._yamahaSystem.netusb(), query_params=query_params)
+        # версия состояния берётся до ответа: если состояние успеет измениться,
+        # следующий опрос с этой версией просто вернётся сразу
+        headers = {}
+        if route.watch is not None:
+            state = route.watch(self._yamahaSystem, sender)
+            token = state.transition_token()
+            if self._park_long_poll(state, token, query):
+                return
+            headers["X-State-Version"] = token
+
+        # ответы из кэша уже закодированы - тогда фаза serialize входит в dispatch
+        dispatch_start = time.perf_counter()
+        if route.feedback:
+            json_answer = self._yamahaSystem.read(lambda: route(self._yamahaSystem, sender, query))
+        else:
+            with self._yamahaSystem.writer():
+                json_answer = route(self._yamahaSystem, sender, query)
+            if not self._yamahaSystem.journal().wait_flushed():
+                self._send_body(500, b"")  # изменение не сохранено на диске
+                return
+        self._dispatch_time = time.perf_counter() - dispatch_start
+        if route.feedback and isinstance(json_answer, EncodedBody):
+            self._send_feedback(json_answer, headers)
+        elif json_answer is None:
             self._send_success()
         else:
-            print(f"Unknown request: {self.path}")
-            self.send_response(404)
-            self.end_headers()
+            self._send_json(json_answer, headers)
 
     def log_message(self, format, *args):
         pass
 
     def print_command(self):
-        if self._yamahaSystem._filter not in ("feedbacks", "f", "feed"):
-            print(f"\033[33m{self.requestline}\033[0m")
+        self.server.request_log.command(self.requestline)
 
     def print_feedback(self):
-        if self._yamahaSystem._filter not in ("commands", "c", "comm"):
-            print(f"\033[32m{self.requestline}\033[0m")
+        self.server.request_log.feedback(self.requestline)
+
+    def _send_metrics(self):
+        self._send_body(200, self.server.metrics.render(), PROMETHEUS_CONTENT_TYPE)
+
+    def _make_admin_response(self, action: str, query: str):
+        # /admin/profile/start?seconds=10&every=1&frames=1&memory=true
+        # /admin/profile/stop, /admin/profile/report?sort=cumulative&limit=30&group=lineno, /admin/profile/dump
+        # /admin/clock, /admin/clock/advance?seconds=3600, /admin/clock/rate?rate=60
+        params = dict(urllib.parse.parse_qsl(query))
+        if action.startswith("/clock"):
+            self._make_clock_response(action, params)
+            return
+        profiler = self.server.profiler
+        if action == "/profile/start":
+            profiler.start(seconds=float(params["seconds"]) if "seconds" in params else None,
+                           every=int(params.get("every", 1)),
+                           frames=int(params.get("frames", 1)),
+                           memory=to_boolean(params.get("memory", "true")))
+        elif action == "/profile/stop":
+            profiler.stop()
+        elif action == "/profile/report":
+            self._send_body(200, profiler.report(sort=params.get("sort", "cumulative"),
+                                                 limit=int(params.get("limit", 30)),
+                                                 group_by=params.get("group", "lineno")), "text/plain; charset=utf-8")
+            return
+        elif action == "/profile/dump":
+            self._send_body(200, profiler.pstats_dump(), "application/octet-stream")
+            return
+        elif action != "/profile":
+            self._send_body(404, b"")
+            return
+        self._send_body(200, json.dumps(profiler.status()).encode("utf-8"), "application/json")
+
+    def _make_clock_response(self, action: str, params: dict):
+        clock = self.server.clock
+        if action == "/clock/advance":
+            assert hasattr(clock, "advance"), "Real clock can not be moved"
+            clock.advance(float(params["seconds"]))
+        elif action == "/clock/rate":
+            assert hasattr(clock, "set_rate"), "Only accelerated clock rate can be changed"
+            clock.set_rate(float(params["rate"]))
+        elif action != "/clock":
+            self._send_body(404, b"")
+            return
+        self._send_body(200, json.dumps(clock.status()).encode("utf-8"), "application/json")
+
+    def _send_admin(self):
+        path, _, query = self.path.partition("?")
+        try:
+            self._make_admin_response(path[len(self.server.admin_path):], query)
+        except Exception as e:
+            self.server.request_log.error(f"Exception: {e}")
+            self._send_body(400, b"")
+
+    def _make_static_response(self, send_body: bool):
+        name = urllib.parse.unquote(self.path.partition("?")[0][len(self.server.static_path):])
+        static_file = self.server.static.lookup(name) if name else None
+        if static_file is None:
+            self._send_body(404, b"")
+            return
+
+        headers = {
+            "ETag": static_file.etag,
+            "Last-Modified": self.date_time_string(static_file.mtime_ns // 1000000000),
+            "Cache-Control": "public, max-age=3600",
+            "Accept-Ranges": "bytes"
+        }
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None and (if_none_match.strip() == "*" or static_file.etag in
+                                          (etag.strip() for etag in if_none_match.split(","))):
+            self._send_body(304, b"", headers=headers)
+            return
+
+        start, end = 0, static_file.size - 1
+        code = 200
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header is not None and (if_range is None or if_range.strip() == static_file.etag):
+            byte_range = parse_range(range_header, static_file.size)
+            if byte_range is False:
+                headers["Content-Range"] = f"bytes */{static_file.size}"
+                self._send_body(416, b"", headers=headers)
+                return
+            if byte_range is not None:
+                start, end = byte_range
+                code = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{static_file.size}"
+
+        write_start = time.perf_counter()
+        length = max(0, end - start + 1)
+        self._send_headers(code, length, static_file.content_type, headers)
+        if send_body and length > 0:
+            if static_file.content is not None:
+                self.wfile.write(static_file.content[start:end + 1])
+            else:
+                # большие файлы не копируются через память процесса: sendfile() из файла прямо в сокет
+                with open(static_file.path, "rb") as file:
+                    self.connection.sendfile(file, start, length)
+        self._write_time = time.perf_counter() - write_start
+
+    def _send_static(self, send_body: bool = True):
+        self._endpoint = self._sender = "static"
+        try:
+            self._make_static_response(send_body)
+        except Exception as e:
+            self.server.request_log.error(f"Exception: {e}")
+            self._send_body(400, b"")
+        self._record_metrics()
+
+    def _is_static_request(self):
+        return self.server.static is not None and self.path.startswith(self.server.static_path)
+
+    def _record_metrics(self):
+        total_time = time.perf_counter() - self._request_start
+        self.server.metrics.request(self._endpoint, self._sender, self._response_code, self._bytes_out,
+                                    (self._parse_time, self._dispatch_time, self._serialize_time,
+                                     self._write_time, total_time))
+
+    def _read_body(self):
+        length = self.headers.get("Content-Length")
+        assert length is not None and length.isdigit(), "Missing Content-Length"
+        length = int(length)
+        assert length <= self.server.max_body_bytes, "Request body is too large"
+        return self.rfile.read(length)
+
+    def _make_batch_response(self, version: str):
+        self._yamahaSystem = self._select_receiver()
+        self._subscribe_to_events()
+        self.print_command()
+        operations, failure = parse_batch(ROUTES, version, self._read_body())
+        if failure is not None:
+            self._send_json(failure)
+            return
+
+        dispatch_start = time.perf_counter()
+        result = run_batch(self._yamahaSystem, operations)
+        if not self._yamahaSystem.journal().wait_flushed():
+            self._send_body(500, b"")
+            return
+        self._dispatch_time = time.perf_counter() - dispatch_start
+        self._send_json(result)
+
+    def do_POST(self):
+        self._reset_request_info()
+        version = ROUTES.resolve_batch(self.path.partition("?")[0])
+        if version is None:
+            # тело запроса не читается - соединение нельзя использовать повторно
+            self.close_connection = True
+            self._send_body(404, b"")
+            self._record_metrics()
+            return
+
+        self._endpoint = self._sender = "batch"
+        try:
+            self._make_batch_response(version)
+        except Exception as e:
+            self.server.request_log.error(f"Exception: {e}")
+            self.close_connection = True
+            self._send_body(400, b"")
+        self._record_metrics()
+
+    def do_HEAD(self):
+        self._reset_request_info()
+        if self._is_static_request():
+            self._send_static(send_body=False)
+        else:
+            self._send_body(405, b"", headers={"Allow": "GET"})
+            self._record_metrics()
+
+    def _reset_request_info(self):
+        self._endpoint = "unknown"
+        self._sender = "unknown"
+        self._dispatch_time = self._serialize_time = self._write_time = None
+        self._response_code = None
+        self._bytes_out = 0
 
     def do_GET(self):
+        if self.server.metrics_path is not None and self.path.partition("?")[0] == self.server.metrics_path:
+            self._send_metrics()
+            return
+        if self.server.admin_path is not None and self.path.startswith(self.server.admin_path + "/"):
+            self._send_admin()
+            return
+
+        self._reset_request_info()
+        if self._is_static_request():
+            self._send_static()
+            return
+
+        profile = None
         try:
+            profile = self.server.profiler.begin_request()
             self._make_response()
         except Exception as e:
-            print(f"Exception: {e}")
-            self.send_response(400)
-            self.end_headers()
+            self.server.request_log.error(f"Exception: {e}")
+            self._send_body(400, b"")
+        finally:
+            self.server.profiler.end_request(profile)
+        if self._waiter is None:
+            self._record_metrics()
 
 
 class start_server:
+    # receivers: порт -> {host или None: ресивер}; все порты обслуживаются одним общим пулом потоков
+    def __init__(self, receivers: dict, mode: str = "pool", workers: int = 32, queue_size: int = 64,
+                 backlog: int = 128, socket_timeout: float = 10.0, keep_alive_timeout: float = 5.0,
+                 max_keep_alive_requests: int = 10000, request_log: RequestLog = None,
+                 metrics_path: str = "/metrics", metrics_port: int = None, admin_path: str = "/admin",
+                 static_path: str = "/img/", art_dirs: tuple = ("img",), max_body_bytes: int = 1024 * 1024,
+                 clock: RealClock = None, compress_min_bytes: int = 1024):
+        assert mode in ("single", "pool"), 'Wrong server mode, "single" or "pool" expected'
+        assert receivers, "No receivers to serve"
+        self._receivers = receivers
+        self._mode = mode
+        self._request_log = request_log
+        self._own_request_log = None
+        self._workers = workers
+        self._queue_size = queue_size
+        self._backlog = backlog
+        self._socket_timeout = socket_timeout
+        self._keep_alive_timeout = keep_alive_timeout
+        self._max_keep_alive_requests = max_keep_alive_requests
+        self._metrics_path = metrics_path
+        self._metrics_port = metrics_port
+        self.metrics = YamahaMetrics()
+        self._admin_path = admin_path
+        self.profiler = YamahaProfiler()
+        self._static_path = static_path
+        self._max_body_bytes = max_body_bytes
+        self._compress_min_bytes = compress_min_bytes  # None - ответы не сжимаются
+        self.static = StaticFiles(list(art_dirs)) if static_path is not None else None
+        # те же часы, что переданы ресиверам как whats_a_time
+        self.clock = clock or RealClock()
+        self.scheduler = YamahaScheduler(self.clock)
+        self._pool = None
+        self.long_poll = None
+        self.servers = []
+        self._threads = []
+
+    def _create_server(self, port: int):
+        if self._mode == "single":
+            # единственный поток не может ждать следующего запроса keep-alive соединения:
+            # пока он ждёт, остальные клиенты простаивают - каждый ответ закрывает соединение
+            return TimeoutHTTPServer(("", port), SimpleHTTPRequestHandler,
+                                     backlog=self._backlog,
+                                     socket_timeout=self._socket_timeout,
+                                     keep_alive_timeout=self._keep_alive_timeout,
+                                     max_keep_alive_requests=1)
+
+        return ThreadPoolHTTPServer(("", port), SimpleHTTPRequestHandler,
+                                    backlog=self._backlog,
+                                    socket_timeout=self._socket_timeout,
+                                    keep_alive_timeout=self._keep_alive_timeout,
+                                    max_keep_alive_requests=self._max_keep_alive_requests,
+                                    pool=self._pool)
+
     def __enter__(self):
-        self.httpd = HTTPServer(("", 80), SimpleHTTPRequestHandler)
-        self.current_thread = threading.Thread(target=self.httpd.serve_forever)
-        self.current_thread.start()
+        if self._request_log is None:
+            self._own_request_log = self._request_log = RequestLog().__enter__()
+        self.metrics.set_request_log(self._request_log)
+        if self._mode == "pool":
+            self._pool = WorkerPool(workers=self._workers, queue_size=self._queue_size)
+            # ожидающие долгие опросы не занимают потоки пула
+            self.long_poll = YamahaLongPoll(self._pool.try_submit, clock=self.clock)
+            self.long_poll.start()
+
+        for system in self._systems():
+            system.schedule_transitions(self.scheduler)
+            system.events().set_error_log(self._request_log.error)
+            system.journal().set_error_log(self._request_log.error)
+        self.scheduler.start()
+
+        for port, receivers in self._receivers.items():
+            httpd = self._create_server(port)
+            httpd.request_log = self._request_log
+            httpd.receivers = receivers
+            httpd.metrics = self.metrics
+            httpd.metrics_path = self._metrics_path
+            httpd.admin_path = self._admin_path
+            httpd.profiler = self.profiler
+            httpd.static_path = self._static_path
+            httpd.static = self.static
+            httpd.max_body_bytes = self._max_body_bytes
+            httpd.compress_min_bytes = self._compress_min_bytes
+            httpd.long_poll = self.long_poll
+            httpd.clock = self.clock
+            self.servers.append(httpd)
+
+        if self._metrics_port is not None:
+            httpd = TimeoutHTTPServer(("", self._metrics_port), MetricsRequestHandler,
+                                      socket_timeout=self._socket_timeout)
+            httpd.metrics = self.metrics
+            self.servers.append(httpd)
+
+        for httpd in self.servers:
+            thread = threading.Thread(target=httpd.serve_forever)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def _systems(self):
+        return {system for receivers in self._receivers.values() for system in receivers.values()}
 
     def __exit__(self, type, value, traceback):
-        self.httpd.shutdown()
-        self.current_thread.join()
+        for httpd in self.servers:
+            httpd.shutdown()
+        for thread in self._threads:
+            thread.join()
+        for httpd in self.servers:
+            httpd.server_close()
+        self.scheduler.stop()
+        if self.long_poll is not None:
+            self.long_poll.stop()
+        if self._pool is not None:
+            self._pool.close()
+        self.profiler.stop()
+        # ресиверы продолжают работать после сервера, а журнал запросов может быть закрыт
+        for system in self._systems():
+            system.events().set_error_log(None)
+            system.journal().set_error_log(None)
+        if self._own_request_log is not None:
+            self._own_request_log.__exit__(type, value, traceback)
+
+
+def load_receivers_manifest(filename: str):
+    # {"receivers": [{"config": "...", "port": 80, "host": "...", "template": "...", "overrides": {...}}]}
+    with open(filename, "r") as file:
+        manifest = json.load(file)
+
+    manifest_dir = os.path.dirname(filename)
+    result = []
+    for receiver in manifest["receivers"]:
+        config_file = os.path.join(manifest_dir, receiver["config"])
+        if "template" in receiver:
+            create_config_from_template(config_file, os.path.join(manifest_dir, receiver["template"]),
+                                        receiver.get("overrides", {}))
+        result.append((config_file, receiver.get("port", 80), host_name(receiver.get("host", ""))))
+    return result
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-f", "--filter")
+    parser.add_argument("-m", "--mode", choices=("single", "pool"), default="pool")
+    parser.add_argument("-w", "--workers", type=int, default=32)
+    parser.add_argument("--queue-size", type=int, default=64)
+    parser.add_argument("--backlog", type=int, default=128)
+    parser.add_argument("--socket-timeout", type=float, default=10.0)
+    parser.add_argument("--keep-alive-timeout", type=float, default=5.0)
+    parser.add_argument("--max-keep-alive-requests", type=int, default=10000)
+    parser.add_argument("--compact-json", action="store_true")
+    parser.add_argument("--shuffle-seed", type=int)
+    parser.add_argument("--log-file")
+    parser.add_argument("-c", "--config", default="config.json")
+    parser.add_argument("-p", "--port", type=int, default=80)
+    parser.add_argument("-r", "--receivers", help="JSON manifest with many receivers in one process")
+    parser.add_argument("--metrics-path", default="/metrics", help="empty value disables metrics on the main ports")
+    parser.add_argument("--metrics-port", type=int)
+    parser.add_argument("--admin-path", default="/admin", help="empty value disables admin endpoints")
+    parser.add_argument("--art-path", default="/img/", help="URL prefix for album art, empty value disables it")
+    parser.add_argument("--art-dir", action="append", default=["img"], help="additional album art directory")
+    parser.add_argument("--art-url-base", help="rewrite albumart_url of tracks with albumart_file, "
+                                               "for example http://192.168.1.10/img/")
+    parser.add_argument("--profile-seconds", type=float, help="profile requests for N seconds after start")
+    parser.add_argument("--profile-every", type=int, help="profile every N-th request after start")
+    parser.add_argument("--compress-min-bytes", type=int, default=1024,
+                        help="gzip/deflate JSON responses from this size, negative value disables compression")
+    parser.add_argument("--clock", default="real",
+                        help="real, manual (moved by /admin/clock/advance) or accelerated, for example 60x")
+    parser.add_argument("--clock-start", type=float, help="initial clock time, seconds since epoch")
+    parser.add_argument("-l", "--list-endpoints", action="store_true")
     parsed_args = parser.parse_args(sys.argv[1:])
 
-    with load_yamaha("config.json", parsed_args.filter):
-        with start_server():
+    if parsed_args.list_endpoints:
+        print("\n".join(ROUTES.endpoints()))
+        return
+
+    if parsed_args.receivers is not None:
+        manifest = load_receivers_manifest(parsed_args.receivers)
+    else:
+        manifest = [(parsed_args.config, parsed_args.port, None)]
+
+    # одни часы на все ресиверы процесса
+    clock = parse_clock(parsed_args.clock, parsed_args.clock_start)
+    with RequestLog(parsed_args.filter, parsed_args.log_file) as request_log, contextlib.ExitStack() as stack:
+        receivers = {}
+        for config_file, port, host in manifest:
+            assert host not in receivers.get(port, {}), f"Duplicate receiver for port {port} and host '{host}'"
+            system = stack.enter_context(load_yamaha(config_file, parsed_args.compact_json, parsed_args.shuffle_seed,
+                                                          whats_a_time=clock, art_url_base=parsed_args.art_url_base))
+            receivers.setdefault(port, {})[host] = system
+
+        with start_server(receivers,
+                          request_log=request_log,
+                          mode=parsed_args.mode,
+                          workers=parsed_args.workers,
+                          queue_size=parsed_args.queue_size,
+                          backlog=parsed_args.backlog,
+                          socket_timeout=parsed_args.socket_timeout,
+                          keep_alive_timeout=parsed_args.keep_alive_timeout,
+                          max_keep_alive_requests=parsed_args.max_keep_alive_requests,
+                          metrics_path=parsed_args.metrics_path or None,
+                          metrics_port=parsed_args.metrics_port,
+                          admin_path=parsed_args.admin_path or None,
+                          static_path=parsed_args.art_path or None,
+                          art_dirs=parsed_args.art_dir,
+                          clock=clock,
+                          compress_min_bytes=parsed_args.compress_min_bytes
+                          if parsed_args.compress_min_bytes >= 0 else None) as server:
+            profile = parsed_args.profile_seconds is not None or parsed_args.profile_every is not None
+            if profile:
+                server.profiler.start(seconds=parsed_args.profile_seconds, every=parsed_args.profile_every or 1)
             input("Press 'Enter' to exit\n")
+            if profile:
+                print(server.profiler.report().decode("utf-8"))
+
+
+class ServerTestCase(unittest.TestCase):
+    # эмулятор с копией config.json на свободном порту
+    STATUS_PATH = "/YamahaExtendedControl/v1/main/getStatus"
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._stack = contextlib.ExitStack()
+        self._server = None
+
+    def tearDown(self):
+        self._stack.close()
+        shutil.rmtree(self._dir)
+
+    def _start(self, **options):
+        config_file = os.path.join(self._dir, "config.json")
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"), config_file)
+        request_log = self._stack.enter_context(RequestLog(console=False))
+        self._system = self._stack.enter_context(load_yamaha(config_file))
+        self._server = self._stack.enter_context(start_server({0: {None: self._system}}, request_log=request_log,
+                                                              **options))
+        return self._server
+
+    def _connect(self, timeout: float = 10.0):
+        connection = http.client.HTTPConnection("127.0.0.1", self._server.servers[0].server_address[1],
+                                                timeout=timeout)
+        self._stack.callback(connection.close)
+        return connection
+
+    def _get(self, path: str, headers: dict = None, connection=None):
+        connection = connection or self._connect()
+        connection.request("GET", path, headers=headers or {})
+        response = connection.getresponse()
+        return response, response.read()
+
+
+class TestCompression(ServerTestCase):
+    def _status_size(self):
+        response, body = self._get(self.STATUS_PATH)
+        return len(body)
+
+    def test_body_at_threshold_is_compressed(self):
+        self._start()
+        self._server.servers[0].compress_min_bytes = self._status_size()
+        response, body = self._get(self.STATUS_PATH, {"Accept-Encoding": "gzip"})
+        self.assertEqual("gzip", response.getheader("Content-Encoding"))
+        self.assertEqual("Accept-Encoding", response.getheader("Vary"))
+        self.assertEqual(self._system.status_response("main"), gzip.decompress(body))
+
+    def test_body_below_threshold_is_not_compressed(self):
+        self._start()
+        self._server.servers[0].compress_min_bytes = self._status_size() + 1
+        response, body = self._get(self.STATUS_PATH, {"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertEqual("Accept-Encoding", response.getheader("Vary"))
+        self.assertEqual(self._system.status_response("main"), body)
+
+    def test_compression_disabled(self):
+        self._start(compress_min_bytes=None)
+        response, body = self._get(self.STATUS_PATH, {"Accept-Encoding": "gzip"})
+        self.assertIsNone(response.getheader("Content-Encoding"))
+        self.assertIsNone(response.getheader("Vary"))
+
+    def test_command_response_is_compressed(self):
+        self._start(compress_min_bytes=1)
+        response, body = self._get("/YamahaExtendedControl/v1/main/setVolume?volume=20",
+                                   {"Accept-Encoding": "deflate"})
+        self.assertEqual("deflate", response.getheader("Content-Encoding"))
+        self.assertEqual(self._system.success_response(), zlib.decompress(body))
+
+
+class TestJournalFailure(ServerTestCase):
+    def test_unsaved_command_is_answered_500(self):
+        self._start()
+        volume = self._system.get_zone("main").volume
+        with mock.patch("YamahaJournal.os.fsync", side_effect=OSError("Input/output error")):
+            response, body = self._get(f"/YamahaExtendedControl/v1/main/setVolume?volume={volume + 1}")
+        self.assertEqual(500, response.status)
+        response, body = self._get(f"/YamahaExtendedControl/v1/main/setVolume?volume={volume + 2}")
+        self.assertEqual(200, response.status)
+
+
+class TestConditionalGet(ServerTestCase):
+    def test_not_modified(self):
+        self._start()
+        connection = self._connect()
+        response, body = self._get(self.STATUS_PATH, connection=connection)
+        etag = response.getheader("ETag")
+        self.assertIsNotNone(etag)
+        self.assertEqual("no-cache", response.getheader("Cache-Control"))
+
+        response, body = self._get(self.STATUS_PATH, {"If-None-Match": '"other", ' + etag}, connection)
+        self.assertEqual(304, response.status)
+        self.assertEqual(b"", body)
+        self.assertEqual(etag, response.getheader("ETag"))
+
+    def test_changed_state_is_sent(self):
+        self._start()
+        response, body = self._get(self.STATUS_PATH)
+        etag = response.getheader("ETag")
+        self._get("/YamahaExtendedControl/v1/main/setVolume?volume=" + str(self._system.get_zone("main").volume + 1))
+        response, body = self._get(self.STATUS_PATH, {"If-None-Match": etag})
+        self.assertEqual(200, response.status)
+        self.assertNotEqual(etag, response.getheader("ETag"))
+        self.assertEqual(self._system.status_response("main"), body)
+
+    def test_compressed_etag(self):
+        # у сжатого варианта свой ETag: несжатый ETag не подходит для ответа со сжатием
+        self._start(compress_min_bytes=1)
+        response, body = self._get(self.STATUS_PATH)
+        plain_etag = response.getheader("ETag")
+        response, body = self._get(self.STATUS_PATH, {"Accept-Encoding": "gzip", "If-None-Match": plain_etag})
+        self.assertEqual(200, response.status)
+        gzip_etag = response.getheader("ETag")
+        self.assertNotEqual(plain_etag, gzip_etag)
+        response, body = self._get(self.STATUS_PATH, {"Accept-Encoding": "gzip", "If-None-Match": gzip_etag})
+        self.assertEqual(304, response.status)
+        self.assertIsNone(response.getheader("Content-Encoding"))
+
+
+class TestLongPoll(ServerTestCase):
+    def _version(self):
+        response, body = self._get(self.STATUS_PATH)
+        return response.getheader("X-State-Version")
+
+    def _poll(self, version: str, wait: float, connection=None):
+        start = time.monotonic()
+        response, body = self._get(f"{self.STATUS_PATH}?since={version}&wait={wait}", connection=connection)
+        return response, body, time.monotonic() - start
+
+    def test_wakeup_on_change(self):
+        self._start()
+        version = self._version()
+        volume = self._system.get_zone("main").volume + 1
+        timer = threading.Timer(0.2, lambda: self._get(f"/YamahaExtendedControl/v1/main/setVolume?volume={volume}"))
+        timer.start()
+        self._stack.callback(timer.join)
+        response, body, elapsed = self._poll(version, 10)
+        self.assertEqual(200, response.status)
+        self.assertLess(elapsed, 5)
+        self.assertNotEqual(version, response.getheader("X-State-Version"))
+        self.assertEqual(volume, json.loads(body)["volume"])
+
+    def test_timeout(self):
+        self._start()
+        version = self._version()
+        connection = self._connect()
+        response, body, elapsed = self._poll(version, 0.3, connection)
+        self.assertEqual(200, response.status)
+        self.assertGreaterEqual(elapsed, 0.3)
+        self.assertEqual(version, response.getheader("X-State-Version"))
+        # после ответа на долгий опрос соединение продолжает обслуживать запросы
+        response, body = self._get(self.STATUS_PATH, connection=connection)
+        self.assertEqual(200, response.status)
+
+    def test_outdated_version_is_answered_at_once(self):
+        self._start()
+        version = self._version()
+        self._get("/YamahaExtendedControl/v1/main/setMute?enable=" +
+                  ("false" if self._system.get_zone("main").mute else "true"))
+        response, body, elapsed = self._poll(version, 10)
+        self.assertLess(elapsed, 5)
+        self.assertNotEqual(version, response.getheader("X-State-Version"))
+
+    def test_single_mode_does_not_wait(self):
+        self._start(mode="single")
+        response, body, elapsed = self._poll(self._version(), 10)
+        self.assertEqual(200, response.status)
+        self.assertLess(elapsed, 5)
+
+
+class TestStaticFiles(ServerTestCase):
+    def _start_static(self):
+        art_dir = os.path.join(self._dir, "img")
+        os.mkdir(art_dir)
+        with open(os.path.join(art_dir, "cover.jpg"), "wb") as file:
+            file.write(bytes(range(100)))
+        self._start(art_dirs=[art_dir])
+
+    def test_suffix_range(self):
+        self._start_static()
+        response, body = self._get("/img/cover.jpg", {"Range": "bytes=-10"})
+        self.assertEqual(206, response.status)
+        self.assertEqual("bytes 90-99/100", response.getheader("Content-Range"))
+        self.assertEqual(bytes(range(90, 100)), body)
+
+    def test_unsatisfiable_range(self):
+        self._start_static()
+        response, body = self._get("/img/cover.jpg", {"Range": "bytes=100-"})
+        self.assertEqual(416, response.status)
+        self.assertEqual("bytes */100", response.getheader("Content-Range"))
+
+    def test_traversal(self):
+        self._start_static()
+        for path in ("/img/../config.json", "/img/%2E%2E/config.json", "/img/..%2Fconfig.json"):
+            response, body = self._get(path)
+            self.assertEqual(404, response.status, path)
+
+
+class TestProfiler(ServerTestCase):
+    def test_profile_request(self):
+        self._start()
+        response, body = self._get("/admin/profile/start?memory=true")
+        self.assertTrue(json.loads(body)["active"])
+        self.assertEqual(200, self._get(self.STATUS_PATH)[0].status)
+        response, body = self._get("/admin/profile/stop")
+        status = json.loads(body)
+        self.assertFalse(status["active"])
+        self.assertEqual(1, status["profiled_requests"])
+
+        response, body = self._get("/admin/profile/report?sort=cumulative&limit=200")
+        self.assertEqual(200, response.status)
+        report = body.decode("utf-8")
+        self.assertIn("profiling: active=False, profiled_requests=1", report)
+        self.assertIn("(_make_response)", report)
+        self.assertIn("allocation sites (difference since start)", report)
+
+        # статистика в формате pstats.Stats.dump_stats()
+        response, body = self._get("/admin/profile/dump")
+        functions = {name for filename, line, name in marshal.loads(body)}
+        self.assertIn("_make_response", functions)
+
+
+class TestReceiverHosts(ServerTestCase):
+    def _start_manifest(self):
+        # два ресивера на одном порту, выбираются по Host, и ресивер по умолчанию
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"),
+                    os.path.join(self._dir, "template.json"))
+        manifest_file = os.path.join(self._dir, "receivers.json")
+        with open(manifest_file, "w") as file:
+            json.dump({"receivers": [
+                {"config": "living.json", "host": "Living.Local", "template": "template.json",
+                 "overrides": {"zones_info": {"main": {"volume": 11}}}},
+                {"config": "kitchen.json", "port": 8080, "host": "[::1]", "template": "template.json",
+                 "overrides": {"zones_info": {"main": {"volume": 22}}}},
+                {"config": "default.json", "template": "template.json",
+                 "overrides": {"zones_info": {"main": {"volume": 33}}}}]}, file)
+
+        manifest = load_receivers_manifest(manifest_file)
+        self.assertEqual([(os.path.join(self._dir, "living.json"), 80, "living.local"),
+                          (os.path.join(self._dir, "kitchen.json"), 8080, "::1"),
+                          (os.path.join(self._dir, "default.json"), 80, None)], manifest)
+        request_log = self._stack.enter_context(RequestLog(console=False))
+        receivers = {host: self._stack.enter_context(load_yamaha(config_file)) for config_file, port, host in manifest}
+        self._server = self._stack.enter_context(start_server({0: receivers}, request_log=request_log))
+
+    def _volume(self, host: str):
+        response, body = self._get(self.STATUS_PATH, {"Host": host})
+        self.assertEqual(200, response.status)
+        return json.loads(body)["volume"]
+
+    def test_receiver_is_selected_by_host(self):
+        self._start_manifest()
+        for host in ("living.local", "LIVING.LOCAL:80", "living.local:"):
+            self.assertEqual(11, self._volume(host), host)
+        for host in ("[::1]", "[::1]:8080"):
+            self.assertEqual(22, self._volume(host), host)
+
+    def test_default_receiver(self):
+        self._start_manifest()
+        for host in ("127.0.0.1:8080", "kitchen.local", "", "[::1"):
+            self.assertEqual(33, self._volume(host), host)
 
 
 if __name__ == "__main__":